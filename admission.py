@@ -0,0 +1,187 @@
+
+import os
+import math
+import time
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Route classes in priority order. Each class has a per-client token bucket
+# (requests per second, burst) and the share of the worker's in-flight slots
+# it may use; lower-priority classes are shed first as the worker fills up.
+ROUTE_CLASSES = {
+    'critical': {'rate': 10.0, 'burst': 30, 'shed_at': 1.0},   # saving bills, bill numbers
+    'write': {'rate': 5.0, 'burst': 20, 'shed_at': 0.9},       # catalog edits
+    'read': {'rate': 20.0, 'burst': 60, 'shed_at': 0.8},       # normal reads
+    'heavy': {'rate': 0.5, 'burst': 5, 'shed_at': 0.5},        # backups, exports, bulk saves, large listings
+}
+
+# Bill listings above this many rows count as heavy
+HEAVY_BILL_LIMIT = 200
+
+def classify(method: str, path: str, args) -> Optional[str]:
+    """Route class for an API request; None for requests that are not admission controlled"""
+    if not path.startswith('/api/') or path.startswith('/api/events'):
+        # Pages, static files and long-lived event streams are not admission controlled
+        return None
+    if method == 'OPTIONS':
+        return None
+    if path.startswith('/api/admin/'):
+        # Diagnostics must still reach a saturated worker; they are token-protected instead
+        return None
+    if path in ('/api/bills/render', '/api/bills/bulk'):
+        # Batch print runs only queue a job, but each one is a lot of work; bulk
+        # saves of up to VALIDATION_MAX_BATCH_ROWS bills must not outrank single bills
+        return 'heavy'
+    if path.startswith('/api/bills') and method == 'POST':
+        return 'critical'
+    if path == '/api/database/backup' or path.startswith('/api/export/'):
+        return 'heavy'
+    # /api/statistics and /api/database/test stay 'read': concurrent callers share
+    # one single-flight query, so a shift-start herd costs one query, not one heavy slot each
+    if path == '/api/bills' and args.get('limit', 50, type=int) > HEAVY_BILL_LIMIT:
+        return 'heavy'
+    if method in ('POST', 'PUT', 'PATCH', 'DELETE'):
+        return 'write'
+    return 'read'
+
+class TokenBucket:
+    """Classic token bucket: rate tokens per second, holding at most burst"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take one token; returns 0 on success, else seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+class AdmissionController:
+    """Per-worker rate limiting, concurrency caps and priority load shedding.
+
+    Each (client, route class) pair gets a token bucket; an empty bucket is
+    answered with 429 and a Retry-After telling the client when its next
+    token arrives. In-flight API requests are counted against max_in_flight
+    and every class may only use its shed_at share of it, so as the worker
+    fills up heavy requests are refused first and bill saving last. Heavy
+    requests are additionally capped at heavy_concurrency at a time. Both
+    kinds of overload are answered with 503 immediately instead of queueing.
+    """
+
+    def __init__(self, max_in_flight: int = 32, heavy_concurrency: int = 2,
+                 classes: Dict[str, Dict] = None, max_buckets: int = 10000):
+        self.max_in_flight = max_in_flight
+        self.heavy_concurrency = heavy_concurrency
+        self.classes = classes or load_route_classes()
+        self.max_buckets = max_buckets
+        self.in_flight = {route_class: 0 for route_class in self.classes}
+        self.admitted = {route_class: 0 for route_class in self.classes}
+        self.rate_limited = {route_class: 0 for route_class in self.classes}
+        self.shed = {route_class: 0 for route_class in self.classes}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, client: str, route_class: str) -> TokenBucket:
+        key = (client, route_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._prune_buckets()
+            config = self.classes[route_class]
+            bucket = self._buckets[key] = TokenBucket(config['rate'], config['burst'])
+        return bucket
+
+    def _prune_buckets(self):
+        """Forget buckets that have refilled completely; they behave like new ones"""
+        now = time.monotonic()
+        full = [key for key, bucket in self._buckets.items()
+                if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.burst]
+        for key in full:
+            del self._buckets[key]
+        if len(self._buckets) >= self.max_buckets:
+            self._buckets.clear()
+
+    def admit(self, client: str, route_class: str) -> Optional[Tuple[int, int, str]]:
+        """Admit a request, or return (status, retry_after_seconds, reason) to reject it"""
+        with self._lock:
+            # Shed before touching the bucket so refused requests cost the client no tokens
+            total = sum(self.in_flight.values())
+            if total >= self.max_in_flight * self.classes[route_class]['shed_at']:
+                self.shed[route_class] += 1
+                return 503, 1, f'Server busy, {route_class} requests are being shed'
+            if route_class == 'heavy' and self.in_flight['heavy'] >= self.heavy_concurrency:
+                self.shed[route_class] += 1
+                return 503, 2, 'Too many heavy requests in progress'
+
+            wait = self._bucket(client, route_class).take()
+            if wait > 0:
+                self.rate_limited[route_class] += 1
+                return 429, max(1, math.ceil(wait)), f'Rate limit exceeded for {route_class} requests'
+
+            self.in_flight[route_class] += 1
+            self.admitted[route_class] += 1
+            return None
+
+    def release(self, route_class: str):
+        """Mark an admitted request as finished"""
+        with self._lock:
+            self.in_flight[route_class] -= 1
+
+    def get_info(self) -> Dict:
+        """Admission statistics for this worker"""
+        return {
+            'pid': os.getpid(),
+            'max_in_flight': self.max_in_flight,
+            'heavy_concurrency': self.heavy_concurrency,
+            'in_flight': dict(self.in_flight),
+            'admitted': dict(self.admitted),
+            'rate_limited': dict(self.rate_limited),
+            'shed': dict(self.shed),
+            'tracked_clients': len(self._buckets),
+            'classes': self.classes
+        }
+
+def load_route_classes() -> Dict[str, Dict]:
+    """Route class limits, overridable with RATE_LIMIT_<CLASS>=<rate per second>,<burst>"""
+    classes = {}
+    for route_class, defaults in ROUTE_CLASSES.items():
+        config = dict(defaults)
+        override = os.getenv(f'RATE_LIMIT_{route_class.upper()}')
+        if override:
+            rate, _, burst = override.partition(',')
+            config['rate'] = float(rate)
+            config['burst'] = int(burst) if burst else config['burst']
+        classes[route_class] = config
+    return classes
+
+_controller = None
+_controller_pid = None
+_controller_lock = threading.Lock()
+
+def get_admission_controller() -> AdmissionController:
+    """Return this worker's controller, creating it after fork if needed"""
+    global _controller, _controller_pid
+    pid = os.getpid()
+    if _controller is None or _controller_pid != pid:
+        with _controller_lock:
+            if _controller is None or _controller_pid != pid:
+                _controller = AdmissionController(
+                    max_in_flight=int(os.getenv('ADMISSION_MAX_IN_FLIGHT', 32)),
+                    heavy_concurrency=int(os.getenv('ADMISSION_HEAVY_CONCURRENCY', 2))
+                )
+                _controller_pid = pid
+    return _controller
@@ -261,6 +261,9 @@ async function init() {
                 } else {
                     console.log('initializeGlobalSearch function not available, skipping');
                 }
+
+                // Pick up price edits made on other terminals without a reload
+                subscribeCatalogChanges();
                 
                 if (systemItems.length > 0) {
                     showToast(`✅ System Database Active: ${systemItems.length} system items loaded`, 'success');
@@ -7632,6 +7635,17 @@ function generateBillNumber() {
     if (billNumberInput) {
         billNumberInput.value = billNumber;
     }
+
+    // Replace the provisional number with one from the server sequence when online
+    if (window.flaskDbAPI && window.flaskDbAPI.initialized) {
+        window.flaskDbAPI.allocateBillNumber('outpatient')
+            .then(serverNumber => {
+                if (billNumberInput && serverNumber) {
+                    billNumberInput.value = serverNumber;
+                }
+            })
+            .catch(() => console.warn('Bill number service unavailable, keeping local bill number'));
+    }
 }
 
 function checkForDuplicates(newItem) {
@@ -9227,6 +9241,44 @@ async function refreshGlobalSearchData() {
     console.log('Global search data refreshed');
 }
 
+// Live catalog updates: catalog-change events from /api/events, or polling when
+// the server cannot stream (WSGI answers 503); both fetch only the changed items
+const CATALOG_POLL_INTERVAL = 60000;
+let catalogEventSource = null;
+let catalogRefreshPending = null;
+let catalogRefreshQueued = false;
+
+// One refresh at a time; a change arriving mid-refresh runs one more afterwards
+function refreshCatalogOnChange() {
+    if (catalogRefreshPending) {
+        catalogRefreshQueued = true;
+        return catalogRefreshPending;
+    }
+    catalogRefreshPending = refreshGlobalSearchData()
+        .catch(error => console.error('Error refreshing catalog:', error))
+        .finally(() => {
+            catalogRefreshPending = null;
+            if (catalogRefreshQueued) {
+                catalogRefreshQueued = false;
+                refreshCatalogOnChange();
+            }
+        });
+    return catalogRefreshPending;
+}
+
+function subscribeCatalogChanges() {
+    if (catalogEventSource || !window.dbAPI || typeof window.dbAPI.subscribeEvents !== 'function') {
+        return;
+    }
+
+    catalogEventSource = window.dbAPI.subscribeEvents(() => refreshCatalogOnChange(), ['catalog-change']);
+    setInterval(() => {
+        if (!catalogEventSource || catalogEventSource.readyState === EventSource.CLOSED) {
+            refreshCatalogOnChange();
+        }
+    }, CATALOG_POLL_INTERVAL);
+}
+
 // Hide dropdown when clicking outside
 document.addEventListener('click', function(event) {
     const dropdown = document.getElementById('medicineDropdown');
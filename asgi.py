@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+ASGI Entry Point for Async Serving
+Hospital Billing System
+
+Run with an ASGI server, for example:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers 4
+
+The Flask routes are served unchanged through a WSGI bridge whose calls
+(and therefore all database work) run on a bounded thread pool, while the
+/api/events stream is served natively on the event loop so thousands of
+idle clients cost no threads.
+"""
+
+import os
+import sys
+import json
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Add current directory to Python path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from main import app, create_app
+from event_stream import get_broadcaster, format_event
+
+logger = logging.getLogger(__name__)
+
+class HospitalASGIApp:
+    """ASGI application wrapping the Flask app with a bounded worker pool"""
+
+    def __init__(self, wsgi_app, max_threads: int = 32, heartbeat: float = 15.0):
+        self.wsgi_app = wsgi_app
+        self.max_threads = max_threads
+        self.heartbeat = heartbeat
+        self.executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='asgi-worker')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            if scope['path'] == '/api/events' and scope['method'] == 'GET':
+                await self._event_stream(scope, receive, send)
+            else:
+                await self._call_wsgi(scope, receive, send)
+
+    async def _run(self, func, *args):
+        """Run blocking code (Flask handlers, database calls) on the bounded pool"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    # ------------------------------------------------------------------
+    # Lifespan
+    # ------------------------------------------------------------------
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self._run(create_app)
+                    await send({'type': 'lifespan.startup.complete'})
+                except Exception as e:
+                    logger.error(f"❌ Startup failed: {e}")
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # ------------------------------------------------------------------
+    # WSGI bridge
+    # ------------------------------------------------------------------
+
+    async def _read_body(self, receive) -> Optional[bytes]:
+        """Buffer the request body; None if the client disconnected first"""
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    def _build_environ(self, scope, body: bytes) -> dict:
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for raw_name, raw_value in scope.get('headers', []):
+            name = raw_name.decode('latin-1').upper().replace('-', '_')
+            value = raw_value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name not in ('CONTENT_LENGTH', 'TRANSFER_ENCODING'):
+                key = f'HTTP_{name}'
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        # The body is fully buffered, so its length is always known
+        environ['CONTENT_LENGTH'] = str(len(body))
+        return environ
+
+    def _start_wsgi(self, environ):
+        """Call the Flask app; returns (status, headers, body iterator)"""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+        body = self.wsgi_app(environ, start_response)
+        return response['status'], response['headers'], body
+
+    async def _call_wsgi(self, scope, receive, send):
+        body = await self._read_body(receive)
+        if body is None:
+            return
+
+        status, headers, iterable = await self._run(self._start_wsgi, self._build_environ(scope, body))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+
+        # Pull chunks one at a time on the pool so streamed responses stay streamed
+        iterator = iter(iterable)
+        try:
+            while True:
+                chunk = await self._run(next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if hasattr(iterable, 'close'):
+                await self._run(iterable.close)
+
+    # ------------------------------------------------------------------
+    # Native event stream
+    # ------------------------------------------------------------------
+
+    async def _send_json(self, send, status: int, payload: dict):
+        body = json.dumps(payload).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _event_stream(self, scope, receive, send):
+        query = dict(
+            pair.split('=', 1) for pair in scope.get('query_string', b'').decode('latin-1').split('&') if '=' in pair
+        )
+        types = query.get('types')
+        event_types = [t.strip() for t in types.replace('%2C', ',').split(',') if t.strip()] if types else None
+
+        broadcaster = get_broadcaster()
+        subscriber = broadcaster.subscribe(event_types, loop=asyncio.get_running_loop())
+        if subscriber is None:
+            await self._send_json(send, 503, {
+                'success': False,
+                'error': 'Too many event stream clients',
+                'message': 'Event stream is at capacity, retry later'
+            })
+            return
+
+        async def wait_for_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        disconnect = asyncio.ensure_future(wait_for_disconnect())
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]})
+            await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+
+            while not subscriber.dropped and not disconnect.done():
+                get_event = asyncio.ensure_future(subscriber.queue.get())
+                done, _ = await asyncio.wait({get_event, disconnect}, timeout=self.heartbeat,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if get_event in done:
+                    text = format_event(get_event.result())
+                else:
+                    get_event.cancel()
+                    if disconnect.done():
+                        break
+                    # Comment line keeps proxies and the browser from timing out
+                    text = ': keepalive\n\n'
+                await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+        finally:
+            disconnect.cancel()
+            broadcaster.unsubscribe(subscriber)
+
+application = HospitalASGIApp(
+    app,
+    max_threads=int(os.getenv('ASGI_DB_THREADS', 32)),
+)
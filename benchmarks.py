@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Performance Benchmarks
+Hospital Billing System
+
+Each benchmark runs against a throwaway SQLite file in a temporary
+directory, so it never touches the real databases.
+"""
+
+import os
+import sys
+import time
+import logging
+import tempfile
+
+# Configure logging
+logging.basicConfig(
+    level=logging.WARNING,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def best_of(func, repeat=3):
+    """Run func repeat times and return the fastest wall time in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def report(label, seconds, rows=None):
+    """Print one benchmark line"""
+    line = f"  {label:<45} {seconds * 1000:10.2f} ms"
+    if rows:
+        line += f"   {rows / seconds:12,.0f} rows/s"
+    print(line)
+
+def make_items(count):
+    """Synthetic catalog rows spread over the standard categories"""
+    categories = ['Registration', 'Dr. Fee', 'Lab', 'Medicine', 'X-ray', 'OR', 'O2, ISO']
+    return [{
+        'category': categories[i % len(categories)],
+        'name': f'Item {i:06d}',
+        'type': 'Tablet',
+        'strength': '500mg',
+        'price': float(i % 500),
+        'description': 'Benchmark item'
+    } for i in range(count)]
+
+def bench_catalog(count=20000):
+    """ORM object paths vs Core bulk insert and projected reads (SQLAlchemy backend)"""
+    from sqlalchemy import create_engine
+    from mysql_database import MySQLHospitalDB, Item
+
+    items = make_items(count)
+    with tempfile.TemporaryDirectory() as tmp:
+        orm_db = MySQLHospitalDB(create_engine(f"sqlite:///{os.path.join(tmp, 'orm.db')}"))
+        bulk_db = MySQLHospitalDB(create_engine(f"sqlite:///{os.path.join(tmp, 'bulk.db')}"))
+
+        print(f"Catalog benchmark ({count} items)")
+
+        def orm_insert():
+            with orm_db.get_session() as session:
+                for item in items:
+                    session.add(Item(**item))
+        report('insert: ORM objects, one by one', best_of(orm_insert, 1), count)
+        report('insert: Core bulk executemany', best_of(lambda: bulk_db.bulk_add_items(items), 1), count)
+
+        def orm_read():
+            with orm_db.get_session(read_only=True) as session:
+                return [item.to_dict() for item in session.query(Item).order_by(Item.category, Item.name).all()]
+        report('read all: ORM instances + to_dict()', best_of(orm_read), count)
+        report('read all: projected rows -> dicts', best_of(bulk_db.get_all_items), count)
+
+def bench_catalog_memory(count=100000):
+    """Per-worker memory and lookup cost: list of item dicts vs CatalogStore columns"""
+    import tracemalloc
+    from flask_database import HospitalDB
+    from catalog_store import CatalogStore
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = HospitalDB(os.path.join(tmp, 'catalog.db'))
+        database.bulk_add_items(make_items(count))
+        version = database.get_catalog_version()
+
+        print(f"Catalog memory benchmark ({database.get_item_count()} items)")
+        tracemalloc.start()
+        items = database.get_all_items()
+        dict_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        del items
+
+        # Fetch and build under tracing, so strings the store keeps from the rows are counted
+        tracemalloc.start()
+        store = CatalogStore(database.get_all_items(), version)
+        store_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        items = database.get_all_items()
+        print(f"  {'list of dicts (get_all_items)':<45} {dict_bytes / 1024 / 1024:10.2f} MB"
+              f"   {dict_bytes / len(items):8.0f} B/item")
+        print(f"  {'CatalogStore (traced)':<45} {store_bytes / 1024 / 1024:10.2f} MB"
+              f"   {store_bytes / len(store):8.0f} B/item")
+        print(f"  {'CatalogStore (memory_bytes estimate)':<45} {store.memory_bytes() / 1024 / 1024:10.2f} MB")
+
+        ids = [item['id'] for item in items[::max(1, len(items) // 1000)]]
+        report('id lookup: scan list of dicts', best_of(
+            lambda: [next(item for item in items if item['id'] == item_id) for item_id in ids[:50]]), 50)
+        report('id lookup: CatalogStore.get', best_of(lambda: [store.get(item_id) for item_id in ids]), len(ids))
+        lab = len(store.category_rows('Lab'))
+        report('category listing: filter dicts', best_of(
+            lambda: [item for item in items if item['category'] == 'Lab']), lab)
+        report('category listing: CatalogStore rows -> dicts', best_of(
+            lambda: store.to_dicts(store.category_rows('Lab'))), lab)
+        report('name prefix search (50 rows)', best_of(lambda: store.search_names('item 0012', 50)))
+
+def bench_catalog_snapshot(count=100000):
+    """Shared mapped snapshot: publish and map cost, private vs shared memory, lookups, change checks"""
+    import tracemalloc
+    from flask_database import HospitalDB
+    from catalog_store import CatalogCache, CatalogStore, open_snapshot
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = HospitalDB(os.path.join(tmp, 'catalog.db'))
+        database.bulk_add_items(make_items(count))
+        path = os.path.join(tmp, 'catalog_snapshot.bin')
+        cache = CatalogCache(snapshot_path=path)
+
+        print(f"Catalog snapshot benchmark ({database.get_item_count()} items)")
+        def republish():
+            if os.path.exists(path):
+                os.remove(path)
+            cache.publish(database)
+
+        report('publish (query + build + write + swap)', best_of(republish))
+        report('map snapshot (per worker, per change)', best_of(lambda: open_snapshot(path)))
+
+        tracemalloc.start()
+        private = CatalogStore(database.get_all_items(), database.get_catalog_version())
+        private_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        tracemalloc.start()
+        mapped = open_snapshot(path)
+        mapped_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"  {'private CatalogStore per worker (traced)':<45} {private_bytes / 1024 / 1024:10.2f} MB")
+        print(f"  {'mapped snapshot per worker (traced)':<45} {mapped_bytes / 1024 / 1024:10.2f} MB")
+        print(f"  {'snapshot file, shared by all workers':<45} {mapped.shared_bytes / 1024 / 1024:10.2f} MB")
+
+        ids = [private.ids[row] for row in range(0, len(private), max(1, len(private) // 1000))]
+        report('id lookup: private store', best_of(lambda: [private.get(item_id) for item_id in ids]), len(ids))
+        report('id lookup: mapped store', best_of(lambda: [mapped.get(item_id) for item_id in ids]), len(ids))
+        lab = len(mapped.category_rows('Lab'))
+        report('category listing: private store', best_of(lambda: private.to_dicts(private.category_rows('Lab'))), lab)
+        report('category listing: mapped store', best_of(lambda: mapped.to_dicts(mapped.category_rows('Lab'))), lab)
+        report('name prefix search: mapped store', best_of(lambda: mapped.search_names('item 0012', 50)))
+
+        cache.get(database)
+        report('change check: catalog version query', best_of(lambda: [database.get_catalog_version()
+                                                                        for _ in range(1000)]), 1000)
+        report('change check: snapshot stat (cache.get)', best_of(lambda: [cache.get(database)
+                                                                           for _ in range(1000)]), 1000)
+
+def _allocate_in_worker(args):
+    """Worker process body for bench_bill_numbers: its own handle and allocator"""
+    db_path, block_size, count = args
+    from flask_database import HospitalDB
+    from bill_numbers import BillNumberAllocator
+    allocator = BillNumberAllocator(HospitalDB(db_path), block_size=block_size)
+    return allocator.allocate_many('outpatient', count)
+
+def bench_bill_numbers(count=20000, workers=4):
+    """Bill number allocation throughput across concurrent worker processes"""
+    import multiprocessing
+    from flask_database import HospitalDB
+
+    print(f"Bill number benchmark ({count} numbers, {workers} worker processes)")
+    with tempfile.TemporaryDirectory() as tmp:
+        for block_size in (1, 10, 50, 500):
+            db_path = os.path.join(tmp, f'numbers_{block_size}.db')
+            HospitalDB(db_path)
+            with multiprocessing.Pool(workers) as pool:
+                start = time.perf_counter()
+                results = pool.map(_allocate_in_worker, [(db_path, block_size, count // workers)] * workers)
+                elapsed = time.perf_counter() - start
+            numbers = [number for result in results for number in result]
+            assert len(set(numbers)) == len(numbers), 'duplicate bill numbers allocated'
+            report(f'block size {block_size:>3} ({count // block_size} leases)', elapsed, len(numbers))
+
+def bench_metering(count=500):
+    """Pricing O2/ISO sessions one call each vs one batch call (loop and numpy)"""
+    from metering import price_sessions, np
+
+    rates = {
+        'o2': {'item_id': 1, 'name': 'O2 Service', 'type': 'Oxygen Therapy', 'unit': 'L', 'unit_price': 65.0},
+        'iso': {'item_id': 2, 'name': 'ISO Service', 'type': 'Isoflurane Therapy', 'unit': 'min', 'unit_price': 30.0},
+    }
+    base = 1767225600  # 2026-01-01T00:00:00Z
+    sessions = [{
+        'service': 'o2' if i % 2 else 'iso',
+        'start': base + i * 3600,
+        'end': base + i * 3600 + 600 + (i * 37) % 3000,
+        'flow_rate': 1 + i % 5
+    } for i in range(count)]
+
+    print(f"Metering benchmark ({count} sessions)")
+    report('one price_sessions() call per session',
+           best_of(lambda: [price_sessions([session], rates, vectorized=False) for session in sessions]), count)
+    loop = price_sessions(sessions, rates, vectorized=False)
+    report('one batch call, plain loop', best_of(lambda: price_sessions(sessions, rates, vectorized=False)), count)
+    if np is not None:
+        vectorized = price_sessions(sessions, rates, vectorized=True)
+        assert [s['charge'] for s in vectorized['sessions']] == [s['charge'] for s in loop['sessions']]
+        report('one batch call, numpy', best_of(lambda: price_sessions(sessions, rates, vectorized=True)), count)
+    else:
+        print('  numpy not installed, vectorized path skipped')
+
+def bench_patients(count=100000, patients=5000):
+    """Patient history: scanning bills by OPD text vs registry + (patient_id, created_at) index"""
+    import sqlite3
+    from flask_database import HospitalDB
+
+    bills = [{
+        'bill_number': f'BENCH-{i:07d}',
+        'patient_name': f'Patient {i % patients}',
+        'opd_number': f'OPD{i % patients:06d}',
+        'total_amount': 100.0,
+        'items': []
+    } for i in range(count)]
+    lookups = [f'OPD{(i * 7919) % patients:06d}' for i in range(200)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = HospitalDB(os.path.join(tmp, 'patients.db'))
+        database.bulk_save_bills(bills)
+        conn = sqlite3.connect(database.db_path)
+
+        print(f"Patient lookup benchmark ({count} bills, {patients} patients, {len(lookups)} lookups)")
+
+        def scan():
+            for opd in lookups:
+                conn.execute('SELECT id FROM bills WHERE opd_number = ? ORDER BY created_at DESC LIMIT 50',
+                             (opd,)).fetchall()
+        report('bills.opd_number (unindexed text scan)', best_of(scan), len(lookups))
+
+        def registry():
+            for opd in lookups:
+                database.get_patient_bills(database.get_patient(opd)['id'], 50)
+        report('registry lookup + patient_id index', best_of(registry), len(lookups))
+        report('prefix search (OPD00*, 20 rows)',
+               best_of(lambda: [database.find_patients('OPD00', 20) for _ in lookups]), len(lookups))
+        conn.close()
+
+def bench_json(count=20000, bills=1000):
+    """API response encoding: Flask's default provider vs FastJSONProvider (stdlib and orjson)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(SQLITE_DB_PATH=os.path.join(tmp, 'api.db'), ADMISSION_ENABLED='False',
+                          MAINTENANCE_ENABLED='False', CATALOG_SNAPSHOT_PATH=os.path.join(tmp, 'catalog.bin'))
+        from flask.json.provider import DefaultJSONProvider
+        from fast_json import FastJSONProvider, orjson
+        from main import app, create_app, db
+
+        create_app()
+        db.bulk_add_items(make_items(count))
+        line_items = [{'category': 'Lab', 'name': f'Test {i}', 'type': 'Lab', 'strength': '', 'quantity': 1,
+                       'price': 150.0, 'totalPrice': 150.0, 'description': 'Benchmark line'} for i in range(8)]
+        db.bulk_save_bills([{'bill_number': f'JSON-{i:06d}', 'patient_name': f'Patient {i}',
+                             'opd_number': f'OPD{i:06d}', 'total_amount': 1200.0, 'items': line_items}
+                            for i in range(bills)])
+        client = app.test_client()
+        items = db.get_all_items()
+        bill_page = db.get_bills(bills)
+
+        default = DefaultJSONProvider(app)
+        fast = FastJSONProvider(app)
+        providers = [('Flask default (stdlib, sorted)', default)]
+        for encoder in ['stdlib'] + (['orjson'] if orjson is not None else []):
+            for sort_keys in (True, False):
+                provider = FastJSONProvider(app)
+                provider.encoder, provider.sort_keys = encoder, sort_keys
+                providers.append((f"fast {encoder}{', sorted' if sort_keys else ''}", provider))
+
+        print(f"JSON benchmark ({len(items)} items, {len(bill_page)} bills per page)")
+        for label, provider in providers:
+            report(f'encode items: {label}', best_of(lambda: provider.response({'items': items}).get_data()),
+                   len(items))
+        for label, provider in providers:
+            report(f'encode bills: {label}', best_of(lambda: provider.response({'bills': bill_page}).get_data()),
+                   len(bill_page))
+
+        # Whole requests: the stdlib, sorted and buffered variant produces what jsonify used to
+        variants = []
+        for label, encoder, sort_keys, stream_min_rows in (
+                ('stdlib, sorted, buffered', 'stdlib', True, sys.maxsize),
+                ('orjson, sorted, streamed', 'orjson', True, 0),
+                ('orjson, streamed', 'orjson', False, 0)):
+            if encoder == 'orjson' and orjson is None:
+                continue
+            provider = FastJSONProvider(app)
+            provider.encoder, provider.sort_keys, provider.stream_min_rows = encoder, sort_keys, stream_min_rows
+            variants.append((label, provider))
+        for path, rows in (('/api/items', len(items)), (f'/api/bills?limit={bills}', len(bill_page))):
+            for label, provider in variants:
+                app.json = provider
+                report(f"GET {path.split('?')[0]}: {label}", best_of(lambda: client.get(path).get_data()), rows)
+        app.json = fast
+
+def bench_validation(lines=20, batch=1000):
+    """Per-request payload validation cost: compiled bill/item validators"""
+    from validation import BILL_VALIDATOR, ITEM_VALIDATOR
+
+    line = {'id': 'checkbox_lab_1', 'category': 'Lab', 'name': 'CBC', 'type': 'Test', 'strength': '',
+            'quantity': 1, 'price': 150, 'totalPrice': 150, 'sourceCheckbox': 'lab'}
+    bill = {'bill_number': 'BILL-BENCH-1', 'patient_name': 'Patient', 'opd_number': 'OPD000001',
+            'total_amount': '3000', 'items': [dict(line) for _ in range(lines)]}
+    items = make_items(batch)
+    requests = 1000
+
+    def hand_checks():
+        # What the endpoints did before: required keys and a float cast, items unchecked
+        for _ in range(requests):
+            missing = [field for field in ('bill_number', 'total_amount', 'items') if field not in bill]
+            if missing or float(bill['total_amount']) < 0:
+                raise ValueError(missing)
+
+    print(f"Validation benchmark ({lines} lines per bill, {batch} items per batch)")
+    report('bill: hand-written top-level checks', best_of(hand_checks), requests)
+    report('bill: compiled schema incl. line items', best_of(
+        lambda: [BILL_VALIDATOR.validate(bill) for _ in range(requests)]), requests)
+    print(f"  {'per bill request':<45} {best_of(lambda: BILL_VALIDATOR.validate(bill)) * 1e6:10.1f} us")
+    report('item: compiled schema', best_of(
+        lambda: [ITEM_VALIDATOR.validate(items[0]) for _ in range(requests)]), requests)
+    report(f'item batch ({batch} rows): compiled schema', best_of(
+        lambda: ITEM_VALIDATOR.validate_many(items, 'items')), batch)
+
+def bench_profiling(count=20000):
+    """Overhead of the admin profilers on a fixed workload: none, stack sampling, cProfile"""
+    import cProfile
+    import profiling
+    from catalog_store import CatalogStore
+
+    items = [dict(item, id=index + 1, created_at=None, updated_at=None)
+             for index, item in enumerate(make_items(count))]
+
+    def workload():
+        store = CatalogStore(items, 1)
+        store.to_dicts()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['PROFILE_DIR'] = tmp
+        print(f"Profiling overhead benchmark (catalog build + serialize, {count} items)")
+        baseline = best_of(workload, repeat=5)
+        report('no profiler', baseline, count)
+        for interval_ms in (10, 1):
+            sampler = profiling.StackSampler()
+            sampler.start({'seconds': 3, 'interval_ms': interval_ms})
+            seconds = best_of(workload, repeat=5)
+            report(f'stack sampling every {interval_ms} ms ({(seconds / baseline - 1) * 100:+.0f}%)', seconds, count)
+            while sampler.profile is not None:
+                time.sleep(0.1)
+
+        def profiled():
+            profiler = cProfile.Profile()
+            profiler.enable()
+            workload()
+            profiler.disable()
+
+        seconds = best_of(profiled, repeat=5)
+        report(f'cProfile (request profiling, {(seconds / baseline - 1) * 100:+.0f}%)', seconds, count)
+
+BENCHMARKS = {
+    'catalog': bench_catalog,
+    'catalog_memory': bench_catalog_memory,
+    'catalog_snapshot': bench_catalog_snapshot,
+    'bill_numbers': bench_bill_numbers,
+    'metering': bench_metering,
+    'patients': bench_patients,
+    'json': bench_json,
+    'validation': bench_validation,
+    'profiling': bench_profiling,
+}
+
+def main():
+    """Main function for running benchmarks"""
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Usage: python benchmarks.py <benchmark> [size]")
+        print("Benchmarks:")
+        for name, func in BENCHMARKS.items():
+            print(f"  {name:<14} - {func.__doc__}")
+        sys.exit(1)
+
+    func = BENCHMARKS[sys.argv[1]]
+    if len(sys.argv) > 2:
+        func(int(sys.argv[2]))
+    else:
+        func()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+
+import os
+import zlib
+import sqlite3
+import logging
+import fast_json
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import quote
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bills from the current month and this many months before it stay in the hot table
+DEFAULT_HOT_MONTHS = 3
+
+# Rows copied per fetchmany/executemany step while archiving a month
+ARCHIVE_COPY_BATCH = 1000
+
+def get_hot_months() -> int:
+    return int(os.getenv('BILL_HOT_MONTHS', DEFAULT_HOT_MONTHS))
+
+def get_archive_dir() -> str:
+    return os.getenv('BILL_ARCHIVE_DIR', 'archives')
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+def next_month(value: datetime) -> datetime:
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+def month_key(value: datetime) -> str:
+    """Partition key of the month containing value: 'YYYY-MM'"""
+    return f'{value.year:04d}-{value.month:02d}'
+
+def parse_month(key: str) -> datetime:
+    return datetime.strptime(key, '%Y-%m')
+
+def archive_cutoff(hot_months: Optional[int] = None, now: Optional[datetime] = None) -> datetime:
+    """First instant of the oldest hot month; every bill before it may be archived"""
+    hot_months = get_hot_months() if hot_months is None else hot_months
+    start = month_start(now or datetime.now())
+    for _ in range(hot_months):
+        start = month_start(datetime.fromordinal(start.toordinal() - 1))
+    return start
+
+def archives_in_range(archives: Iterable[Dict], since: Optional[datetime] = None,
+                      until: Optional[datetime] = None) -> List[Dict]:
+    """Catalog entries whose month overlaps [since, until), oldest first"""
+    selected = []
+    for archive in archives:
+        start = parse_month(archive['month'])
+        if until is not None and start >= until:
+            continue
+        if since is not None and next_month(start) <= since:
+            continue
+        selected.append(archive)
+    return sorted(selected, key=lambda archive: archive['month'])
+
+def compress_items(items_json) -> bytes:
+    """Archived bills keep their line items as zlib-compressed JSON"""
+    if items_json is None:
+        return None
+    if not isinstance(items_json, str):
+        items_json = fast_json.dumps(items_json)
+    return zlib.compress(items_json.encode('utf-8'), 9)
+
+def decompress_items(value) -> List[Dict]:
+    """Line items from a hot (JSON text) or archived (compressed) items_json value"""
+    if not value:
+        return []
+    if isinstance(value, bytes):
+        value = zlib.decompress(value).decode('utf-8')
+    return fast_json.loads(value)
+
+# ---------------------------------------------------------------------------
+# SQLite archive files (raw sqlite3 backend)
+# ---------------------------------------------------------------------------
+
+ARCHIVE_SCHEMA = (
+    '''
+    CREATE TABLE bills (
+        id INTEGER PRIMARY KEY,
+        bill_number TEXT NOT NULL,
+        patient_name TEXT,
+        opd_number TEXT,
+        total_amount REAL NOT NULL,
+        items_json BLOB,
+        created_at DATETIME,
+        patient_id INTEGER
+    )
+    ''',
+    'CREATE INDEX idx_bills_created_at ON bills(created_at)',
+    'CREATE INDEX idx_bills_patient_created ON bills(patient_id, created_at)',
+)
+
+ARCHIVE_COLUMNS = 'id, bill_number, patient_name, opd_number, total_amount, items_json, created_at, patient_id'
+
+def archive_path(archive_dir: str, month: str) -> str:
+    return os.path.join(archive_dir, f"bills_{month.replace('-', '_')}.db")
+
+def open_archive(path: str) -> sqlite3.Connection:
+    """Read-only connection to a closed month; immutable skips file locking entirely"""
+    return sqlite3.connect(f'file:{quote(os.path.abspath(path))}?mode=ro&immutable=1', uri=True)
+
+def write_archive(path: str, rows: Iterable[tuple], previous: Optional[str] = None) -> Dict:
+    """Write bills into a new read-only archive file at path.
+
+    rows are ARCHIVE_COLUMNS tuples from the hot table. When the month was
+    archived before, previous is that file and its rows are carried over.
+    The file is built under a temporary name, vacuumed, then renamed into
+    place, so a crash never leaves a half-written archive behind.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    partial_path = path + '.partial'
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+
+    summary = {'bill_count': 0, 'total_amount': 0.0, 'first_id': None, 'last_id': None}
+    conn = sqlite3.connect(partial_path)
+    try:
+        for statement in ARCHIVE_SCHEMA:
+            conn.execute(statement)
+        if previous:
+            conn.execute('ATTACH DATABASE ? AS previous', (f'file:{quote(os.path.abspath(previous))}?mode=ro',))
+            conn.execute(f'INSERT INTO bills ({ARCHIVE_COLUMNS}) SELECT {ARCHIVE_COLUMNS} FROM previous.bills')
+            conn.commit()
+            conn.execute('DETACH DATABASE previous')
+
+        batch = []
+        for row in rows:
+            batch.append(row[:5] + (compress_items(row[5]),) + tuple(row[6:]))
+            if len(batch) >= ARCHIVE_COPY_BATCH:
+                conn.executemany(f'INSERT INTO bills ({ARCHIVE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', batch)
+                batch = []
+        if batch:
+            conn.executemany(f'INSERT INTO bills ({ARCHIVE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', batch)
+        conn.commit()
+
+        count, total, first_id, last_id = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(total_amount), 0), MIN(id), MAX(id) FROM bills').fetchone()
+        summary.update({'bill_count': count, 'total_amount': total, 'first_id': first_id, 'last_id': last_id})
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+
+    os.replace(partial_path, path)
+    os.chmod(path, 0o444)
+    summary['bytes'] = os.path.getsize(path)
+    return summary
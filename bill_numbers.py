@@ -0,0 +1,93 @@
+
+import os
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List
+from database_backend import db
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Number format per department; {seq} is the sequence value, {year}/{month}/{day} the allocation date
+DEFAULT_FORMATS = {
+    'outpatient': 'BILL-{year}-{seq:06d}',
+    'inpatient': 'IP-{year}-{seq:06d}'
+}
+
+class BillNumberAllocator:
+    """Hands out unique bill numbers from durable per-department sequences.
+
+    Each worker leases a block of block_size values with a single database
+    transaction and then allocates from memory, so the database is touched
+    once per block rather than once per bill. Values left in a block when a
+    worker exits are skipped: numbers are unique and increasing per worker,
+    but not gap-free.
+    """
+
+    def __init__(self, database, block_size: int = 50, formats: Dict[str, str] = None):
+        self.database = database
+        self.block_size = block_size
+        self.formats = formats or get_department_formats()
+        self.blocks = {}
+        self.leases = 0
+        self.allocated = 0
+        self._locks = {department: threading.Lock() for department in self.formats}
+
+    def _next_value(self, department: str) -> int:
+        with self._locks[department]:
+            block = self.blocks.get(department)
+            if block is None or block[0] >= block[1]:
+                first = self.database.reserve_bill_numbers(department, self.block_size)
+                block = self.blocks[department] = [first, first + self.block_size]
+                self.leases += 1
+            value = block[0]
+            block[0] += 1
+            self.allocated += 1
+            return value
+
+    def allocate(self, department: str = 'outpatient') -> str:
+        """Allocate the next bill number for a department"""
+        if department not in self.formats:
+            raise ValueError(f"Unknown department '{department}' (expected one of: {', '.join(self.formats)})")
+        value = self._next_value(department)
+        now = datetime.now()
+        return self.formats[department].format(seq=value, year=now.year, month=now.month, day=now.day)
+
+    def allocate_many(self, department: str, count: int) -> List[str]:
+        """Allocate count bill numbers for a department"""
+        return [self.allocate(department) for _ in range(count)]
+
+    def get_info(self) -> Dict:
+        """Allocator statistics for this worker"""
+        return {
+            'pid': os.getpid(),
+            'block_size': self.block_size,
+            'formats': self.formats,
+            'leases': self.leases,
+            'allocated': self.allocated,
+            'remaining_in_block': {department: block[1] - block[0] for department, block in self.blocks.items()}
+        }
+
+def get_department_formats() -> Dict[str, str]:
+    """Department formats, overridable with BILL_NUMBER_FORMAT_<DEPARTMENT>"""
+    return {
+        department: os.getenv(f'BILL_NUMBER_FORMAT_{department.upper()}', default)
+        for department, default in DEFAULT_FORMATS.items()
+    }
+
+_allocator = None
+_allocator_pid = None
+_allocator_lock = threading.Lock()
+
+def get_allocator() -> BillNumberAllocator:
+    """Return this worker's allocator, creating it after fork if needed"""
+    global _allocator, _allocator_pid
+    pid = os.getpid()
+    if _allocator is None or _allocator_pid != pid:
+        with _allocator_lock:
+            if _allocator is None or _allocator_pid != pid:
+                _allocator = BillNumberAllocator(db, block_size=int(os.getenv('BILL_NUMBER_BLOCK_SIZE', 50)))
+                _allocator_pid = pid
+    return _allocator
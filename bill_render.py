@@ -0,0 +1,428 @@
+
+import os
+import json
+import zlib
+import hashlib
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_NAME = 'bill_print.html'
+HOSPITAL_NAME = os.getenv('HOSPITAL_NAME', 'Hospital Billing System')
+CURRENCY_SYMBOL = '৳'
+
+# Content-Type per format (complete header values, charset included)
+RENDER_FORMATS = {
+    'html': 'text/html; charset=utf-8',
+    'pdf': 'application/pdf',
+}
+
+# ---------------------------------------------------------------------------
+# Bill view model
+# ---------------------------------------------------------------------------
+
+def bill_view(bill: Dict) -> Dict:
+    """Template-ready bill: items grouped by category in bill order, with totals"""
+    groups = OrderedDict()
+    total = 0.0
+    for item in bill.get('items') or []:
+        quantity = item.get('quantity') or 1
+        price = float(item.get('price') or 0)
+        item_total = float(item.get('totalPrice', item.get('total_price', price * quantity)) or 0)
+        total += item_total
+        name = item.get('name') or ''
+        groups.setdefault(item.get('category') or 'Other', []).append({
+            'description': f"{name} ({item['strength']})" if item.get('strength') else name,
+            'type': item.get('type') or '',
+            'quantity': quantity,
+            'total': item_total
+        })
+    created_at = str(bill.get('created_at') or '')
+    return {
+        'id': bill.get('id'),
+        'bill_number': bill.get('bill_number') or '',
+        'patient_name': bill.get('patient_name') or 'Not specified',
+        'opd_number': bill.get('opd_number') or 'Not specified',
+        'bill_date': created_at[:10],
+        'groups': [{'category': category, 'lines': lines} for category, lines in groups.items()],
+        'total': float(bill['total_amount']) if bill.get('total_amount') is not None else total
+    }
+
+# ---------------------------------------------------------------------------
+# HTML through a compiled, per-process Jinja template
+# ---------------------------------------------------------------------------
+
+_environment = None
+_environment_pid = None
+_template_version = None
+_environment_lock = threading.Lock()
+
+def _load_environment():
+    """Compile the print template once per process; BILL_TEMPLATE_CACHE_DIR shares bytecode across workers"""
+    global _environment, _environment_pid, _template_version
+    pid = os.getpid()
+    if _environment is None or _environment_pid != pid:
+        with _environment_lock:
+            if _environment is None or _environment_pid != pid:
+                cache_dir = os.getenv('BILL_TEMPLATE_CACHE_DIR')
+                if cache_dir:
+                    os.makedirs(cache_dir, exist_ok=True)
+                environment = Environment(
+                    loader=FileSystemLoader(TEMPLATE_DIR),
+                    autoescape=select_autoescape(['html']),
+                    auto_reload=False,
+                    bytecode_cache=FileSystemBytecodeCache(cache_dir) if cache_dir else None
+                )
+                environment.get_template(TEMPLATE_NAME)
+                with open(os.path.join(TEMPLATE_DIR, TEMPLATE_NAME), 'rb') as f:
+                    _template_version = hashlib.sha1(f.read()).hexdigest()[:12]
+                _environment = environment
+                _environment_pid = pid
+    return _environment
+
+def template_version() -> str:
+    """Short hash of the print template; part of every cached render's key"""
+    _load_environment()
+    return _template_version
+
+def iter_html(bills: Iterable[Dict]) -> Iterator[str]:
+    """Render bills into one printable document, one page per bill, as it is generated"""
+    template = _load_environment().get_template(TEMPLATE_NAME)
+    return template.generate(bills=(bill_view(bill) for bill in bills),
+                             hospital_name=HOSPITAL_NAME, currency=CURRENCY_SYMBOL)
+
+def render_html(bill: Dict) -> bytes:
+    return ''.join(iter_html([bill])).encode('utf-8')
+
+# ---------------------------------------------------------------------------
+# PDF with the standard Helvetica fonts, no external dependencies
+# ---------------------------------------------------------------------------
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 40
+# Helvetica advance widths (1/1000 em) for the characters that appear in amounts
+_AMOUNT_WIDTHS = {'.': 278, ',': 278, ' ': 278, 'T': 611, 'k': 500, '-': 333}
+
+def _pdf_text(value) -> str:
+    """Escape text for a PDF string in WinAnsi; characters outside it become '?'"""
+    text = str(value).replace(CURRENCY_SYMBOL, 'Tk ')
+    text = text.encode('cp1252', errors='replace').decode('latin-1')
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def _amount_width(text: str, size: float) -> float:
+    return sum(_AMOUNT_WIDTHS.get(char, 556) for char in text) * size / 1000
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 3] + '...'
+
+class _PageLayout:
+    """Content streams for one bill, starting a new page when the current one is full"""
+
+    def __init__(self):
+        self.pages: List[bytes] = []
+        self._ops: List[str] = []
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def text(self, x: float, value, size: float = 10, bold: bool = False):
+        self._ops.append(f"BT /{'F2' if bold else 'F1'} {size} Tf {x:.1f} {self.y:.1f} Td ({_pdf_text(value)}) Tj ET")
+
+    def right(self, x: float, value: str, size: float = 10, bold: bool = False):
+        self.text(x - _amount_width(value, size), value, size, bold)
+
+    def centered(self, value: str, size: float, bold: bool = False):
+        self.text((PAGE_WIDTH - len(value) * size * 0.55) / 2, value, size, bold)
+
+    def rule(self):
+        self._ops.append(f'{MARGIN} {self.y - 4:.1f} m {PAGE_WIDTH - MARGIN} {self.y - 4:.1f} l 0.5 w S')
+
+    def advance(self, points: float, needed: float = 0):
+        self.y -= points
+        if self.y - needed < MARGIN:
+            self.finish_page()
+            self.y = PAGE_HEIGHT - MARGIN
+
+    def finish_page(self):
+        if self._ops:
+            self.pages.append(zlib.compress('\n'.join(self._ops).encode('latin-1')))
+            self._ops = []
+
+def layout_bill_pdf(bill: Dict) -> List[bytes]:
+    """Lay out one bill as compressed PDF page content streams"""
+    view = bill_view(bill)
+    page = _PageLayout()
+    page.centered(HOSPITAL_NAME, 18, bold=True)
+    page.advance(24)
+    page.centered('Medical Bill', 13)
+    page.advance(30)
+    for label, value in (('Patient Name:', view['patient_name']), ('OPD Number:', view['opd_number']),
+                         ('Bill Date:', view['bill_date']), ('Bill Number:', view['bill_number'])):
+        page.text(MARGIN, label, bold=True)
+        page.text(MARGIN + 85, _clip(str(value), 70))
+        page.advance(15)
+    page.advance(10)
+
+    amount_x = PAGE_WIDTH - MARGIN
+    def header():
+        page.text(MARGIN, 'Item/Service', bold=True)
+        page.text(MARGIN + 250, 'Category', bold=True)
+        page.text(MARGIN + 370, 'Qty', bold=True)
+        page.right(amount_x, 'Total Price', bold=True)
+        page.rule()
+        page.advance(18)
+
+    header()
+    for group in view['groups']:
+        page.advance(0, needed=30)
+        if page.y == PAGE_HEIGHT - MARGIN:
+            header()
+        page.text(MARGIN, group['category'].upper(), 9, bold=True)
+        page.advance(14)
+        for item in group['lines']:
+            if page.y == PAGE_HEIGHT - MARGIN:
+                header()
+            page.text(MARGIN, _clip(item['description'], 48))
+            page.text(MARGIN + 250, _clip(group['category'], 20), 8)
+            page.text(MARGIN + 370, item['quantity'])
+            page.right(amount_x, f"Tk {item['total']:.2f}")
+            page.advance(14, needed=14)
+    page.rule()
+    page.advance(20, needed=60)
+    page.right(amount_x - 120, 'TOTAL AMOUNT:', 11, bold=True)
+    page.right(amount_x, f"Tk {view['total']:.2f}", 12, bold=True)
+    page.advance(30)
+    page.text(MARGIN, 'Thank you for choosing our hospital services!', 10, bold=True)
+    page.advance(14)
+    page.text(MARGIN, 'This is a computer generated bill', 9)
+    page.finish_page()
+    return page.pages
+
+class PdfWriter:
+    """Writes pages to a file as they arrive; the page tree goes at the end"""
+
+    # 1: catalog, 2: page tree, 3-4: fonts; pages start at 5
+    _FIRST_PAGE_OBJECT = 5
+
+    def __init__(self, fp: BinaryIO):
+        self.fp = fp
+        self.offsets = {}
+        self.page_objects = []
+        self.position = 0
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self._object(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+        self._object(4, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>')
+        self._next_object = self._FIRST_PAGE_OBJECT
+
+    def _write(self, data: bytes):
+        self.fp.write(data)
+        self.position += len(data)
+
+    def _object(self, number: int, body: bytes):
+        self.offsets[number] = self.position
+        self._write(f'{number} 0 obj\n'.encode() + body + b'\nendobj\n')
+
+    def add_page(self, content: bytes):
+        content_number, page_number = self._next_object, self._next_object + 1
+        self._next_object += 2
+        self._object(content_number, f'<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n'.encode()
+                     + content + b'\nendstream')
+        self._object(page_number, (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {content_number} 0 R >>'
+        ).encode())
+        self.page_objects.append(page_number)
+
+    def close(self):
+        kids = ' '.join(f'{number} 0 R' for number in self.page_objects)
+        self._object(2, f'<< /Type /Pages /Kids [{kids}] /Count {len(self.page_objects)} >>'.encode())
+        self._object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        xref_at = self.position
+        count = self._next_object
+        entries = ['0000000000 65535 f ']
+        for number in range(1, count):
+            offset = self.offsets.get(number)
+            entries.append(f'{offset:010d} 00000 n ' if offset is not None else '0000000000 65535 f ')
+        self._write(f'xref\n0 {count}\n'.encode() + '\n'.join(entries).encode() + b'\n')
+        self._write(f'trailer\n<< /Size {count} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n'.encode())
+
+class _BytesSink:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data: bytes):
+        self.chunks.append(data)
+
+def render_pdf(bill: Dict) -> bytes:
+    sink = _BytesSink()
+    writer = PdfWriter(sink)
+    for content in layout_bill_pdf(bill):
+        writer.add_page(content)
+    writer.close()
+    return b''.join(sink.chunks)
+
+def render_bill(bill: Dict, render_format: str) -> bytes:
+    """Render one bill as 'html' or 'pdf'"""
+    if render_format == 'html':
+        return render_html(bill)
+    if render_format == 'pdf':
+        return render_pdf(bill)
+    raise ValueError(f"Unknown render format '{render_format}' (expected one of {', '.join(RENDER_FORMATS)})")
+
+def bill_etag(bill: Dict, render_format: str) -> str:
+    """Version of a bill's rendering: changes with the bill's content, the template or the format"""
+    digest = hashlib.sha1(json.dumps(bill, sort_keys=True, default=str).encode('utf-8'))
+    digest.update(f'{render_format}:{template_version()}'.encode())
+    return digest.hexdigest()
+
+# ---------------------------------------------------------------------------
+# Rendered output cache
+# ---------------------------------------------------------------------------
+
+class BillRenderCache:
+    """Byte-bounded LRU of rendered bills keyed by (bill id, format).
+
+    Each entry remembers the ETag it was rendered for; a bill whose content
+    or template changed gets a new ETag and is rendered again.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, bill: Dict, render_format: str) -> Tuple[str, bytes]:
+        """Return (etag, rendered bytes), rendering on a miss"""
+        etag = bill_etag(bill, render_format)
+        key = (bill['id'], render_format)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == etag:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        body = render_bill(bill, render_format)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            if len(body) <= self.max_bytes:
+                self._entries[key] = (etag, body)
+                self.size += len(body)
+                while self.size > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return etag, body
+
+    def get_info(self) -> Dict:
+        """Cache statistics for this worker"""
+        return {
+            'pid': os.getpid(),
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'template_version': template_version()
+        }
+
+_render_cache = None
+_render_cache_pid = None
+_render_cache_lock = threading.Lock()
+
+def get_render_cache() -> BillRenderCache:
+    """Return this worker's render cache, creating it after fork if needed"""
+    global _render_cache, _render_cache_pid
+    pid = os.getpid()
+    if _render_cache is None or _render_cache_pid != pid:
+        with _render_cache_lock:
+            if _render_cache is None or _render_cache_pid != pid:
+                _render_cache = BillRenderCache(int(os.getenv('BILL_RENDER_CACHE_MB', 32)) * 1024 * 1024)
+                _render_cache_pid = pid
+    return _render_cache
+
+# ---------------------------------------------------------------------------
+# Batch rendering
+# ---------------------------------------------------------------------------
+
+# Bills handed to the pool at a time; also how often batch progress is reported
+BATCH_CHUNK_SIZE = 200
+# Chunks smaller than this are laid out inline; shipping them to worker processes costs more
+MIN_PARALLEL_BILLS = 50
+
+def create_render_pool(workers: int) -> Optional[ProcessPoolExecutor]:
+    """Process pool for PDF layout, or None for workers <= 1.
+
+    Uses spawn, not fork: the pool is started from a job thread of a
+    multi-threaded web worker, and forking that is not safe.
+    """
+    if workers <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+def write_batch(bills: Iterable[Dict], render_format: str, fp: BinaryIO,
+                workers: int = 1, progress: Optional[Callable[[int], None]] = None) -> int:
+    """Render many bills into one printable file (a page per bill); returns how many.
+
+    HTML is one streamed template pass in this process. PDF layout, the
+    expensive part, is spread over a process pool in chunks and the pages
+    are appended to the file as chunks finish, so memory stays bounded.
+    progress(rendered_so_far) is called after every chunk.
+    """
+    if render_format not in RENDER_FORMATS:
+        raise ValueError(f"Unknown render format '{render_format}' (expected one of {', '.join(RENDER_FORMATS)})")
+
+    rendered = 0
+    if render_format == 'html':
+        def counted():
+            nonlocal rendered
+            for bill in bills:
+                yield bill
+                rendered += 1
+                if progress and rendered % BATCH_CHUNK_SIZE == 0:
+                    progress(rendered)
+        for text in iter_html(counted()):
+            fp.write(text.encode('utf-8'))
+        return rendered
+
+    pdf = PdfWriter(fp)
+    pool = create_render_pool(workers)
+    try:
+        for chunk in _chunks(bills, BATCH_CHUNK_SIZE):
+            if pool is not None and len(chunk) >= MIN_PARALLEL_BILLS:
+                layouts = pool.map(layout_bill_pdf, chunk, chunksize=max(1, len(chunk) // (workers * 4)))
+            else:
+                layouts = map(layout_bill_pdf, chunk)
+            for contents in layouts:
+                for content in contents:
+                    pdf.add_page(content)
+            rendered += len(chunk)
+            if progress:
+                progress(rendered)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    pdf.close()
+    return rendered
+
+def _chunks(values: Iterable, size: int) -> Iterator[List]:
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,575 @@
+
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # no flock: concurrent publishers still swap whole files atomically
+    fcntl = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1)
+_NO_TIME = -(1 << 63)
+
+class _StringColumn:
+    """Each distinct value stored once; rows hold a compact code into the value table"""
+
+    __slots__ = ('values', 'lookup', 'codes')
+
+    def __init__(self, typecode: str = 'I'):
+        self.values = []
+        self.lookup = {}
+        self.codes = array(typecode)
+
+    def append(self, value):
+        code = self.lookup.get(value)
+        if code is None:
+            code = self.lookup[value] = len(self.values)
+            self.values.append(sys.intern(value) if isinstance(value, str) else value)
+        self.codes.append(code)
+
+    def __getitem__(self, row: int):
+        return self.values[self.codes[row]]
+
+    def nbytes(self) -> int:
+        return _private_bytes(self.codes) + _private_bytes(self.values) + _private_bytes(self.lookup)
+
+class _PackedStrings:
+    """Read-only string table over a mapped buffer: UTF-8 blob plus end offsets, decoded on access"""
+
+    __slots__ = ('offsets', 'blob', 'nulls')
+
+    def __init__(self, offsets, blob, nulls=()):
+        self.offsets = offsets
+        self.blob = blob
+        self.nulls = frozenset(nulls)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> Optional[str]:
+        if index in self.nulls:
+            return None
+        return str(self.blob[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+    def __iter__(self) -> Iterator[Optional[str]]:
+        return (self[index] for index in range(len(self)))
+
+def _private_bytes(value) -> int:
+    """Bytes a column holds in this process; mapped snapshot buffers are shared and count as 0"""
+    if isinstance(value, (memoryview, _PackedStrings)):
+        return 0
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value)
+    return sys.getsizeof(value)
+
+class _TimeColumn:
+    """Timestamps as integer microseconds, formatted back to the backend's string form on read"""
+
+    __slots__ = ('micros', 'separator', 'raw')
+
+    def __init__(self):
+        self.micros = array('q')
+        self.separator = None
+        # Values that did not parse, kept verbatim by row
+        self.raw = {}
+
+    def append(self, value):
+        if value is None:
+            self.micros.append(_NO_TIME)
+            return
+        try:
+            parsed = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            self.raw[len(self.micros)] = value
+            self.micros.append(_NO_TIME)
+            return
+        if self.separator is None:
+            self.separator = 'T' if 'T' in value else ' '
+        delta = parsed.replace(tzinfo=None) - _EPOCH
+        self.micros.append((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+    def __getitem__(self, row: int) -> Optional[str]:
+        value = self.micros[row]
+        if value == _NO_TIME:
+            return self.raw.get(row)
+        return (_EPOCH + timedelta(microseconds=value)).isoformat(sep=self.separator)
+
+    def nbytes(self) -> int:
+        return _private_bytes(self.micros) + sys.getsizeof(self.raw)
+
+class CatalogStore:
+    """Read-only columnar snapshot of the item catalog at one catalog version.
+
+    Rows keep the listing order (category, name). Numbers live in typed
+    arrays; category, type, strength and description are interned code
+    columns. Lookups go through compact indexes: ids by binary search over
+    a sorted id array, categories by per-category row arrays, names by a
+    case-insensitive sorted row array. Item dicts are only built when a
+    response is serialized.
+    """
+
+    def __init__(self, items: Iterable[Dict], version: int):
+        self.version = version
+        self.loaded_at = time.time()
+        self.shared_bytes = 0
+        self.ids = array('q')
+        self.prices = array('d')
+        self.names = []
+        self.categories = _StringColumn('H')
+        self.types = _StringColumn('I')
+        self.strengths = _StringColumn('I')
+        self.descriptions = _StringColumn('I')
+        self.created_at = _TimeColumn()
+        self.updated_at = _TimeColumn()
+
+        for item in items:
+            self.ids.append(item['id'])
+            self.prices.append(item['price'] or 0.0)
+            self.names.append(item['name'])
+            self.categories.append(item['category'])
+            self.types.append(item.get('type'))
+            self.strengths.append(item.get('strength'))
+            self.descriptions.append(item.get('description'))
+            self.created_at.append(item.get('created_at'))
+            self.updated_at.append(item.get('updated_at'))
+
+        count = len(self.ids)
+        by_id = sorted(range(count), key=self.ids.__getitem__)
+        self._sorted_ids = array('q', (self.ids[row] for row in by_id))
+        self._id_rows = array('I', by_id)
+
+        self._category_rows = {}
+        for row, code in enumerate(self.categories.codes):
+            rows = self._category_rows.get(code)
+            if rows is None:
+                rows = self._category_rows[code] = array('I')
+            rows.append(row)
+
+        self._name_rows = array('I', sorted(range(count), key=lambda row: (self.names[row].casefold(),
+                                                                            self.ids[row])))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def row_of(self, item_id: int) -> Optional[int]:
+        index = bisect_left(self._sorted_ids, item_id)
+        if index < len(self._sorted_ids) and self._sorted_ids[index] == item_id:
+            return self._id_rows[index]
+        return None
+
+    def category_rows(self, category: str) -> array:
+        code = self.categories.lookup.get(category)
+        return self._category_rows.get(code, array('I')) if code is not None else array('I')
+
+    def search_names(self, query: str, limit: int = 50) -> List[int]:
+        """Rows whose name starts with query, case-insensitively, in name order"""
+        query = query.casefold()
+        index = bisect_left(self._name_rows, query, key=lambda row: self.names[row].casefold())
+        rows = []
+        while index < len(self._name_rows) and len(rows) < limit:
+            row = self._name_rows[index]
+            if not self.names[row].casefold().startswith(query):
+                break
+            rows.append(row)
+            index += 1
+        return rows
+
+    def item(self, row: int) -> Dict:
+        """The API dict for one row, built on demand"""
+        return {
+            'id': self.ids[row],
+            'category': self.categories[row],
+            'name': self.names[row],
+            'type': self.types[row],
+            'strength': self.strengths[row],
+            'price': self.prices[row],
+            'description': self.descriptions[row],
+            'created_at': self.created_at[row],
+            'updated_at': self.updated_at[row]
+        }
+
+    def get(self, item_id: int) -> Optional[Dict]:
+        row = self.row_of(item_id)
+        return self.item(row) if row is not None else None
+
+    def iter_items(self, rows: Optional[Iterable[int]] = None) -> Iterator[Dict]:
+        for row in range(len(self.ids)) if rows is None else rows:
+            yield self.item(row)
+
+    def to_dicts(self, rows: Optional[Iterable[int]] = None) -> List[Dict]:
+        return list(self.iter_items(rows))
+
+    def memory_bytes(self) -> int:
+        """Approximate bytes private to this process; a mapped snapshot's buffers are in shared_bytes"""
+        total = sum(_private_bytes(column) for column in (
+            self.ids, self.prices, self.names, self._sorted_ids, self._id_rows, self._name_rows))
+        total += sum(column.nbytes() for column in (
+            self.categories, self.types, self.strengths, self.descriptions, self.created_at, self.updated_at))
+        total += sys.getsizeof(self._category_rows) + sum(
+            _private_bytes(rows) for rows in self._category_rows.values())
+        return total
+
+# ---------------------------------------------------------------------------
+# Shared snapshot file
+# ---------------------------------------------------------------------------
+
+# File layout: magic, uint32 header length, JSON header, then 8-byte aligned
+# sections whose offsets (from the start of the data area) the header lists.
+SNAPSHOT_MAGIC = b'HBCAT01\n'
+
+def _pack_strings(values) -> tuple:
+    offsets, chunks, nulls, position = array('Q', [0]), [], [], 0
+    for index, value in enumerate(values):
+        if value is None:
+            nulls.append(index)
+        else:
+            data = value.encode('utf-8')
+            chunks.append(data)
+            position += len(data)
+        offsets.append(position)
+    return offsets, b''.join(chunks), nulls
+
+def write_snapshot(store: CatalogStore, path: str) -> int:
+    """Write store as a snapshot file and atomically swap it in at path; returns its size"""
+    sections, nulls = {}, {}
+    for name in ('ids', 'prices', '_sorted_ids', '_id_rows', '_name_rows'):
+        sections[name] = getattr(store, name)
+    for name in ('categories', 'types', 'strengths', 'descriptions'):
+        column = getattr(store, name)
+        sections[f'{name}.codes'] = column.codes
+        offsets, blob, nulls[name] = _pack_strings(column.values)
+        sections[f'{name}.offsets'], sections[f'{name}.blob'] = offsets, array('B', blob)
+    offsets, blob, nulls['names'] = _pack_strings(store.names)
+    sections['names.offsets'], sections['names.blob'] = offsets, array('B', blob)
+    for name in ('created_at', 'updated_at'):
+        sections[f'{name}.micros'] = getattr(store, name).micros
+
+    category_rows, category_ranges = array('I'), {}
+    for code, rows in store._category_rows.items():
+        category_ranges[code] = (len(category_rows), len(category_rows) + len(rows))
+        category_rows.extend(rows)
+    sections['category_rows'] = category_rows
+
+    layout, position = {}, 0
+    for name, column in sections.items():
+        data = array(column.typecode, column) if isinstance(column, memoryview) else column
+        size = len(data) * data.itemsize
+        layout[name] = [position, size, data.typecode]
+        position += (size + 7) // 8 * 8
+    header = json.dumps({
+        'version': store.version,
+        'count': len(store),
+        'created_at': datetime.now().isoformat(),
+        'sections': layout,
+        'nulls': nulls,
+        'category_ranges': {str(code): span for code, span in category_ranges.items()},
+        'time_columns': {name: {'separator': getattr(store, name).separator,
+                                'raw': {str(row): value for row, value in getattr(store, name).raw.items()}}
+                         for name in ('created_at', 'updated_at')}
+    }).encode('utf-8')
+    data_start = (len(SNAPSHOT_MAGIC) + 4 + len(header) + 7) // 8 * 8
+
+    partial_path = f'{path}.{os.getpid()}.partial'
+    try:
+        with open(partial_path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC + struct.pack('<I', len(header)) + header)
+            f.write(b'\0' * (data_start - f.tell()))
+            for name, column in sections.items():
+                offset = data_start + layout[name][0]
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(column.tobytes() if isinstance(column, array) else bytes(column))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial_path, path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return os.path.getsize(path)
+
+def _read_header(f) -> tuple:
+    magic = f.read(len(SNAPSHOT_MAGIC))
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError('Not a catalog snapshot file')
+    (length,) = struct.unpack('<I', f.read(4))
+    header = json.loads(f.read(length))
+    return header, (len(SNAPSHOT_MAGIC) + 4 + length + 7) // 8 * 8
+
+def snapshot_version(path: str) -> Optional[int]:
+    """Catalog version of the snapshot at path, or None if there is none"""
+    try:
+        with open(path, 'rb') as f:
+            return _read_header(f)[0]['version']
+    except (FileNotFoundError, ValueError):
+        return None
+
+def open_snapshot(path: str) -> CatalogStore:
+    """Map a snapshot file read-only; columns are views over the shared pages"""
+    with open(path, 'rb') as f:
+        header, data_start = _read_header(f)
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+
+    def section(name):
+        offset, size, typecode = header['sections'][name]
+        start = data_start + offset
+        return view[start:start + size].cast(typecode)
+
+    store = CatalogStore.__new__(CatalogStore)
+    store.version = header['version']
+    store.loaded_at = time.time()
+    store.shared_bytes = len(mapped)
+    store._mapped = mapped
+    store.ids = section('ids')
+    store.prices = section('prices')
+    store.names = _PackedStrings(section('names.offsets'), section('names.blob'), header['nulls']['names'])
+    for name in ('categories', 'types', 'strengths', 'descriptions'):
+        column = _StringColumn.__new__(_StringColumn)
+        column.codes = section(f'{name}.codes')
+        column.values = _PackedStrings(section(f'{name}.offsets'), section(f'{name}.blob'), header['nulls'][name])
+        column.lookup = {}
+        setattr(store, name, column)
+    # Only category names are looked up by value, and there are few of them
+    store.categories.values = [store.categories.values[code] for code in range(len(store.categories.values))]
+    store.categories.lookup = {value: code for code, value in enumerate(store.categories.values)}
+    for name in ('created_at', 'updated_at'):
+        column = _TimeColumn.__new__(_TimeColumn)
+        column.micros = section(f'{name}.micros')
+        column.separator = header['time_columns'][name]['separator']
+        column.raw = {int(row): value for row, value in header['time_columns'][name]['raw'].items()}
+        setattr(store, name, column)
+    store._sorted_ids = section('_sorted_ids')
+    store._id_rows = section('_id_rows')
+    store._name_rows = section('_name_rows')
+    category_rows = section('category_rows')
+    store._category_rows = {int(code): category_rows[start:end]
+                            for code, (start, end) in header['category_ranges'].items()}
+    return store
+
+class _SnapshotLock:
+    """Exclusive flock on a side file so one worker at a time rebuilds the snapshot"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+
+class CatalogCache:
+    """Per-worker holder of the current CatalogStore.
+
+    Without a snapshot path each worker builds a private store: the catalog
+    version is checked at most every check_seconds (0 checks on every call)
+    and the store is rebuilt only when it changed.
+
+    With a snapshot path the store is a read-only mapping of a shared file,
+    so every worker reads the same physical pages. Calls only stat the file
+    and remap it after it was swapped, which costs no queries. The worker
+    that writes publishes the new file before it answers (see invalidate),
+    so other workers see the change on their next call; every verify_seconds
+    the version is also checked against the database to catch writes from
+    outside the app. One caller reloads while the others keep serving the
+    previous store.
+    """
+
+    def __init__(self, check_seconds: float = 0.0, snapshot_path: Optional[str] = None,
+                 verify_seconds: float = 60.0):
+        self.check_seconds = check_seconds
+        self.snapshot_path = snapshot_path or None
+        self.verify_seconds = verify_seconds
+        self.store = None
+        self.reloads = 0
+        self.last_reload_ms = None
+        self.publishes = 0
+        self.last_publish_ms = None
+        self._checked_at = 0.0
+        self._snapshot_key = None
+        # Verify once at start: the file may predate changes made while no worker was running
+        self._verify_pending = True
+        self._verified_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, database) -> CatalogStore:
+        if self.snapshot_path:
+            return self._get_shared(database)
+        return self._get_private(database)
+
+    def _get_private(self, database) -> CatalogStore:
+        store = self.store
+        now = time.monotonic()
+        if store is not None and now - self._checked_at < self.check_seconds:
+            return store
+
+        version = database.get_catalog_version()
+        if store is not None and store.version == version:
+            self._checked_at = now
+            return store
+        if store is not None and not self._lock.acquire(blocking=False):
+            # Another thread is rebuilding; this one answers from the previous snapshot
+            return store
+        if store is None:
+            self._lock.acquire()
+        try:
+            if self.store is not None and self.store.version == version:
+                return self.store
+            start = time.perf_counter()
+            # Version first: a change racing the listing triggers another reload, never a stale one
+            version = database.get_catalog_version()
+            self.store = CatalogStore(database.get_all_items(), version)
+            self.reloads += 1
+            self.last_reload_ms = round((time.perf_counter() - start) * 1000, 2)
+            self._checked_at = time.monotonic()
+            logger.info(f"📚 Catalog v{version} loaded: {len(self.store)} items, "
+                        f"{self.store.memory_bytes() / 1024:.0f} KB in process {os.getpid()}")
+            return self.store
+        finally:
+            self._lock.release()
+
+    def _snapshot_stat(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _get_shared(self, database) -> CatalogStore:
+        store = self.store
+        key = self._snapshot_stat()
+        verify_due = self._verify_pending or (
+            self.verify_seconds > 0 and time.monotonic() - self._verified_at >= self.verify_seconds)
+        if store is not None and key == self._snapshot_key and not verify_due:
+            return store
+        if store is not None and not self._lock.acquire(blocking=False):
+            return store
+        if store is None:
+            self._lock.acquire()
+        try:
+            if verify_due or key is None:
+                self._verify_pending = False
+                self._verified_at = time.monotonic()
+                version = database.get_catalog_version()
+                if key is None or snapshot_version(self.snapshot_path) != version:
+                    try:
+                        self.publish(database)
+                    except OSError as e:
+                        # Unwritable snapshot location: serve a private store until the next verify
+                        logger.error(f"❌ Catalog snapshot publish failed, using a private store: {e}")
+                        if self.store is None or self.store.version != version:
+                            self.store = CatalogStore(database.get_all_items(), version)
+                            self.reloads += 1
+                        self._snapshot_key = key
+                        return self.store
+                key = self._snapshot_stat()
+            if key is not None and (key != self._snapshot_key or self.store is None):
+                start = time.perf_counter()
+                self.store = open_snapshot(self.snapshot_path)
+                self._snapshot_key = key
+                self.reloads += 1
+                self.last_reload_ms = round((time.perf_counter() - start) * 1000, 2)
+                logger.info(f"📚 Catalog v{self.store.version} mapped: {len(self.store)} items, "
+                            f"{self.store.shared_bytes / 1024:.0f} KB shared in process {os.getpid()}")
+            return self.store
+        finally:
+            self._lock.release()
+
+    def publish(self, database) -> bool:
+        """Rebuild the shared snapshot file unless another worker already published this version"""
+        with _SnapshotLock(self.snapshot_path + '.lock'):
+            version = database.get_catalog_version()
+            if snapshot_version(self.snapshot_path) == version:
+                return False
+            start = time.perf_counter()
+            size = write_snapshot(CatalogStore(database.get_all_items(), version), self.snapshot_path)
+            self.publishes += 1
+            self.last_publish_ms = round((time.perf_counter() - start) * 1000, 2)
+            logger.info(f"📦 Catalog v{version} snapshot published: {size / 1024:.0f} KB "
+                        f"in {self.last_publish_ms} ms by process {os.getpid()}")
+            return True
+
+    def invalidate(self, database=None):
+        """Catalog changed in this worker: check the version on the next call.
+
+        In shared mode with a database, the snapshot is republished right away,
+        so other workers serve the change as soon as the caller answers.
+        """
+        self._checked_at = 0.0
+        self._verify_pending = True
+        if not self.snapshot_path or database is None:
+            return
+        try:
+            self.publish(database)
+            self._verify_pending = False
+            self._verified_at = time.monotonic()
+        except Exception as e:
+            # The next call in this worker retries; other workers catch up at their next verify
+            logger.error(f"❌ Catalog snapshot publish after write failed: {e}")
+
+    def get_info(self) -> Dict:
+        """Store size and memory for this worker"""
+        store = self.store
+        info = {
+            'pid': os.getpid(),
+            'mode': 'shared' if store is not None and store.shared_bytes else 'private',
+            'loaded': store is not None,
+            'reloads': self.reloads,
+            'last_reload_ms': self.last_reload_ms,
+            'check_seconds': self.check_seconds,
+            'snapshot_path': self.snapshot_path,
+            'verify_seconds': self.verify_seconds,
+            'publishes': self.publishes,
+            'last_publish_ms': self.last_publish_ms
+        }
+        if store is not None:
+            memory = store.memory_bytes()
+            info.update({
+                'version': store.version,
+                'items': len(store),
+                'categories': len(store.categories.values),
+                'memory_bytes': memory,
+                'shared_bytes': store.shared_bytes,
+                'bytes_per_item': round((memory + store.shared_bytes) / len(store), 1) if len(store) else 0,
+                'loaded_at': datetime.fromtimestamp(store.loaded_at).isoformat()
+            })
+        return info
+
+_catalog_cache = None
+_catalog_cache_pid = None
+_catalog_cache_lock = threading.Lock()
+
+def get_catalog_cache() -> CatalogCache:
+    """Return this worker's catalog cache, creating it after fork if needed"""
+    global _catalog_cache, _catalog_cache_pid
+    pid = os.getpid()
+    if _catalog_cache is None or _catalog_cache_pid != pid:
+        with _catalog_cache_lock:
+            if _catalog_cache is None or _catalog_cache_pid != pid:
+                _catalog_cache = CatalogCache(
+                    check_seconds=float(os.getenv('CATALOG_CHECK_SECONDS', 0)),
+                    snapshot_path=os.getenv('CATALOG_SNAPSHOT_PATH', ''),
+                    verify_seconds=float(os.getenv('CATALOG_VERIFY_SECONDS', 60)))
+                _catalog_cache_pid = pid
+    return _catalog_cache
@@ -0,0 +1,292 @@
+
+import os
+import time
+import logging
+import threading
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Any, List, Dict, Optional, Iterator
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class DuplicateBillNumberError(ValueError):
+    """A bill with this bill_number already exists; raised by save_bill and bulk_save_bills"""
+
+def is_bill_number_conflict(error: Exception) -> bool:
+    """Whether a driver IntegrityError is the UNIQUE constraint on bills.bill_number"""
+    return 'bill_number' in str(error)
+
+def get_item_changes_retention() -> int:
+    """Catalog versions kept in item_changes; older entries are trimmed on write (0 = keep all)"""
+    return int(os.getenv('ITEM_CHANGES_RETENTION', 10000))
+
+class HospitalDatabase(ABC):
+    """Storage interface shared by every database backend.
+
+    main.py only talks to this API, so backends can be swapped through
+    DATABASE_BACKEND without touching the routes.
+    """
+
+    @abstractmethod
+    def get_all_items(self) -> List[Dict]:
+        """Get all items ordered by category and name"""
+
+    @abstractmethod
+    def get_items_by_category(self, category: str) -> List[Dict]:
+        """Get items in one category ordered by name"""
+
+    @abstractmethod
+    def add_item(self, item_data: Dict) -> int:
+        """Add an item and return its id"""
+
+    @abstractmethod
+    def bulk_add_items(self, items: List[Dict]) -> int:
+        """Insert many items in one transaction and return how many"""
+
+    @abstractmethod
+    def bulk_upsert_items(self, items: List[Dict]) -> int:
+        """Insert items, updating those whose 'id' already exists"""
+
+    @abstractmethod
+    def update_item(self, item_id: int, item_data: Dict) -> bool:
+        """Update an item; False if it does not exist"""
+
+    @abstractmethod
+    def delete_item(self, item_id: int) -> bool:
+        """Delete an item; False if it does not exist"""
+
+    @abstractmethod
+    def get_catalog_version(self) -> int:
+        """Latest catalog change version"""
+
+    @abstractmethod
+    def get_item_changes(self, since: int) -> Dict:
+        """Changes after `since`: version, full_resync, items (current state) and deleted ids"""
+
+    @abstractmethod
+    def save_bill(self, bill_data: Dict) -> int:
+        """Save a bill and return its id; DuplicateBillNumberError if the number is taken"""
+
+    @abstractmethod
+    def bulk_save_bills(self, bills: List[Dict]) -> int:
+        """Insert many bills in one transaction and return how many; DuplicateBillNumberError on a taken number"""
+
+    @abstractmethod
+    def reserve_bill_numbers(self, department: str, count: int) -> int:
+        """Atomically advance a department's bill sequence by count; returns the first reserved value"""
+
+    @abstractmethod
+    def get_bills(self, limit: int = 50) -> List[Dict]:
+        """Get the most recent bills"""
+
+    @abstractmethod
+    def get_bill(self, bill_id: int) -> Optional[Dict]:
+        """Get one bill by id, or None"""
+
+    @abstractmethod
+    def start_maintenance_run(self, run: Dict) -> Optional[int]:
+        """Record a started maintenance run; None if its window_key was already claimed"""
+
+    @abstractmethod
+    def finish_maintenance_run(self, run_id: int, fields: Dict):
+        """Store a maintenance run's status, results and timings"""
+
+    @abstractmethod
+    def list_maintenance_runs(self, limit: int = 20) -> List[Dict]:
+        """Recent maintenance runs, newest first"""
+
+    @abstractmethod
+    def list_bill_archives(self) -> List[Dict]:
+        """Catalog of archived monthly bill partitions, oldest first"""
+
+    @abstractmethod
+    def archive_bills(self, before: datetime, progress: Optional[Callable[[int, int], None]] = None) -> List[Dict]:
+        """Move bills created before `before` out of the hot table, one partition per month"""
+
+    @abstractmethod
+    def get_patient(self, opd_number: str) -> Optional[Dict]:
+        """Get a registered patient by OPD number, or None"""
+
+    @abstractmethod
+    def find_patients(self, prefix: str, limit: int = 20) -> List[Dict]:
+        """Patients whose OPD number starts with prefix, in OPD order"""
+
+    @abstractmethod
+    def get_patient_bills(self, patient_id: int, limit: int = 50) -> List[Dict]:
+        """A patient's bills, newest first"""
+
+    @abstractmethod
+    def iter_bills(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                   batch_size: int = 1000) -> Iterator[Dict]:
+        """Stream bills created in [since, until) oldest first, batch_size rows at a time"""
+
+    @abstractmethod
+    def claim_idempotency_key(self, key: str, request_hash: str, expires_at: float) -> Optional[Dict]:
+        """Claim a free or expired key until expires_at; None on success, else the holder's record"""
+
+    @abstractmethod
+    def complete_idempotency_key(self, key: str, status_code: int, response_body: str, expires_at: float):
+        """Store the response for a claimed key and keep it until expires_at"""
+
+    @abstractmethod
+    def release_idempotency_key(self, key: str):
+        """Drop a claim whose request failed so a retry can run it again"""
+
+    @abstractmethod
+    def purge_idempotency_keys(self, now: float) -> int:
+        """Delete keys that expired before now; returns how many"""
+
+    @abstractmethod
+    def create_job(self, job: Dict):
+        """Persist a new background job (id, job_type, status, params, created_at, worker)"""
+
+    @abstractmethod
+    def update_job(self, job_id: str, fields: Dict) -> bool:
+        """Update job columns; False if the job does not exist"""
+
+    @abstractmethod
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Get one job, or None"""
+
+    @abstractmethod
+    def list_jobs(self, limit: int = 50, statuses: Optional[List[str]] = None) -> List[Dict]:
+        """Most recent jobs, optionally only those in the given statuses"""
+
+    @abstractmethod
+    def get_statistics(self) -> Dict:
+        """Get item, bill and revenue totals"""
+
+    @abstractmethod
+    def get_connection_info(self) -> Dict:
+        """Describe the connection; must include connected, database_type and pool"""
+
+    def get_outbox_status(self) -> Optional[Dict]:
+        """Writes buffered while the primary was down; None if the backend has no fallback"""
+        return None
+
+class LazyDatabase:
+    """Process-local proxy that builds the real database handle on first use.
+
+    Importing a database module no longer touches the database. The handle is
+    created the first time an attribute is accessed, and again in every forked
+    worker, so gunicorn workers never share connections with the master.
+    """
+
+    def __init__(self, factory: Callable[[], Any], name: str = 'database'):
+        self._factory = factory
+        self._name = name
+        self._instance = None
+        self._pid = None
+        self._init_ms = None
+        self._lock = threading.Lock()
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        """Drop the parent's handle in a freshly forked worker"""
+        self._instance = None
+        self._pid = None
+        self._init_ms = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the handle for this process, creating it if needed"""
+        pid = os.getpid()
+        if self._instance is not None and self._pid == pid:
+            return self._instance
+
+        with self._lock:
+            if self._instance is None or self._pid != pid:
+                start = time.perf_counter()
+                self._instance = self._factory()
+                self._pid = pid
+                self._init_ms = round((time.perf_counter() - start) * 1000, 2)
+                logger.info(f"⚡ {self._name} handle ready in process {pid} ({self._init_ms} ms)")
+
+        return self._instance
+
+    @property
+    def initialized(self) -> bool:
+        """Whether this process already holds a handle"""
+        return self._instance is not None and self._pid == os.getpid()
+
+    @property
+    def init_ms(self):
+        """How long creating this process's handle took, in milliseconds"""
+        return self._init_ms
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+# Read-your-writes for replica routing. Each client carries the time of its own
+# last write (main.py sets it as a cookie), so whichever worker serves its next
+# request reads from the primary until the replicas have caught up.
+_client_writes = ContextVar('client_writes', default=None)
+
+def get_read_your_writes_seconds() -> float:
+    """How long a client's reads stay on the primary after its last write"""
+    return float(os.getenv('DB_READ_YOUR_WRITES_SECONDS', 5))
+
+def begin_client_request(last_write_at: float = 0.0):
+    """Start tracking writes for the client request served in this context"""
+    _client_writes.set({'last_write_at': last_write_at, 'pending': False, 'wrote_at': None})
+
+def end_client_request():
+    """Stop tracking: later work in this context counts as background work"""
+    _client_writes.set(None)
+
+def client_wrote_at() -> Optional[float]:
+    """When the current request last committed changed rows, if it did"""
+    state = _client_writes.get()
+    return state['wrote_at'] if state else None
+
+def client_last_write_at() -> Optional[float]:
+    """Last write time of the current client; None outside a client request (background work)"""
+    state = _client_writes.get()
+    if state is None:
+        return None
+    return max(state['last_write_at'], state['wrote_at'] or 0.0)
+
+def note_rows_written():
+    """A statement in the current transaction changed rows"""
+    state = _client_writes.get()
+    if state is not None:
+        state['pending'] = True
+
+def finish_client_transaction(committed: bool):
+    """Stamp the client's write time if the transaction that just ended committed changed rows"""
+    state = _client_writes.get()
+    if state is not None and state['pending']:
+        state['pending'] = False
+        if committed:
+            state['wrote_at'] = time.time()
+
+def get_backend_name() -> str:
+    """Configured backend: 'sqlite' (default) or 'sqlalchemy'/'mysql'"""
+    return os.getenv('DATABASE_BACKEND', 'sqlite').lower()
+
+def get_database_identity() -> str:
+    """Stable name of the configured database, for host-local files shared by its workers"""
+    backend = get_backend_name()
+    if backend == 'sqlite':
+        return 'sqlite:' + os.path.abspath(os.getenv('SQLITE_DB_PATH', 'hospital_billing_flask.db'))
+    return (f"{backend}:{os.getenv('DB_HOST', 'localhost')}:{os.getenv('DB_PORT', 3306)}"
+            f"/{os.getenv('DB_NAME', 'hospital_billing')}")
+
+def create_database() -> HospitalDatabase:
+    """Build the backend selected by DATABASE_BACKEND"""
+    backend = get_backend_name()
+    if backend == 'sqlite':
+        from flask_database import HospitalDB
+        return HospitalDB(os.getenv('SQLITE_DB_PATH', 'hospital_billing_flask.db'))
+    if backend in ('sqlalchemy', 'mysql'):
+        from mysql_database import MySQLHospitalDB
+        return MySQLHospitalDB()
+    raise ValueError(f"Unknown DATABASE_BACKEND '{backend}' (expected 'sqlite' or 'sqlalchemy')")
+
+# Global database instance for the configured backend, created lazily per process
+db = LazyDatabase(create_database, 'database')
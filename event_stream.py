@@ -0,0 +1,260 @@
+
+import os
+import json
+import time
+import hashlib
+import queue
+import asyncio
+import atexit
+import socket
+import logging
+import tempfile
+import threading
+from typing import Dict, Optional, Iterable
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Largest event we send between workers in one datagram
+MAX_DATAGRAM_SIZE = 64 * 1024
+
+class Subscriber:
+    """One connected event-stream client: a bounded queue filled by the broadcaster"""
+
+    def __init__(self, max_queue: int, event_types: Optional[Iterable[str]] = None):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.event_types = set(event_types) if event_types else None
+        self.dropped = False
+
+    def wants(self, event_type: str) -> bool:
+        return self.event_types is None or event_type in self.event_types
+
+    def deliver(self, event: Dict) -> bool:
+        """Queue an event without blocking; False if the client is too far behind"""
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+class AsyncSubscriber(Subscriber):
+    """Subscriber drained by a coroutine on an asyncio event loop (ASGI mode).
+
+    Events arrive from request threads and the relay thread, so they are
+    handed to the loop with call_soon_threadsafe; no thread waits per client.
+    """
+
+    def __init__(self, max_queue: int, loop: asyncio.AbstractEventLoop,
+                 event_types: Optional[Iterable[str]] = None):
+        super().__init__(max_queue, event_types)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_queue)
+
+    def _put(self, event: Dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped = True
+
+    def deliver(self, event: Dict) -> bool:
+        if self.queue.full():
+            return False
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # Event loop already closed
+            return False
+        return True
+
+def format_event(event: Dict) -> str:
+    """Render one event in Server-Sent Events wire format"""
+    return (f"id: {event['id']}\n"
+            f"event: {event['type']}\n"
+            f"data: {json.dumps(event['data'])}\n\n")
+
+def get_socket_dir() -> str:
+    """EVENTS_SOCKET_DIR, or a temp directory named after the configured database.
+
+    Workers of one deployment find each other there, while other deployments
+    on the same host (another database) get a directory of their own.
+    """
+    configured = os.getenv('EVENTS_SOCKET_DIR')
+    if configured:
+        return configured
+    from database_backend import get_database_identity
+    digest = hashlib.sha1(get_database_identity().encode('utf-8')).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f'hospital_billing_events-{digest}')
+
+class EventBroadcaster:
+    """Per-worker fan-out of server events to event-stream subscribers.
+
+    Publishing never blocks on clients: each subscriber has a bounded queue
+    and a client that falls too far behind is dropped (it reconnects and
+    resyncs through /api/items/changes). Workers on the same host relay
+    events to each other over Unix datagram sockets in a shared directory,
+    served by a single listener thread per worker. Streams themselves are
+    served by the ASGI entry point, where an idle client costs no thread.
+    """
+
+    def __init__(self, socket_dir: Optional[str] = None, max_queue: int = 100, max_clients: int = 500):
+        self.socket_dir = socket_dir or get_socket_dir()
+        self.max_queue = max_queue
+        self.max_clients = max_clients
+        self.subscribers = set()
+        self.sequence = 0
+        self.published = 0
+        self.relayed = 0
+        self._lock = threading.Lock()
+        self._socket = None
+        self._socket_path = None
+        self._listener = None
+        self._start_relay()
+
+    # ------------------------------------------------------------------
+    # Cross-worker relay
+    # ------------------------------------------------------------------
+
+    def _start_relay(self):
+        """Bind this worker's datagram socket and start the listener thread"""
+        if not hasattr(socket, 'AF_UNIX'):
+            logger.info("ℹ️ Unix sockets unavailable; events stay within this worker")
+            return
+        try:
+            os.makedirs(self.socket_dir, exist_ok=True)
+            self._socket_path = os.path.join(self.socket_dir, f'{os.getpid()}.sock')
+            if os.path.exists(self._socket_path):
+                os.unlink(self._socket_path)
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._socket.bind(self._socket_path)
+            atexit.register(self._remove_socket)
+            self._listener = threading.Thread(target=self._listen, name='event-relay', daemon=True)
+            self._listener.start()
+        except OSError as e:
+            logger.warning(f"⚠️ Event relay disabled: {e}")
+            self._socket = None
+
+    def _remove_socket(self):
+        try:
+            os.unlink(self._socket_path)
+        except OSError:
+            pass
+
+    def _listen(self):
+        while True:
+            try:
+                payload = self._socket.recv(MAX_DATAGRAM_SIZE)
+                event = json.loads(payload)
+                self.relayed += 1
+                self._fan_out(event)
+            except Exception as e:
+                logger.warning(f"⚠️ Dropped relayed event: {e}")
+
+    def _relay(self, event: Dict):
+        """Send an event to every other worker's socket, removing dead ones"""
+        if not self._socket:
+            return
+        payload = json.dumps(event).encode('utf-8')
+        if len(payload) > MAX_DATAGRAM_SIZE:
+            logger.warning(f"⚠️ Event {event['type']} too large to relay ({len(payload)} bytes)")
+            return
+        for name in os.listdir(self.socket_dir):
+            path = os.path.join(self.socket_dir, name)
+            if path == self._socket_path or not name.endswith('.sock'):
+                continue
+            try:
+                self._socket.sendto(payload, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Worker is gone; clean up its socket file
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError as e:
+                logger.warning(f"⚠️ Could not relay event to {name}: {e}")
+
+    # ------------------------------------------------------------------
+    # Local fan-out
+    # ------------------------------------------------------------------
+
+    def subscribe(self, event_types: Optional[Iterable[str]] = None,
+                  loop: Optional[asyncio.AbstractEventLoop] = None) -> Optional[Subscriber]:
+        """Register a client; None when the worker is at max_clients.
+
+        Pass the running event loop to get an AsyncSubscriber for ASGI streams.
+        """
+        with self._lock:
+            if len(self.subscribers) >= self.max_clients:
+                return None
+            if loop is not None:
+                subscriber = AsyncSubscriber(self.max_queue, loop, event_types)
+            else:
+                subscriber = Subscriber(self.max_queue, event_types)
+            self.subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def _fan_out(self, event: Dict):
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            if not subscriber.wants(event['type']):
+                continue
+            if not subscriber.deliver(event):
+                # Slow client: drop it instead of blocking everyone else
+                subscriber.dropped = True
+                self.unsubscribe(subscriber)
+
+    def publish(self, event_type: str, data: Dict):
+        """Deliver an event to local subscribers and to the other workers"""
+        with self._lock:
+            self.sequence += 1
+            sequence = self.sequence
+        event = {
+            'type': event_type,
+            'data': data,
+            'id': f'{os.getpid()}-{sequence}',
+            'timestamp': time.time()
+        }
+        self.published += 1
+        self._fan_out(event)
+        self._relay(event)
+
+    def get_info(self) -> Dict:
+        """Broadcaster statistics for this worker"""
+        return {
+            'pid': os.getpid(),
+            'subscribers': len(self.subscribers),
+            'max_clients': self.max_clients,
+            'published': self.published,
+            'relayed': self.relayed,
+            'relay_enabled': self._socket is not None
+        }
+
+_broadcaster = None
+_broadcaster_pid = None
+_broadcaster_lock = threading.Lock()
+
+def get_broadcaster() -> EventBroadcaster:
+    """Return this worker's broadcaster, creating it after fork if needed"""
+    global _broadcaster, _broadcaster_pid
+    pid = os.getpid()
+    if _broadcaster is None or _broadcaster_pid != pid:
+        with _broadcaster_lock:
+            if _broadcaster is None or _broadcaster_pid != pid:
+                _broadcaster = EventBroadcaster(
+                    max_queue=int(os.getenv('EVENTS_QUEUE_SIZE', 100)),
+                    max_clients=int(os.getenv('EVENTS_MAX_CLIENTS', 500))
+                )
+                _broadcaster_pid = pid
+    return _broadcaster
+
+def publish_event(event_type: str, data: Dict):
+    """Publish an event without ever failing the caller's request"""
+    try:
+        get_broadcaster().publish(event_type, data)
+    except Exception as e:
+        logger.warning(f"⚠️ Could not publish {event_type} event: {e}")
@@ -0,0 +1,207 @@
+
+import io
+import re
+import csv
+import logging
+import zipfile
+from typing import Dict, Iterable, Iterator, List, Sequence
+from xml.sax.saxutils import escape
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BILL_EXPORT_COLUMNS = ('id', 'bill_number', 'patient_name', 'opd_number', 'total_amount', 'item_count', 'created_at')
+BILL_LINE_EXPORT_COLUMNS = ('bill_id', 'bill_number', 'patient_name', 'opd_number', 'created_at',
+                            'category', 'name', 'type', 'strength', 'quantity', 'price', 'total_price')
+ITEM_EXPORT_COLUMNS = ('id', 'category', 'name', 'type', 'strength', 'price', 'description', 'created_at', 'updated_at')
+STATISTICS_EXPORT_COLUMNS = ('metric', 'category', 'value')
+
+# Rows written between yields; keeps chunks around tens of kilobytes
+FLUSH_ROWS = 500
+
+# format -> (Content-Type, file extension); complete header values, charset included
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+def bill_rows(bills: Iterable[Dict], lines: bool = False) -> Iterator[Sequence]:
+    """One row per bill, or one row per bill line item when lines is set"""
+    for bill in bills:
+        items = bill.get('items') or []
+        if not lines:
+            yield (bill['id'], bill['bill_number'], bill['patient_name'], bill['opd_number'],
+                   bill['total_amount'], len(items), bill['created_at'])
+            continue
+        for item in items:
+            yield (bill['id'], bill['bill_number'], bill['patient_name'], bill['opd_number'], bill['created_at'],
+                   item.get('category'), item.get('name'), item.get('type'), item.get('strength'),
+                   item.get('quantity'), item.get('price'), item.get('totalPrice', item.get('total_price')))
+
+def item_rows(items: Iterable[Dict]) -> Iterator[Sequence]:
+    """One row per catalog item"""
+    for item in items:
+        yield tuple(item.get(column) for column in ITEM_EXPORT_COLUMNS)
+
+def statistics_rows(stats: Dict) -> Iterator[Sequence]:
+    """Totals, then item counts per category"""
+    for metric in ('total_items', 'total_bills', 'total_revenue'):
+        yield (metric, None, stats.get(metric))
+    for category, count in sorted(stats.get('items_by_category', {}).items()):
+        yield ('items_by_category', category, count)
+
+# Leading characters spreadsheet apps treat as a formula
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def _csv_value(value):
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def stream_csv(columns: Sequence[str], rows: Iterable[Sequence]) -> Iterator[str]:
+    """Yield CSV text in chunks of FLUSH_ROWS rows, with a BOM so Excel reads it as UTF-8"""
+    buffer = io.StringIO()
+    buffer.write('\ufeff')
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([_csv_value(value) for value in row])
+        if count % FLUSH_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+class _ChunkBuffer:
+    """Write-only file object that collects bytes until drained.
+
+    It has no tell()/seek(), so zipfile writes entries with data
+    descriptors and the archive can be streamed as it is produced.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+# Characters XML 1.0 does not allow, even escaped
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def _xlsx_cell(value) -> str:
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c><v>{value}</v></c>'
+    text = escape(_INVALID_XML.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+def _xlsx_row(row: Sequence) -> str:
+    return '<row>' + ''.join(_xlsx_cell(value) for value in row) + '</row>'
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+        '</styleSheet>'
+    ),
+}
+
+def _workbook_xml(sheet_name: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+def stream_xlsx(columns: Sequence[str], rows: Iterable[Sequence], sheet_name: str = 'Sheet1') -> Iterator[bytes]:
+    """Yield a single-sheet XLSX workbook as it is compressed.
+
+    The worksheet uses inline strings instead of a shared string table, so
+    nothing about earlier rows has to be kept in memory.
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_PARTS.items():
+            archive.writestr(name, content)
+        archive.writestr('xl/workbook.xml', _workbook_xml(sheet_name))
+        yield buffer.drain()
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                + _xlsx_row(columns)
+            ).encode('utf-8'))
+            pending = []
+            for row in rows:
+                pending.append(_xlsx_row(row))
+                if len(pending) >= FLUSH_ROWS:
+                    sheet.write(''.join(pending).encode('utf-8'))
+                    pending = []
+                    chunk = buffer.drain()
+                    if chunk:
+                        yield chunk
+            sheet.write((''.join(pending) + '</sheetData></worksheet>').encode('utf-8'))
+    yield buffer.drain()
+
+def stream_export(export_format: str, columns: Sequence[str], rows: Iterable[Sequence],
+                  sheet_name: str = 'Sheet1') -> Iterator:
+    """Stream rows in the requested format ('csv' or 'xlsx')"""
+    if export_format == 'csv':
+        return stream_csv(columns, rows)
+    if export_format == 'xlsx':
+        return stream_xlsx(columns, rows, sheet_name)
+    raise ValueError(f"Unknown export format '{export_format}' (expected one of {', '.join(EXPORT_FORMATS)})")
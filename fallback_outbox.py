@@ -0,0 +1,180 @@
+
+import logging
+from datetime import datetime
+from typing import List, Dict, Tuple, Optional
+from sqlalchemy import select, insert, update, delete, func
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import IntegrityError
+from schema_migrations import normalize_opd_number
+from mysql_database import Item, Bill, ItemChange, OutboxEntry, OutboxReplay, resolve_patient_ids
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class OutboxReplayer:
+    """Replays writes recorded on the SQLite fallback onto the MySQL primary.
+
+    Entries are applied in outbox order, one primary transaction per batch.
+    Every applied entry's key is stored in the primary's outbox_replays table
+    in that same transaction, so a batch interrupted between the primary
+    commit and the local status update is skipped, not applied twice, on
+    the next run. An entry that cannot be applied (for example a bill_number
+    already used by a different bill on the primary) is marked 'conflict'
+    with the reason and replay carries on with the next entry.
+    """
+
+    def __init__(self, fallback_engine, primary_engine, batch_size: int = 100):
+        self.FallbackSession = sessionmaker(bind=fallback_engine)
+        self.PrimarySession = sessionmaker(bind=primary_engine)
+        self.batch_size = batch_size
+
+    def _load_id_map(self) -> Dict[int, int]:
+        """Fallback item ids already replayed, mapped to their primary ids"""
+        with self.FallbackSession() as session:
+            rows = session.execute(
+                select(OutboxEntry.local_id, OutboxEntry.primary_id)
+                .where(OutboxEntry.operation == 'add_item', OutboxEntry.primary_id.isnot(None))
+            ).all()
+            return {local_id: primary_id for local_id, primary_id in rows}
+
+    def _next_batch(self) -> List[Dict]:
+        with self.FallbackSession() as session:
+            rows = session.execute(
+                select(OutboxEntry.id, OutboxEntry.entry_key, OutboxEntry.operation,
+                       OutboxEntry.local_id, OutboxEntry.payload)
+                .where(OutboxEntry.status == 'pending')
+                .order_by(OutboxEntry.id).limit(self.batch_size)
+            ).all()
+            return [{'id': row[0], 'entry_key': row[1], 'operation': row[2],
+                     'local_id': row[3], 'payload': row[4]} for row in rows]
+
+    def _apply(self, session, entry: Dict, id_map: Dict[int, int]) -> Tuple[str, Optional[int], Optional[str]]:
+        """Apply one entry on the primary; returns (status, primary_id, error)"""
+        operation = entry['operation']
+        values = entry['payload']
+        now = datetime.utcnow()
+
+        if operation == 'add_item':
+            item_id = session.execute(insert(Item).values(**values)).inserted_primary_key[0]
+            id_map[entry['local_id']] = item_id
+            session.execute(insert(ItemChange).values(item_id=item_id, operation='upsert'))
+            return 'replayed', item_id, None
+
+        if operation in ('update_item', 'upsert_item'):
+            item_id = id_map.get(entry['local_id'], entry['local_id'])
+            result = session.execute(update(Item).where(Item.id == item_id).values(**values, updated_at=now))
+            if result.rowcount == 0:
+                if operation == 'update_item':
+                    return 'conflict', item_id, f"Item {item_id} no longer exists on the primary"
+                session.execute(insert(Item).values(id=item_id, **values, updated_at=now))
+            session.execute(insert(ItemChange).values(item_id=item_id, operation='upsert'))
+            return 'replayed', item_id, None
+
+        if operation == 'delete_item':
+            item_id = id_map.get(entry['local_id'], entry['local_id'])
+            if session.execute(delete(Item).where(Item.id == item_id)).rowcount:
+                session.execute(insert(ItemChange).values(item_id=item_id, operation='delete'))
+            # Already gone on the primary is the outcome the delete wanted
+            return 'replayed', item_id, None
+
+        if operation == 'save_bill':
+            existing = session.execute(
+                select(Bill.id, Bill.patient_name, Bill.opd_number, Bill.total_amount)
+                .where(Bill.bill_number == values['bill_number'])
+            ).first()
+            if existing is not None:
+                same_bill = (existing[1] == values['patient_name'] and existing[2] == values['opd_number']
+                             and float(existing[3]) == float(values['total_amount']))
+                if same_bill:
+                    return 'replayed', existing[0], None
+                return 'conflict', existing[0], (
+                    f"bill_number {values['bill_number']} is already used by bill {existing[0]} on the primary")
+            patient_ids = resolve_patient_ids(session, [values])
+            patient_id = patient_ids.get(normalize_opd_number(values['opd_number']))
+            bill_id = session.execute(insert(Bill).values(**values, patient_id=patient_id)).inserted_primary_key[0]
+            return 'replayed', bill_id, None
+
+        return 'conflict', None, f"Unknown outbox operation '{operation}'"
+
+    def _replay_batch(self, entries: List[Dict], id_map: Dict[int, int]) -> Dict[int, Tuple]:
+        """Apply a batch in one primary transaction; returns results by outbox id"""
+        results = {}
+        with self.PrimarySession() as session, session.begin():
+            keys = [entry['entry_key'] for entry in entries]
+            done = {
+                row[0]: (row[1], row[2], row[3]) for row in session.execute(
+                    select(OutboxReplay.entry_key, OutboxReplay.status,
+                           OutboxReplay.primary_id, OutboxReplay.error)
+                    .where(OutboxReplay.entry_key.in_(keys))
+                ).all()
+            }
+
+            for entry in entries:
+                if entry['entry_key'] in done:
+                    results[entry['id']] = done[entry['entry_key']]
+                    continue
+                try:
+                    # Savepoint per entry so one constraint violation does not sink the batch
+                    with session.begin_nested():
+                        outcome = self._apply(session, entry, id_map)
+                except IntegrityError as e:
+                    outcome = ('conflict', None, str(e.orig))
+                session.execute(insert(OutboxReplay).values(
+                    entry_key=entry['entry_key'], status=outcome[0], primary_id=outcome[1], error=outcome[2]))
+                results[entry['id']] = outcome
+
+        now = datetime.utcnow()
+        with self.FallbackSession() as session, session.begin():
+            for outbox_id, (status, primary_id, error) in results.items():
+                session.execute(
+                    update(OutboxEntry).where(OutboxEntry.id == outbox_id)
+                    .values(status=status, primary_id=primary_id, error=error, replayed_at=now))
+        return results
+
+    def replay(self, max_batches: Optional[int] = None) -> Dict:
+        """Replay pending entries batch by batch until none are left"""
+        summary = {'batches': 0, 'replayed': 0, 'conflicts': 0}
+        id_map = self._load_id_map()
+        while max_batches is None or summary['batches'] < max_batches:
+            entries = self._next_batch()
+            if not entries:
+                break
+            results = self._replay_batch(entries, id_map)
+            summary['batches'] += 1
+            for outbox_id, (status, _, error) in results.items():
+                if status == 'conflict':
+                    summary['conflicts'] += 1
+                    logger.warning(f"⚠️ Outbox entry {outbox_id} conflicts with the primary: {error}")
+                else:
+                    summary['replayed'] += 1
+        if summary['batches']:
+            logger.info(f"✅ Replayed {summary['replayed']} fallback writes "
+                        f"({summary['conflicts']} conflicts, {summary['batches']} batches)")
+        return summary
+
+def get_outbox_status(fallback_engine, conflict_limit: int = 20) -> Dict:
+    """Outbox counts by status plus the most recent conflicts"""
+    with sessionmaker(bind=fallback_engine)() as session:
+        counts = dict(session.execute(
+            select(OutboxEntry.status, func.count()).group_by(OutboxEntry.status)
+        ).all())
+        conflicts = session.execute(
+            select(OutboxEntry.id, OutboxEntry.operation, OutboxEntry.payload,
+                   OutboxEntry.error, OutboxEntry.created_at, OutboxEntry.replayed_at)
+            .where(OutboxEntry.status == 'conflict')
+            .order_by(OutboxEntry.id.desc()).limit(conflict_limit)
+        ).all()
+    return {
+        'pending': counts.get('pending', 0),
+        'replayed': counts.get('replayed', 0),
+        'conflicts': counts.get('conflict', 0),
+        'recent_conflicts': [{
+            'id': row[0],
+            'operation': row[1],
+            'payload': row[2],
+            'error': row[3],
+            'created_at': row[4].isoformat() if row[4] else None,
+            'replayed_at': row[5].isoformat() if row[5] else None
+        } for row in conflicts]
+    }
@@ -0,0 +1,145 @@
+
+import os
+import json
+import uuid
+import decimal
+import logging
+import dataclasses
+from datetime import date
+from typing import Any, Dict, Iterable, Iterator, Optional
+from flask import Response, stream_with_context
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder with compact separators is used instead
+    orjson = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+JSON_ENCODERS = ('auto', 'orjson', 'stdlib')
+
+# Rows encoded per chunk when a large array is streamed
+STREAM_CHUNK_ROWS = 500
+
+def get_json_config() -> Dict:
+    """JSON_ENCODER, JSON_SORT_KEYS and JSON_STREAM_MIN_ROWS from the environment"""
+    encoder = os.getenv('JSON_ENCODER', 'auto').lower()
+    if encoder not in JSON_ENCODERS:
+        raise ValueError(f"JSON_ENCODER must be one of {', '.join(JSON_ENCODERS)}, not '{encoder}'")
+    if encoder == 'orjson' and orjson is None:
+        logger.warning("⚠️ JSON_ENCODER=orjson but orjson is not installed, using the stdlib encoder")
+    return {
+        'encoder': 'orjson' if encoder != 'stdlib' and orjson is not None else 'stdlib',
+        'sort_keys': os.getenv('JSON_SORT_KEYS', 'True').lower() == 'true',
+        'stream_min_rows': int(os.getenv('JSON_STREAM_MIN_ROWS', 1000))
+    }
+
+def _default(o: Any) -> Any:
+    """Types outside plain JSON, encoded the way Flask's default provider does"""
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+if orjson is not None:
+    # Datetimes and dataclasses go through _default so output matches the stdlib path
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+    _ORJSON_SORTED_OPTIONS = _ORJSON_OPTIONS | orjson.OPT_SORT_KEYS
+
+def dumps_bytes(obj: Any, sort_keys: bool = False, encoder: Optional[str] = None) -> bytes:
+    """Compact UTF-8 JSON for obj, with orjson when available"""
+    if (encoder or ('orjson' if orjson is not None else 'stdlib')) == 'orjson':
+        try:
+            return orjson.dumps(obj, default=_default,
+                                option=_ORJSON_SORTED_OPTIONS if sort_keys else _ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # Integers beyond 64 bits and the like: the stdlib encoder handles them
+            pass
+    return json.dumps(obj, default=_default, sort_keys=sort_keys, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+def dumps(obj: Any, sort_keys: bool = False, encoder: Optional[str] = None) -> str:
+    return dumps_bytes(obj, sort_keys, encoder).decode('utf-8')
+
+def loads(data) -> Any:
+    """Parse JSON text or bytes, with orjson when available"""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # NaN/Infinity and other stdlib-only extensions still parse as before
+            pass
+    return json.loads(data)
+
+def iter_json_object(envelope: Dict, key: str, rows: Iterable, sort_keys: bool = False,
+                     encoder: Optional[str] = None, chunk_rows: int = STREAM_CHUNK_ROWS) -> Iterator[bytes]:
+    """Encode envelope plus key: [rows...] as one JSON object, a chunk of rows at a time.
+
+    The array is written as the last member; rows are encoded in batches of
+    chunk_rows, so the whole document is never held in memory at once.
+    """
+    head = dumps_bytes(envelope, sort_keys, encoder)
+    yield head[:-1] + (b',' if envelope else b'') + dumps_bytes(key) + b':['
+    first = True
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk_rows:
+            yield (b'' if first else b',') + dumps_bytes(batch, sort_keys, encoder)[1:-1]
+            first = False
+            batch = []
+    if batch:
+        yield (b'' if first else b',') + dumps_bytes(batch, sort_keys, encoder)[1:-1]
+    yield b']}\n'
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider with compact output and a fast encoder when installed.
+
+    Keys stay sorted by default, like Flask's own provider, so responses
+    only lose their whitespace. Set JSON_SORT_KEYS=False to skip sorting.
+    """
+
+    mimetype = 'application/json'
+
+    def __init__(self, app):
+        super().__init__(app)
+        config = get_json_config()
+        self.encoder = config['encoder']
+        self.sort_keys = config['sort_keys']
+        self.stream_min_rows = config['stream_min_rows']
+
+    def dumps(self, obj: Any, **kwargs) -> str:
+        return dumps(obj, kwargs.pop('sort_keys', self.sort_keys), self.encoder)
+
+    def loads(self, s, **kwargs) -> Any:
+        return loads(s)
+
+    def response(self, *args, **kwargs) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj, self.sort_keys, self.encoder) + b'\n',
+                                         mimetype=self.mimetype)
+
+    def stream_response(self, envelope: Dict, key: str, rows: Iterable, count: int) -> Response:
+        """Response for envelope plus a rows array; streamed once count reaches stream_min_rows"""
+        if count < self.stream_min_rows:
+            return self.response({**envelope, key: list(rows)})
+        return self._app.response_class(
+            stream_with_context(iter_json_object(envelope, key, rows, self.sort_keys, self.encoder)),
+            mimetype=self.mimetype)
+
+    def get_info(self) -> Dict:
+        return {
+            'encoder': self.encoder,
+            'orjson_installed': orjson is not None,
+            'sort_keys': self.sort_keys,
+            'stream_min_rows': self.stream_min_rows
+        }
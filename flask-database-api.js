@@ -10,6 +10,9 @@ class FlaskDatabaseAPI {
         this.initialized = false;
         this.retryCount = 0;
         this.maxRetries = 3;
+        // Catalog copy kept current through /api/items/changes
+        this.catalogItems = null;
+        this.catalogVersion = 0;
     }
 
     /**
@@ -245,7 +248,6 @@ class FlaskDatabaseAPI {
             console.error('Error getting database info:', error);
             return { connected: false, database_type: 'Unknown' };
         }
-    }n false;
     }
 
     /**
@@ -287,7 +289,7 @@ class FlaskDatabaseAPI {
     }
 
     /**
-     * Get all items from database
+     * Get all items from database (the local catalog copy, brought up to date first)
      */
     async getAllItems() {
         try {
@@ -295,8 +297,8 @@ class FlaskDatabaseAPI {
                 throw new Error('API not initialized');
             }
 
-            const response = await this.makeRequest('/api/items');
-            return response.items || [];
+            await this.refreshCatalog();
+            return this.catalogItems.map(item => ({ ...item }));
         } catch (error) {
             console.error('Error getting all items:', error);
             if (this.localDB) {
@@ -340,8 +342,17 @@ class FlaskDatabaseAPI {
                 throw new Error('Missing required fields: category, name, and price');
             }
 
+            // One key per add, reused by makeRequest's retries so a retry never adds a duplicate
+            const idempotencyKey = window.crypto && window.crypto.randomUUID
+                ? window.crypto.randomUUID()
+                : `item-${Date.now()}-${Math.random().toString(36).slice(2)}`;
             const response = await this.makeRequest('/api/items', {
                 method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Accept': 'application/json',
+                    'Idempotency-Key': idempotencyKey
+                },
                 body: JSON.stringify(item)
             });
 
@@ -419,8 +430,18 @@ class FlaskDatabaseAPI {
                 throw new Error('Missing required fields: bill_number, total_amount, and items');
             }
 
+            // One key per save attempt, reused by makeRequest's retries so a retry never saves twice.
+            // Not derived from the bill number: a corrected resave or another terminal needs its own key.
+            const idempotencyKey = window.crypto && window.crypto.randomUUID
+                ? window.crypto.randomUUID()
+                : `bill-${Date.now()}-${Math.random().toString(36).slice(2)}`;
             const response = await this.makeRequest('/api/bills', {
                 method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Accept': 'application/json',
+                    'Idempotency-Key': idempotencyKey
+                },
                 body: JSON.stringify(billData)
             });
 
@@ -512,6 +533,96 @@ class FlaskDatabaseAPI {
         }
     }
 
+    /**
+     * Get catalog changes since a catalog version (delta sync).
+     * Returns { version, full_resync, items, deleted }; when full_resync is
+     * true, items is the whole catalog and replaces the local copy.
+     */
+    async getItemChanges(since = 0) {
+        try {
+            if (!this.initialized) {
+                throw new Error('API not initialized');
+            }
+
+            return await this.makeRequest(`/api/items/changes?since=${encodeURIComponent(since)}`);
+        } catch (error) {
+            console.error('Error getting catalog changes:', error);
+            throw error;
+        }
+    }
+
+    /**
+     * Bring the local catalog copy up to date from the last seen version.
+     * Applies upserted items and deleted ids; a full_resync answer (first
+     * load, or history pruned on the server) replaces the copy.
+     * Returns the number of items changed.
+     */
+    async refreshCatalog() {
+        const changes = await this.getItemChanges(this.catalogItems ? this.catalogVersion : 0);
+
+        if (changes.full_resync || !this.catalogItems) {
+            this.catalogItems = changes.items || [];
+        } else if (changes.count > 0) {
+            const deleted = new Set(changes.deleted);
+            const upserted = new Set(changes.items.map(item => item.id));
+            this.catalogItems = this.catalogItems
+                .filter(item => !deleted.has(item.id) && !upserted.has(item.id))
+                .concat(changes.items)
+                .sort((a, b) => a.category.localeCompare(b.category) || a.name.localeCompare(b.name));
+        }
+
+        this.catalogVersion = changes.version;
+        return changes.full_resync ? this.catalogItems.length : changes.count;
+    }
+
+    /**
+     * Allocate a bill number from the server-side department sequence
+     * ('outpatient' or 'inpatient'); numbers never collide across clients.
+     */
+    async allocateBillNumber(department = 'outpatient') {
+        try {
+            const response = await this.makeRequest('/api/bills/number', {
+                method: 'POST',
+                body: JSON.stringify({ department })
+            });
+            return response.bill_number;
+        } catch (error) {
+            console.error('Error allocating bill number:', error);
+            throw error;
+        }
+    }
+
+    /**
+     * Subscribe to server push events (catalog-change, bill-saved).
+     * Returns the EventSource; call close() on it to unsubscribe.
+     */
+    subscribeEvents(onEvent, types = ['catalog-change', 'bill-saved']) {
+        if (typeof EventSource === 'undefined') {
+            console.warn('⚠️ EventSource not supported, falling back to polling');
+            return null;
+        }
+
+        const source = new EventSource(`${this.baseUrl}/api/events?types=${encodeURIComponent(types.join(','))}`);
+        types.forEach(type => {
+            source.addEventListener(type, (event) => {
+                try {
+                    onEvent(type, JSON.parse(event.data));
+                } catch (error) {
+                    console.error(`Error handling ${type} event:`, error);
+                }
+            });
+        });
+        source.onerror = () => {
+            if (source.readyState === EventSource.CLOSED) {
+                // Refused (the WSGI server answers 503): the browser will not reconnect on its own
+                console.warn('⚠️ Event stream unavailable on this server, falling back to polling');
+            } else {
+                console.warn('⚠️ Event stream interrupted, reconnecting...');
+            }
+        };
+        return source;
+    }
+
     /**
      * Check API health
      */
@@ -1,76 +1,149 @@
 
 import sqlite3
 import json
+import time
+import os
 import logging
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Iterator
+import fast_json
+from database_backend import (HospitalDatabase, LazyDatabase, DuplicateBillNumberError, is_bill_number_conflict,
+                              get_item_changes_retention)
+from schema_migrations import SQLiteMigrator, latest_version, normalize_opd_number, upsert_patient_sql
+from bill_archive import (ARCHIVE_COLUMNS, archive_path, archives_in_range, decompress_items, get_archive_dir,
+                          next_month, open_archive, parse_month, write_archive)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class HospitalDB:
+ITEM_SELECT = '''
+    SELECT id, category, name, type, strength, price, description, created_at, updated_at
+    FROM items
+'''
+
+def _item_row_to_dict(row) -> Dict:
+    """Build the API item dict from an ITEM_SELECT row"""
+    return {
+        'id': row[0],
+        'category': row[1],
+        'name': row[2],
+        'type': row[3] or '',
+        'strength': row[4] or '',
+        'price': row[5],
+        'description': row[6] or '',
+        'created_at': row[7],
+        'updated_at': row[8]
+    }
+
+BILL_SELECT = '''
+    SELECT id, bill_number, patient_name, opd_number, total_amount, items_json, created_at
+    FROM bills
+'''
+
+def _bill_row_to_dict(row) -> Dict:
+    """Build the API bill dict from a BILL_SELECT row of the hot table or an archive"""
+    return {
+        'id': row[0],
+        'bill_number': row[1],
+        'patient_name': row[2],
+        'opd_number': row[3],
+        'total_amount': row[4],
+        'items': decompress_items(row[5]),
+        'created_at': row[6]
+    }
+
+MAINTENANCE_RUN_COLUMNS = ('id', 'window_key', 'source', 'status', 'tasks', 'results', 'worker',
+                           'started_at', 'finished_at', 'duration_ms')
+
+def _maintenance_run_row_to_dict(row) -> Dict:
+    """Build a maintenance run dict from a MAINTENANCE_RUN_COLUMNS row"""
+    run = dict(zip(MAINTENANCE_RUN_COLUMNS, row))
+    run['tasks'] = json.loads(run['tasks']) if run['tasks'] else []
+    run['results'] = json.loads(run['results']) if run['results'] else []
+    return run
+
+ARCHIVE_CATALOG_COLUMNS = ('month', 'location', 'first_id', 'last_id', 'bill_count', 'total_amount',
+                           'bytes', 'archived_at')
+
+JOB_COLUMNS = ('id', 'job_type', 'status', 'params', 'progress', 'message', 'result', 'error',
+               'cancel_requested', 'worker', 'created_at', 'started_at', 'finished_at')
+
+def _job_row_to_dict(row) -> Dict:
+    """Build a job dict from a JOB_COLUMNS row"""
+    job = dict(zip(JOB_COLUMNS, row))
+    job['params'] = json.loads(job['params']) if job['params'] else {}
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job['cancel_requested'] = bool(job['cancel_requested'])
+    return job
+
+PATIENT_COLUMNS = ('id', 'opd_number', 'name', 'created_at', 'updated_at')
+
+def _resolve_patients(cursor, bills: List[Dict]) -> Dict[str, int]:
+    """Patient id per OPD number for bills about to be saved, registering new patients"""
+    names = {}
+    for bill in bills:
+        opd = normalize_opd_number(bill.get('opd_number'))
+        if opd:
+            names[opd] = bill.get('patient_name') or names.get(opd, '')
+    if not names:
+        return {}
+    
+    cursor.executemany(upsert_patient_sql('sqlite'),
+                       [{'opd_number': opd, 'name': name} for opd, name in names.items()])
+    patient_ids = {}
+    opds = list(names)
+    # Stay under SQLite's bound parameter limit
+    for start in range(0, len(opds), 500):
+        chunk = opds[start:start + 500]
+        cursor.execute(f"SELECT opd_number, id FROM patients WHERE opd_number IN ({', '.join('?' * len(chunk))})",
+                       chunk)
+        patient_ids.update(cursor.fetchall())
+    return patient_ids
+
+class HospitalDB(HospitalDatabase):
     def __init__(self, db_path='hospital_billing_flask.db'):
         self.db_path = db_path
         self.connected = False
+        self.schema_version = 0
+        self.init_timings = {}
+        self.item_changes_retention = get_item_changes_retention()
         self._initialize_database()
     
+    def _get_stored_schema_version(self, cursor) -> int:
+        """Read the schema version stamped in the SQLite file header"""
+        cursor.execute('PRAGMA user_version')
+        return cursor.fetchone()[0]
+    
     def _initialize_database(self):
-        """Initialize the SQLite database and create tables"""
+        """Initialize the SQLite database and apply pending schema migrations"""
         try:
-            # Create database and tables
+            start = time.perf_counter()
             conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Create items table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS items (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    category TEXT NOT NULL,
-                    name TEXT NOT NULL,
-                    type TEXT,
-                    strength TEXT,
-                    price REAL NOT NULL,
-                    description TEXT,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Create bills table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS bills (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    bill_number TEXT UNIQUE NOT NULL,
-                    patient_name TEXT,
-                    opd_number TEXT,
-                    total_amount REAL NOT NULL,
-                    items_json TEXT,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Create settings table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT NOT NULL,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+            stored_version = self._get_stored_schema_version(conn.cursor())
+            conn.close()
+            self.init_timings['schema_check_ms'] = round((time.perf_counter() - start) * 1000, 2)
             
-            # Create indexes for better performance
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_items_category ON items(category)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_bills_number ON bills(bill_number)')
+            # Fast path: schema already up to date from an earlier start
+            if stored_version >= latest_version():
+                self.schema_version = stored_version
+                self.connected = True
+                return
             
-            conn.commit()
-            conn.close()
+            start = time.perf_counter()
+            applied = SQLiteMigrator(self.db_path).migrate()
+            self.init_timings['migrate_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            self.schema_version = latest_version()
             
             self.connected = True
-            logger.info("✅ SQLite database initialized successfully")
+            logger.info(f"✅ SQLite database initialized successfully (migrations applied: {applied})")
             
-            # Seed with sample data if needed
-            self._seed_sample_data()
+            # Seed with sample data if needed; only the process that created the
+            # tables (migration 1) seeds, so workers starting together don't seed twice
+            if 1 in applied:
+                start = time.perf_counter()
+                self._seed_sample_data()
+                self.init_timings['seed_ms'] = round((time.perf_counter() - start) * 1000, 2)
             
         except Exception as e:
             logger.error(f"❌ Database initialization failed: {e}")
@@ -114,8 +187,7 @@ class HospitalDB:
                 {'category': 'O2, ISO', 'name': 'ISO Service', 'type': 'Isoflurane Therapy', 'strength': 'Per minute', 'price': 30, 'description': 'Isoflurane therapy per minute'},
             ]
             
-            for item_data in sample_items:
-                self.add_item(item_data)
+            self.bulk_add_items(sample_items)
             
             logger.info(f"✅ Seeded database with {len(sample_items)} sample items")
             
@@ -140,24 +212,8 @@ class HospitalDB:
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, category, name, type, strength, price, description, created_at, updated_at
-                FROM items ORDER BY category, name
-            ''')
-            
-            items = []
-            for row in cursor.fetchall():
-                items.append({
-                    'id': row[0],
-                    'category': row[1],
-                    'name': row[2],
-                    'type': row[3] or '',
-                    'strength': row[4] or '',
-                    'price': row[5],
-                    'description': row[6] or '',
-                    'created_at': row[7],
-                    'updated_at': row[8]
-                })
+            cursor.execute(ITEM_SELECT + ' ORDER BY category, name')
+            items = [_item_row_to_dict(row) for row in cursor.fetchall()]
             
             conn.close()
             return items
@@ -170,24 +226,8 @@ class HospitalDB:
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, category, name, type, strength, price, description, created_at, updated_at
-                FROM items WHERE category = ? ORDER BY name
-            ''', (category,))
-            
-            items = []
-            for row in cursor.fetchall():
-                items.append({
-                    'id': row[0],
-                    'category': row[1],
-                    'name': row[2],
-                    'type': row[3] or '',
-                    'strength': row[4] or '',
-                    'price': row[5],
-                    'description': row[6] or '',
-                    'created_at': row[7],
-                    'updated_at': row[8]
-                })
+            cursor.execute(ITEM_SELECT + ' WHERE category = ? ORDER BY name', (category,))
+            items = [_item_row_to_dict(row) for row in cursor.fetchall()]
             
             conn.close()
             return items
@@ -213,6 +253,7 @@ class HospitalDB:
             ))
             
             item_id = cursor.lastrowid
+            self._record_item_changes(cursor, [item_id], 'upsert')
             conn.commit()
             conn.close()
             return item_id
@@ -220,6 +261,70 @@ class HospitalDB:
             logger.error(f"Error adding item: {e}")
             raise
     
+    def bulk_add_items(self, items: List[Dict]) -> int:
+        """Insert many items with a single executemany in one transaction"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            # Take the write lock first so every id above max_id is ours
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM items')
+            max_id = cursor.fetchone()[0]
+            cursor.executemany('''
+                INSERT INTO items (category, name, type, strength, price, description)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(
+                item['category'],
+                item['name'],
+                item.get('type', ''),
+                item.get('strength', ''),
+                item['price'],
+                item.get('description', '')
+            ) for item in items])
+            self._record_new_item_changes(cursor, max_id)
+            
+            conn.commit()
+            conn.close()
+            return len(items)
+        except Exception as e:
+            logger.error(f"Error bulk adding items: {e}")
+            raise
+    
+    def bulk_upsert_items(self, items: List[Dict]) -> int:
+        """Insert items, updating in place those whose 'id' already exists"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM items')
+            max_id = cursor.fetchone()[0]
+            cursor.executemany('''
+                INSERT INTO items (id, category, name, type, strength, price, description)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    category = excluded.category, name = excluded.name, type = excluded.type,
+                    strength = excluded.strength, price = excluded.price,
+                    description = excluded.description, updated_at = CURRENT_TIMESTAMP
+            ''', [(
+                item.get('id'),
+                item['category'],
+                item['name'],
+                item.get('type', ''),
+                item.get('strength', ''),
+                item['price'],
+                item.get('description', '')
+            ) for item in items])
+            updated_ids = [item['id'] for item in items if item.get('id') is not None and item['id'] <= max_id]
+            self._record_item_changes(cursor, updated_ids, 'upsert')
+            self._record_new_item_changes(cursor, max_id)
+            
+            conn.commit()
+            conn.close()
+            return len(items)
+        except Exception as e:
+            logger.error(f"Error bulk upserting items: {e}")
+            raise
+    
     def update_item(self, item_id: int, item_data: Dict) -> bool:
         """Update existing item"""
         try:
@@ -240,6 +345,8 @@ class HospitalDB:
             ))
             
             success = cursor.rowcount > 0
+            if success:
+                self._record_item_changes(cursor, [item_id], 'upsert')
             conn.commit()
             conn.close()
             return success
@@ -255,6 +362,8 @@ class HospitalDB:
             cursor.execute('DELETE FROM items WHERE id = ?', (item_id,))
             
             success = cursor.rowcount > 0
+            if success:
+                self._record_item_changes(cursor, [item_id], 'delete')
             conn.commit()
             conn.close()
             return success
@@ -262,51 +371,173 @@ class HospitalDB:
             logger.error(f"Error deleting item: {e}")
             raise
     
+    def _record_item_changes(self, cursor, item_ids: List[int], operation: str):
+        """Append change-log rows in the caller's transaction"""
+        cursor.executemany(
+            'INSERT INTO item_changes (item_id, operation) VALUES (?, ?)',
+            [(item_id, operation) for item_id in item_ids]
+        )
+        self._trim_item_changes(cursor)
+    
+    def _record_new_item_changes(self, cursor, max_id: int):
+        """Log every item inserted above max_id in the caller's transaction"""
+        cursor.execute('''
+            INSERT INTO item_changes (item_id, operation)
+            SELECT id, 'upsert' FROM items WHERE id > ? ORDER BY id
+        ''', (max_id,))
+        self._trim_item_changes(cursor)
+    
+    def _trim_item_changes(self, cursor):
+        """Drop change-log entries older than the retention horizon; clients behind it get a full resync"""
+        if self.item_changes_retention > 0:
+            cursor.execute('DELETE FROM item_changes WHERE version <= (SELECT MAX(version) FROM item_changes) - ?',
+                           (self.item_changes_retention,))
+    
+    def get_catalog_version(self) -> int:
+        """Latest item change-log version (0 if nothing changed yet)"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute('SELECT COALESCE(MAX(version), 0) FROM item_changes')
+            version = cursor.fetchone()[0]
+            conn.close()
+            return version
+        except Exception as e:
+            logger.error(f"Error getting catalog version: {e}")
+            raise
+    
+    def get_item_changes(self, since: int) -> Dict:
+        """Items upserted and ids deleted after catalog version `since`"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute('SELECT COALESCE(MIN(version), 0), COALESCE(MAX(version), 0) FROM item_changes')
+            min_version, version = cursor.fetchone()
+            
+            # Unknown or pruned history: the client has to replace its copy
+            if since <= 0 or since > version or since < min_version - 1:
+                cursor.execute(ITEM_SELECT + ' ORDER BY category, name')
+                items = [_item_row_to_dict(row) for row in cursor.fetchall()]
+                conn.close()
+                return {'version': version, 'full_resync': True, 'items': items, 'deleted': []}
+            
+            # Keep only the last operation per item
+            cursor.execute('SELECT item_id, operation FROM item_changes WHERE version > ? ORDER BY version', (since,))
+            last_operation = {item_id: operation for item_id, operation in cursor.fetchall()}
+            upserted = [item_id for item_id, op in last_operation.items() if op == 'upsert']
+            deleted = [item_id for item_id, op in last_operation.items() if op == 'delete']
+            
+            items = []
+            for start in range(0, len(upserted), 500):
+                chunk = upserted[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(ITEM_SELECT + f' WHERE id IN ({placeholders})', chunk)
+                items.extend(_item_row_to_dict(row) for row in cursor.fetchall())
+            
+            conn.close()
+            return {'version': version, 'full_resync': False, 'items': items, 'deleted': deleted}
+        except Exception as e:
+            logger.error(f"Error getting item changes: {e}")
+            raise
+    
     def save_bill(self, bill_data: Dict) -> int:
         """Save bill to database"""
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
+            patient_ids = _resolve_patients(cursor, [bill_data])
             cursor.execute('''
-                INSERT INTO bills (bill_number, patient_name, opd_number, total_amount, items_json)
-                VALUES (?, ?, ?, ?, ?)
+                INSERT INTO bills (bill_number, patient_name, opd_number, total_amount, items_json, patient_id)
+                VALUES (?, ?, ?, ?, ?, ?)
             ''', (
                 bill_data['bill_number'],
                 bill_data.get('patient_name', ''),
                 bill_data.get('opd_number', ''),
                 bill_data['total_amount'],
-                json.dumps(bill_data['items'])
+                fast_json.dumps(bill_data['items']),
+                patient_ids.get(normalize_opd_number(bill_data.get('opd_number')))
             ))
             
             bill_id = cursor.lastrowid
             conn.commit()
             conn.close()
             return bill_id
+        except sqlite3.IntegrityError as e:
+            conn.close()
+            if is_bill_number_conflict(e):
+                raise DuplicateBillNumberError(f"Bill number '{bill_data['bill_number']}' is already used") from e
+            logger.error(f"Error saving bill: {e}")
+            raise
         except Exception as e:
             logger.error(f"Error saving bill: {e}")
             raise
     
-    def get_bills(self, limit: int = 50) -> List[Dict]:
-        """Get recent bills"""
+    def bulk_save_bills(self, bills: List[Dict]) -> int:
+        """Insert many bills with a single executemany in one transaction"""
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
+            patient_ids = _resolve_patients(cursor, bills)
+            cursor.executemany('''
+                INSERT INTO bills (bill_number, patient_name, opd_number, total_amount, items_json, patient_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(
+                bill['bill_number'],
+                bill.get('patient_name', ''),
+                bill.get('opd_number', ''),
+                bill['total_amount'],
+                fast_json.dumps(bill['items']),
+                patient_ids.get(normalize_opd_number(bill.get('opd_number')))
+            ) for bill in bills])
+            
+            conn.commit()
+            conn.close()
+            return len(bills)
+        except sqlite3.IntegrityError as e:
+            conn.close()
+            if is_bill_number_conflict(e):
+                raise DuplicateBillNumberError('A bill number in this batch is already used') from e
+            logger.error(f"Error bulk saving bills: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Error bulk saving bills: {e}")
+            raise
+    
+    def reserve_bill_numbers(self, department: str, count: int) -> int:
+        """Reserve a block of sequence values for a department in one write transaction"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('INSERT OR IGNORE INTO bill_sequences (department, next_value) VALUES (?, 1)',
+                           (department,))
             cursor.execute('''
-                SELECT id, bill_number, patient_name, opd_number, total_amount, items_json, created_at
-                FROM bills ORDER BY created_at DESC LIMIT ?
-            ''', (limit,))
-            
-            bills = []
-            for row in cursor.fetchall():
-                bills.append({
-                    'id': row[0],
-                    'bill_number': row[1],
-                    'patient_name': row[2],
-                    'opd_number': row[3],
-                    'total_amount': row[4],
-                    'items': json.loads(row[5]) if row[5] else [],
-                    'created_at': row[6]
-                })
+                UPDATE bill_sequences SET next_value = next_value + ?, updated_at = CURRENT_TIMESTAMP
+                WHERE department = ?
+            ''', (count, department))
+            cursor.execute('SELECT next_value FROM bill_sequences WHERE department = ?', (department,))
+            first = cursor.fetchone()[0] - count
+            
+            conn.commit()
+            conn.close()
+            return first
+        except Exception as e:
+            logger.error(f"Error reserving bill numbers: {e}")
+            raise
+    
+    def get_bills(self, limit: int = 50) -> List[Dict]:
+        """Get recent bills, reading archives only when the hot table has fewer than limit"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute(BILL_SELECT + ' ORDER BY created_at DESC LIMIT ?', (limit,))
+            bills = [_bill_row_to_dict(row) for row in cursor.fetchall()]
+            
+            if len(bills) < limit:
+                for archive in reversed(self._list_archives(cursor)):
+                    bills.extend(self._read_archive(archive, ' ORDER BY created_at DESC LIMIT ?', (limit - len(bills),)))
+                    if len(bills) >= limit:
+                        break
             
             conn.close()
             return bills
@@ -314,6 +545,413 @@ class HospitalDB:
             logger.error(f"Error getting bills: {e}")
             raise
     
+    def get_bill(self, bill_id: int) -> Optional[Dict]:
+        """Get one bill by id, from the hot table or the archive whose id range covers it"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute(BILL_SELECT + ' WHERE id = ?', (bill_id,))
+            row = cursor.fetchone()
+            if row is not None:
+                conn.close()
+                return _bill_row_to_dict(row)
+            
+            cursor.execute(f"SELECT {', '.join(ARCHIVE_CATALOG_COLUMNS)} FROM bill_archives "
+                           'WHERE first_id <= ? AND last_id >= ?', (bill_id, bill_id))
+            archives = [dict(zip(ARCHIVE_CATALOG_COLUMNS, row)) for row in cursor.fetchall()]
+            conn.close()
+            for archive in archives:
+                bills = self._read_archive(archive, ' WHERE id = ?', (bill_id,))
+                if bills:
+                    return bills[0]
+            return None
+        except Exception as e:
+            logger.error(f"Error getting bill: {e}")
+            raise
+    
+    def get_patient(self, opd_number: str) -> Optional[Dict]:
+        """Get a patient by exact OPD number"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {', '.join(PATIENT_COLUMNS)} FROM patients WHERE opd_number = ?",
+                           (normalize_opd_number(opd_number),))
+            row = cursor.fetchone()
+            conn.close()
+            return dict(zip(PATIENT_COLUMNS, row)) if row else None
+        except Exception as e:
+            logger.error(f"Error getting patient: {e}")
+            raise
+    
+    def find_patients(self, prefix: str, limit: int = 20) -> List[Dict]:
+        """Patients whose OPD number starts with prefix, as an index range scan"""
+        try:
+            prefix = normalize_opd_number(prefix)
+            query = f"SELECT {', '.join(PATIENT_COLUMNS)} FROM patients"
+            params = []
+            if prefix:
+                # A range rather than LIKE, which SQLite only runs on the index under narrow conditions
+                query += ' WHERE opd_number >= ? AND opd_number < ?'
+                params = [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute(query + ' ORDER BY opd_number LIMIT ?', params + [limit])
+            patients = [dict(zip(PATIENT_COLUMNS, row)) for row in cursor.fetchall()]
+            conn.close()
+            return patients
+        except Exception as e:
+            logger.error(f"Error finding patients: {e}")
+            raise
+    
+    def get_patient_bills(self, patient_id: int, limit: int = 50) -> List[Dict]:
+        """A patient's most recent bills through the (patient_id, created_at) index, newest partition first"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute(BILL_SELECT + ' WHERE patient_id = ? ORDER BY created_at DESC LIMIT ?',
+                           (patient_id, limit))
+            bills = [_bill_row_to_dict(row) for row in cursor.fetchall()]
+            
+            if len(bills) < limit:
+                for archive in reversed(self._list_archives(cursor)):
+                    bills.extend(self._read_archive(archive, ' WHERE patient_id = ? ORDER BY created_at DESC LIMIT ?',
+                                                    (patient_id, limit - len(bills))))
+                    if len(bills) >= limit:
+                        break
+            
+            conn.close()
+            return bills
+        except Exception as e:
+            logger.error(f"Error getting patient bills: {e}")
+            raise
+    
+    def iter_bills(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                   batch_size: int = 1000) -> Iterator[Dict]:
+        """Stream bills oldest first: the archives the range touches, then the hot table"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conditions, params = [], []
+            if since:
+                conditions.append('created_at >= ?')
+                params.append(since.strftime('%Y-%m-%d %H:%M:%S'))
+            if until:
+                conditions.append('created_at < ?')
+                params.append(until.strftime('%Y-%m-%d %H:%M:%S'))
+            clause = (' WHERE ' + ' AND '.join(conditions) if conditions else '') + ' ORDER BY id'
+            
+            for archive in archives_in_range(self._list_archives(conn.cursor()), since, until):
+                archive_conn = open_archive(self._archive_location(archive))
+                try:
+                    yield from self._iter_rows(archive_conn.execute(BILL_SELECT + clause, params), batch_size)
+                finally:
+                    archive_conn.close()
+            
+            yield from self._iter_rows(conn.execute(BILL_SELECT + clause, params), batch_size)
+        except Exception as e:
+            logger.error(f"Error streaming bills: {e}")
+            raise
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def _iter_rows(cursor, batch_size: int) -> Iterator[Dict]:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield _bill_row_to_dict(row)
+    
+    def _archive_location(self, archive: Dict) -> str:
+        """Archive file path; relative locations are under the database's directory"""
+        return os.path.join(os.path.dirname(os.path.abspath(self.db_path)), archive['location'])
+    
+    def _list_archives(self, cursor) -> List[Dict]:
+        cursor.execute(f"SELECT {', '.join(ARCHIVE_CATALOG_COLUMNS)} FROM bill_archives ORDER BY month")
+        return [dict(zip(ARCHIVE_CATALOG_COLUMNS, row)) for row in cursor.fetchall()]
+    
+    def _read_archive(self, archive: Dict, clause: str, params: tuple) -> List[Dict]:
+        """Run BILL_SELECT + clause against one archive file"""
+        conn = open_archive(self._archive_location(archive))
+        try:
+            return [_bill_row_to_dict(row) for row in conn.execute(BILL_SELECT + clause, params)]
+        finally:
+            conn.close()
+    
+    def list_bill_archives(self) -> List[Dict]:
+        """Archived months, oldest first"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            archives = self._list_archives(conn.cursor())
+            conn.close()
+            return archives
+        except Exception as e:
+            logger.error(f"Error listing bill archives: {e}")
+            raise
+    
+    def archive_bills(self, before: datetime, progress: Optional[Callable[[int, int], None]] = None) -> List[Dict]:
+        """Move bills created before `before` into one read-only archive file per month"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cutoff = before.strftime('%Y-%m-%d %H:%M:%S')
+            cursor.execute('SELECT DISTINCT substr(created_at, 1, 7) FROM bills WHERE created_at < ? ORDER BY 1',
+                           (cutoff,))
+            months = [row[0] for row in cursor.fetchall()]
+            archives = {archive['month']: archive for archive in self._list_archives(cursor)}
+            db_dir = os.path.dirname(os.path.abspath(self.db_path))
+            archive_dir = os.path.join(db_dir, get_archive_dir())
+            
+            archived = []
+            for index, month in enumerate(months):
+                start = parse_month(month)
+                bounds = (start.strftime('%Y-%m-%d %H:%M:%S'),
+                          min(next_month(start), before).strftime('%Y-%m-%d %H:%M:%S'))
+                path = archive_path(archive_dir, month)
+                previous = self._archive_location(archives[month]) if month in archives else None
+                rows = conn.execute(f'SELECT {ARCHIVE_COLUMNS} FROM bills '
+                                    'WHERE created_at >= ? AND created_at < ? ORDER BY id', bounds)
+                summary = write_archive(path, rows, previous=previous)
+                
+                # Catalog the file and drop the hot rows in one transaction; a crash before
+                # this commit leaves the rows hot and the next run rewrites the file
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute(f'''
+                    INSERT OR REPLACE INTO bill_archives ({', '.join(ARCHIVE_CATALOG_COLUMNS)})
+                    VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (month, os.path.relpath(path, db_dir), summary['first_id'], summary['last_id'],
+                      summary['bill_count'], summary['total_amount'], summary['bytes']))
+                cursor.execute('DELETE FROM bills WHERE created_at >= ? AND created_at < ? AND id <= ?',
+                               bounds + (summary['last_id'],))
+                moved = cursor.rowcount
+                conn.commit()
+                
+                logger.info(f"🗄️ Archived {moved} bills from {month} to {path} ({summary['bytes']} bytes)")
+                archived.append({'month': month, 'moved': moved, **summary})
+                if progress:
+                    progress(index + 1, len(months))
+            
+            conn.close()
+            return archived
+        except Exception as e:
+            logger.error(f"Error archiving bills: {e}")
+            raise
+    
+    def claim_idempotency_key(self, key: str, request_hash: str, expires_at: float) -> Optional[Dict]:
+        """Claim a key in one write transaction, or return the live record holding it"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT request_hash, status_code, response_body, expires_at
+                FROM idempotency_keys WHERE idempotency_key = ?
+            ''', (key,))
+            row = cursor.fetchone()
+            if row and row[3] > time.time():
+                conn.rollback()
+                conn.close()
+                return {'request_hash': row[0], 'status_code': row[1], 'response_body': row[2], 'expires_at': row[3]}
+            
+            cursor.execute('''
+                INSERT OR REPLACE INTO idempotency_keys (idempotency_key, request_hash, status_code, response_body, expires_at)
+                VALUES (?, ?, NULL, NULL, ?)
+            ''', (key, request_hash, expires_at))
+            
+            conn.commit()
+            conn.close()
+            return None
+        except Exception as e:
+            logger.error(f"Error claiming idempotency key: {e}")
+            raise
+    
+    def complete_idempotency_key(self, key: str, status_code: int, response_body: str, expires_at: float):
+        """Store the response for a claimed key"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE idempotency_keys SET status_code = ?, response_body = ?, expires_at = ?
+                WHERE idempotency_key = ?
+            ''', (status_code, response_body, expires_at, key))
+            
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error completing idempotency key: {e}")
+            raise
+    
+    def release_idempotency_key(self, key: str):
+        """Drop an unfinished claim so the request can be retried"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM idempotency_keys WHERE idempotency_key = ? AND status_code IS NULL', (key,))
+            
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error releasing idempotency key: {e}")
+            raise
+    
+    def purge_idempotency_keys(self, now: float) -> int:
+        """Delete expired idempotency keys"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM idempotency_keys WHERE expires_at < ?', (now,))
+            purged = cursor.rowcount
+            
+            conn.commit()
+            conn.close()
+            return purged
+        except Exception as e:
+            logger.error(f"Error purging idempotency keys: {e}")
+            raise
+    
+    def create_job(self, job: Dict):
+        """Insert a new background job row"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO jobs (id, job_type, status, params, message, worker, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                job['id'],
+                job['job_type'],
+                job['status'],
+                json.dumps(job.get('params') or {}),
+                job.get('message'),
+                job.get('worker'),
+                job['created_at']
+            ))
+            
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error creating job: {e}")
+            raise
+    
+    def update_job(self, job_id: str, fields: Dict) -> bool:
+        """Update the given job columns"""
+        try:
+            columns = [column for column in fields if column in JOB_COLUMNS and column != 'id']
+            values = [json.dumps(fields[column]) if column in ('params', 'result') else fields[column]
+                      for column in columns]
+            
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute(
+                f"UPDATE jobs SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?",
+                values + [job_id]
+            )
+            updated = cursor.rowcount > 0
+            
+            conn.commit()
+            conn.close()
+            return updated
+        except Exception as e:
+            logger.error(f"Error updating job: {e}")
+            raise
+    
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Get one job by id"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            
+            conn.close()
+            return _job_row_to_dict(row) if row else None
+        except Exception as e:
+            logger.error(f"Error getting job: {e}")
+            raise
+    
+    def list_jobs(self, limit: int = 50, statuses: Optional[List[str]] = None) -> List[Dict]:
+        """Get recent jobs, newest first"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            query = f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs"
+            params = []
+            if statuses:
+                query += f" WHERE status IN ({', '.join('?' for _ in statuses)})"
+                params.extend(statuses)
+            cursor.execute(query + ' ORDER BY created_at DESC LIMIT ?', params + [limit])
+            jobs = [_job_row_to_dict(row) for row in cursor.fetchall()]
+            
+            conn.close()
+            return jobs
+        except Exception as e:
+            logger.error(f"Error listing jobs: {e}")
+            raise
+    
+    def start_maintenance_run(self, run: Dict) -> Optional[int]:
+        """Insert a running maintenance run; None if its window_key is already taken"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    INSERT INTO maintenance_runs (window_key, source, status, tasks, worker, started_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (
+                    run.get('window_key'),
+                    run['source'],
+                    run['status'],
+                    json.dumps(run.get('tasks') or []),
+                    run.get('worker'),
+                    run['started_at']
+                ))
+            except sqlite3.IntegrityError:
+                conn.close()
+                return None
+            run_id = cursor.lastrowid
+            
+            conn.commit()
+            conn.close()
+            return run_id
+        except Exception as e:
+            logger.error(f"Error starting maintenance run: {e}")
+            raise
+    
+    def finish_maintenance_run(self, run_id: int, fields: Dict):
+        """Store a maintenance run's status, results and timings"""
+        try:
+            columns = [column for column in fields if column in MAINTENANCE_RUN_COLUMNS and column != 'id']
+            values = [json.dumps(fields[column]) if column in ('tasks', 'results') else fields[column]
+                      for column in columns]
+            
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute(
+                f"UPDATE maintenance_runs SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?",
+                values + [run_id]
+            )
+            
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.error(f"Error finishing maintenance run: {e}")
+            raise
+    
+    def list_maintenance_runs(self, limit: int = 20) -> List[Dict]:
+        """Get recent maintenance runs, newest first"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {', '.join(MAINTENANCE_RUN_COLUMNS)} FROM maintenance_runs "
+                           'ORDER BY started_at DESC LIMIT ?', (limit,))
+            runs = [_maintenance_run_row_to_dict(row) for row in cursor.fetchall()]
+            
+            conn.close()
+            return runs
+        except Exception as e:
+            logger.error(f"Error listing maintenance runs: {e}")
+            raise
+    
     def get_statistics(self) -> Dict:
         """Get database statistics"""
         try:
@@ -338,6 +976,13 @@ class HospitalDB:
             cursor.execute('SELECT COALESCE(SUM(total_amount), 0) FROM bills')
             stats['total_revenue'] = cursor.fetchone()[0]
             
+            # Archived months are counted from their catalog rows, not scanned
+            cursor.execute('SELECT COALESCE(SUM(bill_count), 0), COALESCE(SUM(total_amount), 0) FROM bill_archives')
+            archived_bills, archived_revenue = cursor.fetchone()
+            stats['archived_bills'] = archived_bills
+            stats['total_bills'] += archived_bills
+            stats['total_revenue'] += archived_revenue
+            
             conn.close()
             return stats
         except Exception as e:
@@ -349,8 +994,14 @@ class HospitalDB:
         return {
             'connected': self.connected,
             'database_type': 'SQLite',
-            'database_path': self.db_path
+            'database_path': self.db_path,
+            'schema_version': self.schema_version,
+            'init_timings': self.init_timings,
+            'pool': {
+                'pool_class': None,
+                'mode': 'one sqlite3 connection per operation'
+            }
         }
 
-# Global database instance
-db = HospitalDB()
+# Global database instance, created lazily in each worker process
+db = LazyDatabase(HospitalDB, 'SQLite database')
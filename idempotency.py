@@ -0,0 +1,206 @@
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import wraps
+from typing import Dict, Optional, Tuple
+from flask import request, jsonify, make_response, Response
+from database_backend import db
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+class IdempotencyStore:
+    """Responses to write requests, keyed by the client's Idempotency-Key.
+
+    Completed responses live in a bounded, TTL-evicting in-memory LRU in
+    front of the idempotency_keys table, so a retry storm against one worker
+    is answered from memory and other workers answer from one primary-key
+    lookup. A key is claimed in the database before the write runs; a
+    duplicate arriving while the first request is still running sees the
+    claim and is told to retry. Claims expire after claim_seconds, so a
+    worker that dies mid-request does not block its key for the full TTL.
+    """
+
+    def __init__(self, database, ttl_seconds: float = 86400, max_entries: int = 10000,
+                 claim_seconds: float = 60, purge_interval: float = 300):
+        self.database = database
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.claim_seconds = claim_seconds
+        self.purge_interval = purge_interval
+        self.memory_hits = 0
+        self.database_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def _remember(self, key: str, record: Dict):
+        with self._lock:
+            self._entries[key] = record
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _recall(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            record = self._entries.get(key)
+            if record is None:
+                return None
+            if record['expires_at'] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return record
+
+    def _purge_if_due(self):
+        now = time.time()
+        if now - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = now
+        try:
+            purged = self.database.purge_idempotency_keys(now)
+            if purged:
+                logger.info(f"🧹 Purged {purged} expired idempotency keys")
+        except Exception as e:
+            logger.warning(f"⚠️ Could not purge idempotency keys: {e}")
+
+    def begin(self, key: str, request_hash: str) -> Tuple[str, Optional[Dict]]:
+        """Start a request: ('new' | 'replay' | 'in_progress' | 'mismatch', record)"""
+        record = self._recall(key)
+        if record is not None:
+            self.memory_hits += 1
+        else:
+            self._purge_if_due()
+            record = self.database.claim_idempotency_key(key, request_hash, time.time() + self.claim_seconds)
+            if record is None:
+                self.misses += 1
+                return 'new', None
+            self.database_hits += 1
+            if record['status_code'] is not None:
+                self._remember(key, record)
+
+        if record['request_hash'] != request_hash:
+            return 'mismatch', record
+        if record['status_code'] is None:
+            return 'in_progress', record
+        return 'replay', record
+
+    def complete(self, key: str, request_hash: str, status_code: int, response_body: str):
+        """Store the finished response for replays"""
+        expires_at = time.time() + self.ttl_seconds
+        self.database.complete_idempotency_key(key, status_code, response_body, expires_at)
+        self._remember(key, {'request_hash': request_hash, 'status_code': status_code,
+                             'response_body': response_body, 'expires_at': expires_at})
+
+    def release(self, key: str):
+        """Forget a claim whose request failed"""
+        self.database.release_idempotency_key(key)
+
+    def get_info(self) -> Dict:
+        """Store statistics for this worker"""
+        return {
+            'pid': os.getpid(),
+            'cached_responses': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'memory_hits': self.memory_hits,
+            'database_hits': self.database_hits,
+            'misses': self.misses
+        }
+
+_store = None
+_store_pid = None
+_store_lock = threading.Lock()
+
+def get_idempotency_store() -> IdempotencyStore:
+    """Return this worker's store, creating it after fork if needed"""
+    global _store, _store_pid
+    pid = os.getpid()
+    if _store is None or _store_pid != pid:
+        with _store_lock:
+            if _store is None or _store_pid != pid:
+                _store = IdempotencyStore(
+                    db,
+                    ttl_seconds=float(os.getenv('IDEMPOTENCY_TTL_SECONDS', 86400)),
+                    max_entries=int(os.getenv('IDEMPOTENCY_CACHE_SIZE', 10000))
+                )
+                _store_pid = pid
+    return _store
+
+def idempotent(view):
+    """Make a write endpoint safe to retry with an Idempotency-Key header.
+
+    Requests without the header run as before. A repeated key with the same
+    body gets the original response back without running the view again.
+    Only successful responses are stored: after a 4xx or 5xx the key is
+    released, so a corrected payload or a retry can go through under it.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid Idempotency-Key',
+                'message': f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters'
+            }), 400
+
+        request_hash = hashlib.sha256(
+            request.method.encode() + request.path.encode() + b'\n' + request.get_data()
+        ).hexdigest()
+
+        store = get_idempotency_store()
+        try:
+            outcome, record = store.begin(key, request_hash)
+        except Exception as e:
+            # The write path reports database trouble itself; don't add a second failure
+            logger.warning(f"⚠️ Idempotency store unavailable, running request without it: {e}")
+            return view(*args, **kwargs)
+
+        if outcome == 'replay':
+            response = Response(record['response_body'], status=record['status_code'], mimetype='application/json')
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        if outcome == 'mismatch':
+            return jsonify({
+                'success': False,
+                'error': 'Idempotency-Key reused with a different request',
+                'message': 'Use a new Idempotency-Key for a different request'
+            }), 422
+        if outcome == 'in_progress':
+            response = jsonify({
+                'success': False,
+                'error': 'Request with this Idempotency-Key is still in progress',
+                'message': 'Retry shortly to get the original response'
+            })
+            response.status_code = 409
+            response.headers['Retry-After'] = '1'
+            return response
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            store.release(key)
+            raise
+
+        try:
+            if response.status_code < 400:
+                store.complete(key, request_hash, response.status_code, response.get_data(as_text=True))
+            else:
+                store.release(key)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not store idempotent response for key {key}: {e}")
+        return response
+
+    return wrapper
@@ -91,7 +91,28 @@ function initInpatientAppWithoutDatabase() {
 
 // Generate unique bill number
 function generateBillNumber() {
-    const billNumber = 'IP-' + new Date().getFullYear() + '-' + String(Date.now()).slice(-6);
+    // Provisional numbers use a prefix the server sequence never issues (IP-{year}-{seq}),
+    // so a bill saved offline cannot collide with a number allocated later
+    const billNumber = 'IP-TMP-' + new Date().getFullYear() + '-' + String(Date.now()).slice(-6) +
+        Math.random().toString(36).slice(2, 5).toUpperCase();
+    setInpatientBillNumber(billNumber);
+
+    // Replace the provisional number with one from the server sequence when online
+    fetch('/api/bills/number', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ department: 'inpatient' })
+    })
+        .then(response => response.ok ? response.json() : null)
+        .then(result => {
+            if (result && result.success) {
+                setInpatientBillNumber(result.bill_number);
+            }
+        })
+        .catch(() => console.warn('Bill number service unavailable, keeping local bill number'));
+}
+
+function setInpatientBillNumber(billNumber) {
     const billNumberInput = document.getElementById('billNumber');
     if (billNumberInput) {
         billNumberInput.value = billNumber;
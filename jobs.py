@@ -0,0 +1,445 @@
+
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+from database_backend import db, get_backend_name
+from bill_render import RENDER_FORMATS, write_batch
+from bill_archive import archive_cutoff
+from maintenance import execute_run
+from schema_migrations import DATA_MIGRATIONS, DataMigrationRunner, SQLiteMigrator, SQLAlchemyMigrator
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Job lifecycle: queued -> running -> succeeded | failed | cancelled
+FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+# Registered job types: name -> {'handler', 'max_concurrent', 'description'}
+JOB_TYPES: Dict[str, Dict] = {}
+
+def register_job(name: str, max_concurrent: int = 1, description: str = ''):
+    """Register a job handler taking (context, params) and returning a JSON-able result"""
+    def decorator(handler: Callable):
+        JOB_TYPES[name] = {'handler': handler, 'max_concurrent': max_concurrent, 'description': description}
+        return handler
+    return decorator
+
+class JobCancelled(Exception):
+    """Raised inside a handler when its job has been cancelled"""
+
+class JobQueueFull(Exception):
+    """Raised when a worker already holds the maximum number of queued jobs"""
+
+class JobContext:
+    """Handed to job handlers for progress reporting and cancellation checks"""
+
+    def __init__(self, job_queue: 'JobQueue', job_id: str, cancel_check_interval: float = 1.0):
+        self.job_queue = job_queue
+        self.job_id = job_id
+        self.cancel_check_interval = cancel_check_interval
+        self._last_check = time.monotonic()
+
+    def progress(self, fraction: float, message: Optional[str] = None):
+        """Record progress (0..1); raises JobCancelled if the job was cancelled"""
+        fields = {'progress': round(max(0.0, min(1.0, fraction)), 4)}
+        if message is not None:
+            fields['message'] = message
+        self.job_queue.database.update_job(self.job_id, fields)
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        """Raise JobCancelled if cancellation was requested, polling the database at most once a second"""
+        if self.job_id in self.job_queue.cancelled_locally:
+            raise JobCancelled()
+        now = time.monotonic()
+        if now - self._last_check < self.cancel_check_interval:
+            return
+        self._last_check = now
+        job = self.job_queue.database.get_job(self.job_id)
+        if job is None or job['cancel_requested']:
+            raise JobCancelled()
+
+class JobQueue:
+    """Per-worker background job runner backed by the jobs table.
+
+    Jobs are persisted when submitted and run on a small pool of daemon
+    threads, so a request only pays for one insert. Each job type has its
+    own concurrency limit on top of the pool size: an idle worker takes the
+    oldest job whose type has a free slot and otherwise sleeps until a job
+    is queued or one finishes, so a type at its limit neither holds a
+    thread nor blocks other types. Progress, results and errors
+    live in the database, so any worker can answer status polls, and
+    cancellation is a flag handlers observe through their context.
+    """
+
+    def __init__(self, database, max_workers: int = 2, max_queued: int = 20, output_dir: str = 'backups'):
+        self.database = database
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.output_dir = output_dir
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.cancelled_locally = set()
+        self.completed = 0
+        self.failed = 0
+        self._pending = deque()
+        self._waiting = 0
+        self._running = {}
+        self._running_by_type = {}
+        self._threads = []
+        self._lock = threading.Lock()
+        # Signalled when a job is queued or a type slot frees up
+        self._ready = threading.Condition(self._lock)
+        self._recovered = False
+
+    def _start_workers(self):
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.max_workers):
+                thread = threading.Thread(target=self._work, name=f'job-worker-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"🧵 Started {self.max_workers} job workers in process {os.getpid()}")
+
+    def recover_orphans(self):
+        """Fail jobs left queued or running by a process on this host that no longer exists"""
+        host = socket.gethostname()
+        recovered = 0
+        for job in self.database.list_jobs(limit=1000, statuses=['queued', 'running']):
+            worker_host, _, pid = (job['worker'] or '').rpartition(':')
+            if worker_host != host or not pid.isdigit() or _process_alive(int(pid)):
+                continue
+            self.database.update_job(job['id'], {
+                'status': 'failed',
+                'error': 'Worker process exited before the job finished',
+                'finished_at': time.time()
+            })
+            recovered += 1
+        if recovered:
+            logger.warning(f"⚠️ Marked {recovered} orphaned jobs as failed")
+        return recovered
+
+    def submit(self, job_type: str, params: Optional[Dict] = None) -> Dict:
+        """Persist a job and queue it; raises ValueError or JobQueueFull"""
+        if job_type not in JOB_TYPES:
+            raise ValueError(f"Unknown job type '{job_type}'")
+
+        if not self._recovered:
+            self._recovered = True
+            try:
+                self.recover_orphans()
+            except Exception as e:
+                logger.warning(f"⚠️ Could not recover orphaned jobs: {e}")
+
+        with self._lock:
+            if self._waiting >= self.max_queued:
+                raise JobQueueFull(f'{self._waiting} jobs are already queued in this worker')
+            self._waiting += 1
+
+        job = {
+            'id': str(uuid.uuid4()),
+            'job_type': job_type,
+            'status': 'queued',
+            'params': params or {},
+            'message': 'Waiting for a worker',
+            'worker': self.worker_id,
+            'created_at': time.time()
+        }
+        try:
+            self.database.create_job(job)
+        except Exception:
+            with self._lock:
+                self._waiting -= 1
+            raise
+
+        self._start_workers()
+        with self._ready:
+            self._pending.append(job)
+            self._ready.notify()
+        logger.info(f"📥 Queued {job_type} job {job['id']}")
+        return self.database.get_job(job['id'])
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """Request cancellation; queued jobs are cancelled at once, running ones at their next check"""
+        job = self.database.get_job(job_id)
+        if job is None or job['status'] in FINISHED_STATUSES:
+            return job
+        fields = {'cancel_requested': True}
+        if job['status'] == 'queued':
+            fields.update({'status': 'cancelled', 'message': 'Cancelled before it started', 'finished_at': time.time()})
+        self.database.update_job(job_id, fields)
+        if job_id in self._running:
+            self.cancelled_locally.add(job_id)
+        return self.database.get_job(job_id)
+
+    def _take_next(self) -> Dict:
+        """Block until the oldest queued job whose type is under its limit can start, and claim its slot"""
+        with self._ready:
+            while True:
+                for job in self._pending:
+                    job_type = job['job_type']
+                    if self._running_by_type.get(job_type, 0) < JOB_TYPES[job_type]['max_concurrent']:
+                        self._pending.remove(job)
+                        self._waiting -= 1
+                        self._running[job['id']] = job_type
+                        self._running_by_type[job_type] = self._running_by_type.get(job_type, 0) + 1
+                        return job
+                self._ready.wait()
+
+    def _work(self):
+        while True:
+            job = self._take_next()
+            try:
+                self._run(job)
+            finally:
+                with self._ready:
+                    self._running.pop(job['id'], None)
+                    self._running_by_type[job['job_type']] -= 1
+                    # A job of this type may be waiting behind the one that just finished
+                    self._ready.notify()
+
+    def _run(self, job: Dict):
+        job_id = job['id']
+        try:
+            current = self.database.get_job(job_id)
+            if current is None or current['status'] != 'queued':
+                return
+
+            self.database.update_job(job_id, {'status': 'running', 'started_at': time.time(), 'message': 'Running'})
+            context = JobContext(self, job_id)
+            start = time.perf_counter()
+            result = JOB_TYPES[job['job_type']]['handler'](context, job['params'])
+            self.database.update_job(job_id, {
+                'status': 'succeeded',
+                'progress': 1.0,
+                'message': 'Completed',
+                'result': result,
+                'finished_at': time.time()
+            })
+            self.completed += 1
+            logger.info(f"✅ {job['job_type']} job {job_id} finished in {time.perf_counter() - start:.2f}s")
+        except JobCancelled:
+            self.database.update_job(job_id, {'status': 'cancelled', 'message': 'Cancelled', 'finished_at': time.time()})
+            logger.info(f"🛑 {job['job_type']} job {job_id} cancelled")
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"❌ {job['job_type']} job {job_id} failed: {e}")
+            try:
+                self.database.update_job(job_id, {'status': 'failed', 'error': str(e), 'finished_at': time.time()})
+            except Exception as update_error:
+                logger.error(f"Error recording job failure: {update_error}")
+        finally:
+            self.cancelled_locally.discard(job_id)
+
+    def get_info(self) -> Dict:
+        """Queue statistics for this worker"""
+        return {
+            'pid': os.getpid(),
+            'max_workers': self.max_workers,
+            'max_queued': self.max_queued,
+            'queued': self._waiting,
+            'running': dict(self._running),
+            'completed': self.completed,
+            'failed': self.failed,
+            'job_types': {name: {'max_concurrent': spec['max_concurrent'], 'description': spec['description']}
+                          for name, spec in JOB_TYPES.items()}
+        }
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def job_to_json(job: Dict) -> Dict:
+    """API view of a job with ISO timestamps"""
+    view = dict(job)
+    for field in ('created_at', 'started_at', 'finished_at'):
+        if view.get(field) is not None:
+            view[field] = datetime.fromtimestamp(view[field]).isoformat()
+    return view
+
+_job_queue = None
+_job_queue_pid = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue() -> JobQueue:
+    """Return this worker's job queue, creating it after fork if needed"""
+    global _job_queue, _job_queue_pid
+    pid = os.getpid()
+    if _job_queue is None or _job_queue_pid != pid:
+        with _job_queue_lock:
+            if _job_queue is None or _job_queue_pid != pid:
+                _job_queue = JobQueue(
+                    db,
+                    max_workers=int(os.getenv('JOBS_MAX_WORKERS', 2)),
+                    max_queued=int(os.getenv('JOBS_MAX_QUEUED', 20)),
+                    output_dir=os.getenv('JOBS_OUTPUT_DIR', 'backups')
+                )
+                _job_queue_pid = pid
+    return _job_queue
+
+# ---------------------------------------------------------------------------
+# Job types
+# ---------------------------------------------------------------------------
+
+@register_job('backup', max_concurrent=1, description='Write items, bills and statistics to a JSON file')
+def backup_job(context: JobContext, params: Dict) -> Dict:
+    bill_limit = int(params.get('bill_limit', 100000))
+    output_dir = context.job_queue.output_dir
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{context.job_id[:8]}.json")
+
+    context.progress(0.05, 'Reading items')
+    items = context.job_queue.database.get_all_items()
+    context.progress(0.3, f'Read {len(items)} items, reading bills')
+    bills = context.job_queue.database.get_bills(bill_limit)
+    context.progress(0.7, f'Read {len(bills)} bills, reading statistics')
+    statistics = context.job_queue.database.get_statistics()
+
+    context.progress(0.85, 'Writing backup file')
+    partial_path = path + '.partial'
+    try:
+        with open(partial_path, 'w') as f:
+            json.dump({
+                'timestamp': datetime.now().isoformat(),
+                'items': items,
+                'bills': bills,
+                'statistics': statistics,
+                'database_info': context.job_queue.database.get_connection_info()
+            }, f)
+        context.check_cancelled()
+        os.replace(partial_path, path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+    return {'path': path, 'bytes': os.path.getsize(path), 'items': len(items), 'bills': len(bills)}
+
+@register_job('statistics', max_concurrent=1, description='Compute database statistics')
+def statistics_job(context: JobContext, params: Dict) -> Dict:
+    context.progress(0.1, 'Computing statistics')
+    return context.job_queue.database.get_statistics()
+
+@register_job('optimize', max_concurrent=1, description='Refresh query planner statistics')
+def optimize_job(context: JobContext, params: Dict) -> Dict:
+    database = context.job_queue.database
+    context.progress(0.1, 'Analyzing tables')
+    start = time.perf_counter()
+    if get_backend_name() == 'sqlite':
+        conn = sqlite3.connect(database.db_path)
+        try:
+            conn.execute('ANALYZE')
+            conn.execute('PRAGMA optimize')
+        finally:
+            conn.close()
+        statements = ['ANALYZE', 'PRAGMA optimize']
+    else:
+        engine = database.engine
+        if engine.dialect.name == 'mysql':
+            statements = ['ANALYZE TABLE items, bills']
+        else:
+            statements = ['ANALYZE', 'PRAGMA optimize']
+        from sqlalchemy import text
+        with engine.begin() as conn:
+            for statement in statements:
+                conn.execute(text(statement))
+    return {'statements': statements, 'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)}
+
+@register_job('render_bills', max_concurrent=1, description='Render many bills into one printable HTML or PDF file')
+def render_bills_job(context: JobContext, params: Dict) -> Dict:
+    render_format = params.get('format', 'pdf')
+    if render_format not in RENDER_FORMATS:
+        raise ValueError(f"Unknown render format '{render_format}'")
+    database = context.job_queue.database
+
+    ids = params.get('ids')
+    if ids:
+        total = len(ids)
+        bills = (bill for bill in (database.get_bill(int(bill_id)) for bill_id in ids) if bill is not None)
+    else:
+        total = None
+        day = params.get('date')
+        since = datetime.fromisoformat(params.get('since') or day) if (params.get('since') or day) else None
+        until = datetime.fromisoformat(params['until']) if params.get('until') else (
+            since + timedelta(days=1) if day else None)
+        if since is None and until is None:
+            raise ValueError('Give ids, a date, or a since/until range')
+        bills = database.iter_bills(since, until)
+
+    def progress(rendered: int):
+        context.progress(rendered / total * 0.95 if total else 0.5, f'Rendered {rendered} bills')
+
+    output_dir = context.job_queue.output_dir
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"bills_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{context.job_id[:8]}.{render_format}")
+    partial_path = path + '.partial'
+    workers = int(os.getenv('BILL_RENDER_WORKERS', min(4, os.cpu_count() or 1)))
+    try:
+        with open(partial_path, 'wb') as f:
+            rendered = write_batch(bills, render_format, f, workers=workers, progress=progress)
+        context.check_cancelled()
+        os.replace(partial_path, path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+    return {'path': path, 'bytes': os.path.getsize(path), 'bills': rendered, 'format': render_format}
+
+@register_job('archive_bills', max_concurrent=1, description='Move bills from closed months out of the hot table')
+def archive_bills_job(context: JobContext, params: Dict) -> Dict:
+    hot_months = params.get('hot_months')
+    before = archive_cutoff(int(hot_months) if hot_months is not None else None)
+    context.progress(0.05, f"Archiving bills created before {before.strftime('%Y-%m-%d')}")
+
+    def progress(done: int, total: int):
+        context.progress(0.05 + done / total * 0.9, f'Archived {done} of {total} months')
+
+    archived = context.job_queue.database.archive_bills(before, progress=progress)
+    return {'before': before.isoformat(), 'months': archived,
+            'bills': sum(archive['moved'] for archive in archived)}
+
+@register_job('maintenance', max_concurrent=1, description='Run database maintenance tasks within a time budget')
+def maintenance_job(context: JobContext, params: Dict) -> Dict:
+    def progress(done: int, total: int, task: str):
+        context.progress(done / total, f'Running {task}')
+
+    return execute_run(context.job_queue.database, 'manual', params['tasks'], float(params['budget_seconds']),
+                       progress=progress)
+
+@register_job('data_migration', max_concurrent=1, description='Run a registered data migration in checkpointed batches')
+def data_migration_job(context: JobContext, params: Dict) -> Dict:
+    migration = DATA_MIGRATIONS.get(params.get('name'))
+    if migration is None:
+        raise ValueError(f"Unknown data migration '{params.get('name')}' (expected one of {', '.join(DATA_MIGRATIONS)})")
+    database = context.job_queue.database
+    if get_backend_name() == 'sqlite':
+        migrator = SQLiteMigrator(database.db_path)
+    else:
+        migrator = SQLAlchemyMigrator(database.engine)
+    runner = DataMigrationRunner(migrator)
+    with migrator.transaction() as conn:
+        total = conn.execute(f'SELECT COUNT(*) FROM {migration.table}')[0][0]
+
+    # One batch per step so progress is reported and cancellation is honoured between batches
+    pause = float(params.get('pause', 0.0))
+    while True:
+        checkpoint = runner.run(migration, max_batches=1)
+        if checkpoint['status'] == 'completed':
+            return {'name': migration.name, 'rows_done': checkpoint['rows_done'], 'last_id': checkpoint['last_id']}
+        context.progress(min(checkpoint['rows_done'] / total, 0.99) if total else 0.5,
+                         f"{checkpoint['rows_done']} rows migrated")
+        if pause:
+            time.sleep(pause)
@@ -1,12 +1,31 @@
 
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response, stream_with_context, g
 from flask_cors import CORS
 import os
 import json
+import time
 import logging
+from contextlib import contextmanager
 from datetime import datetime
 from dotenv import load_dotenv
-from flask_database import db
+from database_backend import (db, get_backend_name, DuplicateBillNumberError, begin_client_request,
+                              client_wrote_at, end_client_request, get_read_your_writes_seconds)
+from event_stream import get_broadcaster, publish_event
+from bill_numbers import get_allocator
+from idempotency import idempotent
+from single_flight import get_single_flight
+from catalog_store import get_catalog_cache
+from admission import get_admission_controller, classify
+from exports import (EXPORT_FORMATS, BILL_EXPORT_COLUMNS, BILL_LINE_EXPORT_COLUMNS, ITEM_EXPORT_COLUMNS,
+                     STATISTICS_EXPORT_COLUMNS, bill_rows, item_rows, statistics_rows, stream_export)
+from bill_render import RENDER_FORMATS, get_render_cache
+from metering import load_rates, price_sessions, MeteringError
+from jobs import get_job_queue, job_to_json, JobQueueFull, JOB_TYPES, FINISHED_STATUSES
+from maintenance import (MAINTENANCE_TASKS, get_maintenance_config, get_maintenance_scheduler,
+                         maintenance_run_to_json, validate_tasks)
+from fast_json import FastJSONProvider
+from validation import ITEM_VALIDATOR, BILL_VALIDATOR, ValidationError, validation_error_response
+from profiling import ProfilingError, admin_required, get_profilers, list_profiles, load_profile
 
 # Load environment variables
 load_dotenv()
@@ -19,6 +38,8 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# Compact responses through orjson when installed; large arrays are streamed
+app.json = FastJSONProvider(app)
 
 # Configure Flask app
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', os.urandom(24))
@@ -35,6 +56,20 @@ else:
 app.static_folder = '.'
 app.template_folder = '.'
 
+# Duration of each startup phase in milliseconds, filled in by create_app()
+startup_timings = {}
+
+@contextmanager
+def startup_phase(name):
+    """Time a startup phase and record it in startup_timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 2)
+        startup_timings[name] = elapsed_ms
+        logger.info(f"⏱️ Startup phase '{name}' took {elapsed_ms} ms")
+
 def startup_info():
     """Log startup information"""
     logger.info("🏥 Hospital Billing System Flask Server Starting")
@@ -42,8 +77,24 @@ def startup_info():
     logger.info(f"📊 Database Type: {db_info['database_type']}")
     logger.info(f"🔗 Connected: {db_info['connected']}")
 
-# Call startup info immediately
-startup_info()
+def create_app():
+    """Run the explicit startup sequence and return the configured app.
+
+    Importing this module does not touch the database. Call this once from the
+    process that serves requests (or the gunicorn master with --preload); the
+    schema check then runs once, and each forked worker opens its own handle
+    lazily on its first request.
+    """
+    if app.config.get('STARTUP_COMPLETE'):
+        return app
+    
+    with startup_phase('database'):
+        db.get()
+    with startup_phase('startup_info'):
+        startup_info()
+    
+    app.config['STARTUP_COMPLETE'] = True
+    return app
 
 @app.route('/')
 def index():
@@ -81,7 +132,7 @@ def health():
     db_info = db.get_connection_info()
     
     status = 'healthy' if db_info['connected'] else 'unhealthy'
-    message = 'System running with SQLite database' if db_info['connected'] else 'Database connection failed'
+    message = f"System running with {db_info['database_type']} database" if db_info['connected'] else 'Database connection failed'
     
     return jsonify({
         'status': status,
@@ -100,14 +151,22 @@ def api_status():
     db_info = db.get_connection_info()
     return jsonify({
         'server': 'online',
-        'database': 'sqlite' if db_info['connected'] else 'offline',
+        'database': db_info['database_type'].lower() if db_info['connected'] else 'offline',
         'version': '3.0-sqlite-professional',
         'timestamp': datetime.now().isoformat(),
         'message': 'Professional Flask-SQLite Hospital Billing System',
         'connection_info': {
             'database_type': db_info['database_type'],
             'connected': db_info['connected']
-        }
+        },
+        'startup_timings': startup_timings,
+        'single_flight': get_single_flight().get_info(),
+        'catalog': get_catalog_cache().get_info(),
+        'json': app.json.get_info(),
+        'admission': get_admission_controller().get_info(),
+        'jobs': get_job_queue().get_info(),
+        'bill_render_cache': get_render_cache().get_info(),
+        'maintenance': get_maintenance_scheduler().get_info()
     })
 
 # API Endpoints for data management
@@ -116,13 +175,13 @@ def api_status():
 def get_all_items():
     """Get all items"""
     try:
-        items = db.get_all_items()
-        return jsonify({
+        store = get_catalog_cache().get(db)
+        return app.json.stream_response({
             'success': True,
-            'items': items,
-            'count': len(items),
+            'count': len(store),
+            'catalog_version': store.version,
             'message': 'Items retrieved successfully'
-        })
+        }, 'items', store.iter_items(), len(store))
     except Exception as e:
         logger.error(f"Error in get_all_items: {e}")
         return jsonify({
@@ -131,18 +190,42 @@ def get_all_items():
             'message': 'Failed to retrieve items'
         }), 500
 
+@app.route('/api/items/changes', methods=['GET'])
+def get_item_changes():
+    """Get catalog changes since a catalog version (delta sync)"""
+    try:
+        since = request.args.get('since', 0, type=int)
+        changes = db.get_item_changes(since)
+        return jsonify({
+            'success': True,
+            'since': since,
+            'version': changes['version'],
+            'full_resync': changes['full_resync'],
+            'items': changes['items'],
+            'deleted': changes['deleted'],
+            'count': len(changes['items']) + len(changes['deleted']),
+            'message': 'Catalog changes retrieved successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error in get_item_changes: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to retrieve catalog changes'
+        }), 500
+
 @app.route('/api/items/category/<category>', methods=['GET'])
 def get_items_by_category(category):
     """Get items by category"""
     try:
-        items = db.get_items_by_category(category)
-        return jsonify({
+        store = get_catalog_cache().get(db)
+        rows = store.category_rows(category)
+        return app.json.stream_response({
             'success': True,
             'category': category,
-            'items': items,
-            'count': len(items),
+            'count': len(rows),
             'message': f'Items in category "{category}" retrieved successfully'
-        })
+        }, 'items', store.iter_items(rows), len(rows))
     except Exception as e:
         logger.error(f"Error in get_items_by_category: {e}")
         return jsonify({
@@ -151,41 +234,71 @@ def get_items_by_category(category):
             'message': f'Failed to retrieve items for category "{category}"'
         }), 500
 
-@app.route('/api/items', methods=['POST'])
-def add_item():
-    """Add new item"""
+@app.route('/api/items/<int:item_id>', methods=['GET'])
+def get_item(item_id):
+    """Get one item by id"""
     try:
-        data = request.get_json()
-        if not data:
+        item = get_catalog_cache().get(db).get(item_id)
+        if item is None:
             return jsonify({
                 'success': False,
-                'error': 'No data provided',
-                'message': 'Request body is required'
-            }), 400
-        
-        required_fields = ['category', 'name', 'price']
-        missing_fields = [field for field in required_fields if field not in data]
-        if missing_fields:
-            return jsonify({
-                'success': False,
-                'error': f'Missing required fields: {", ".join(missing_fields)}',
-                'message': 'Please provide all required fields'
-            }), 400
+                'error': 'Item not found',
+                'message': f'No item with id {item_id}'
+            }), 404
+        return jsonify({
+            'success': True,
+            'item': item,
+            'message': 'Item retrieved successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error in get_item: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to retrieve item'
+        }), 500
+
+@app.route('/api/items/search', methods=['GET'])
+def search_items():
+    """Find items whose name starts with a prefix (case-insensitive)"""
+    try:
+        name = request.args.get('name', '')
+        limit = request.args.get('limit', 50, type=int)
+        if limit < 1 or limit > 500:
+            limit = 50
         
-        # Validate price
+        store = get_catalog_cache().get(db)
+        items = store.to_dicts(store.search_names(name, limit))
+        return jsonify({
+            'success': True,
+            'items': items,
+            'count': len(items),
+            'catalog_version': store.version,
+            'message': 'Items retrieved successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error in search_items: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to search items'
+        }), 500
+
+@app.route('/api/items', methods=['POST'])
+@idempotent
+def add_item():
+    """Add new item"""
+    try:
         try:
-            data['price'] = float(data['price'])
-            if data['price'] < 0:
-                raise ValueError("Price cannot be negative")
-        except (ValueError, TypeError):
-            return jsonify({
-                'success': False,
-                'error': 'Invalid price value',
-                'message': 'Price must be a valid positive number'
-            }), 400
+            data = ITEM_VALIDATOR.validate(request.get_json(silent=True))
+        except ValidationError as e:
+            return jsonify(validation_error_response(e)), 400
         
         item_id = db.add_item(data)
         logger.info(f"Added new item: {data['name']} (ID: {item_id})")
+        get_single_flight().invalidate('statistics', 'database_test')
+        get_catalog_cache().invalidate(db)
+        publish_event('catalog-change', {'item_id': item_id, 'operation': 'upsert'})
         
         return jsonify({
             'success': True,
@@ -201,30 +314,49 @@ def add_item():
             'message': 'Failed to add item'
         }), 500
 
+@app.route('/api/items/bulk', methods=['POST'])
+@idempotent
+def bulk_add_items():
+    """Add or upsert many items in one transaction"""
+    try:
+        data = request.get_json(silent=True)
+        data = data if isinstance(data, dict) else {}
+        try:
+            items = ITEM_VALIDATOR.validate_many(data.get('items'), 'items')
+        except ValidationError as e:
+            return jsonify(validation_error_response(e)), 400
+        
+        if data.get('upsert'):
+            count = db.bulk_upsert_items(items)
+        else:
+            count = db.bulk_add_items(items)
+        logger.info(f"Bulk {'upserted' if data.get('upsert') else 'added'} {count} items")
+        get_single_flight().invalidate('statistics', 'database_test')
+        get_catalog_cache().invalidate(db)
+        publish_event('catalog-change', {'item_id': None, 'operation': 'bulk', 'count': count})
+        
+        return jsonify({
+            'success': True,
+            'count': count,
+            'message': f'{count} items saved successfully'
+        }), 201
+        
+    except Exception as e:
+        logger.error(f"Error in bulk_add_items: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to save items'
+        }), 500
+
 @app.route('/api/items/<int:item_id>', methods=['PUT'])
 def update_item(item_id):
     """Update existing item"""
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({
-                'success': False,
-                'error': 'No data provided',
-                'message': 'Request body is required'
-            }), 400
-        
-        # Validate price if provided
-        if 'price' in data:
-            try:
-                data['price'] = float(data['price'])
-                if data['price'] < 0:
-                    raise ValueError("Price cannot be negative")
-            except (ValueError, TypeError):
-                return jsonify({
-                    'success': False,
-                    'error': 'Invalid price value',
-                    'message': 'Price must be a valid positive number'
-                }), 400
+        try:
+            data = ITEM_VALIDATOR.validate(request.get_json(silent=True))
+        except ValidationError as e:
+            return jsonify(validation_error_response(e)), 400
         
         success = db.update_item(item_id, data)
         if not success:
@@ -235,6 +367,9 @@ def update_item(item_id):
             }), 404
         
         logger.info(f"Updated item ID: {item_id}")
+        get_single_flight().invalidate('statistics', 'database_test')
+        get_catalog_cache().invalidate(db)
+        publish_event('catalog-change', {'item_id': item_id, 'operation': 'upsert'})
         
         return jsonify({
             'success': True,
@@ -262,6 +397,9 @@ def delete_item(item_id):
             }), 404
         
         logger.info(f"Deleted item ID: {item_id}")
+        get_single_flight().invalidate('statistics', 'database_test')
+        get_catalog_cache().invalidate(db)
+        publish_event('catalog-change', {'item_id': item_id, 'operation': 'delete'})
         
         return jsonify({
             'success': True,
@@ -277,53 +415,151 @@ def delete_item(item_id):
         }), 500
 
 @app.route('/api/bills', methods=['POST'])
+@idempotent
 def save_bill():
     """Save bill"""
     try:
-        data = request.get_json()
-        if not data:
+        try:
+            data = BILL_VALIDATOR.validate(request.get_json(silent=True))
+        except ValidationError as e:
+            return jsonify(validation_error_response(e)), 400
+        
+        # Bills sent without a number get one from the server-side sequence
+        if not data.get('bill_number'):
+            try:
+                data['bill_number'] = get_allocator().allocate(data.get('department') or 'outpatient')
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e),
+                    'message': 'Invalid department'
+                }), 400
+        
+        bill_id = db.save_bill(data)
+        logger.info(f"Saved bill: {data['bill_number']} (ID: {bill_id})")
+        get_single_flight().invalidate('statistics', 'database_test')
+        publish_event('bill-saved', {
+            'bill_id': bill_id,
+            'bill_number': data['bill_number'],
+            'total_amount': data['total_amount']
+        })
+        
+        return jsonify({
+            'success': True,
+            'bill_id': bill_id,
+            'bill_number': data['bill_number'],
+            'message': f'Bill "{data["bill_number"]}" saved successfully'
+        }), 201
+        
+    except DuplicateBillNumberError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Bill number already exists; use a new bill number'
+        }), 409
+    except Exception as e:
+        logger.error(f"Error in save_bill: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to save bill'
+        }), 500
+
+@app.route('/api/bills/bulk', methods=['POST'])
+@idempotent
+def bulk_save_bills():
+    """Save many bills in one transaction"""
+    try:
+        data = request.get_json(silent=True)
+        data = data if isinstance(data, dict) else {}
+        try:
+            bills = BILL_VALIDATOR.validate_many(data.get('bills'), 'bills')
+        except ValidationError as e:
+            return jsonify(validation_error_response(e)), 400
+        
+        # Number the bills that came without one, a block per department
+        unnumbered = {}
+        for bill in bills:
+            if not bill.get('bill_number'):
+                unnumbered.setdefault(bill.get('department') or 'outpatient', []).append(bill)
+        try:
+            for department, department_bills in unnumbered.items():
+                numbers = get_allocator().allocate_many(department, len(department_bills))
+                for bill, number in zip(department_bills, numbers):
+                    bill['bill_number'] = number
+        except ValueError as e:
             return jsonify({
                 'success': False,
-                'error': 'No data provided',
-                'message': 'Request body is required'
+                'error': str(e),
+                'message': 'Invalid department'
             }), 400
         
-        required_fields = ['bill_number', 'total_amount', 'items']
-        missing_fields = [field for field in required_fields if field not in data]
-        if missing_fields:
+        count = db.bulk_save_bills(bills)
+        logger.info(f"Bulk saved {count} bills")
+        get_single_flight().invalidate('statistics', 'database_test')
+        publish_event('bill-saved', {
+            'bill_id': None,
+            'operation': 'bulk',
+            'count': count,
+            'total_amount': sum(bill['total_amount'] for bill in bills)
+        })
+        
+        return jsonify({
+            'success': True,
+            'count': count,
+            'bill_numbers': [bill['bill_number'] for bill in bills],
+            'message': f'{count} bills saved successfully'
+        }), 201
+        
+    except DuplicateBillNumberError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'No bills were saved; use new bill numbers for the duplicates'
+        }), 409
+    except Exception as e:
+        logger.error(f"Error in bulk_save_bills: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to save bills'
+        }), 500
+
+@app.route('/api/bills/number', methods=['POST'])
+def allocate_bill_number():
+    """Allocate bill numbers from the department's server-side sequence"""
+    try:
+        data = request.get_json(silent=True) or {}
+        department = data.get('department', 'outpatient')
+        count = data.get('count', 1)
+        if not isinstance(count, int) or count < 1 or count > 100:
             return jsonify({
                 'success': False,
-                'error': f'Missing required fields: {", ".join(missing_fields)}',
-                'message': 'Please provide all required fields'
+                'error': 'Invalid count',
+                'message': 'count must be an integer between 1 and 100'
             }), 400
         
-        # Validate total_amount
         try:
-            data['total_amount'] = float(data['total_amount'])
-            if data['total_amount'] < 0:
-                raise ValueError("Total amount cannot be negative")
-        except (ValueError, TypeError):
+            bill_numbers = get_allocator().allocate_many(department, count)
+        except ValueError as e:
             return jsonify({
                 'success': False,
-                'error': 'Invalid total amount',
-                'message': 'Total amount must be a valid positive number'
+                'error': str(e),
+                'message': 'Invalid department'
             }), 400
         
-        bill_id = db.save_bill(data)
-        logger.info(f"Saved bill: {data['bill_number']} (ID: {bill_id})")
-        
         return jsonify({
             'success': True,
-            'bill_id': bill_id,
-            'message': f'Bill "{data["bill_number"]}" saved successfully'
-        }), 201
-        
+            'bill_number': bill_numbers[0],
+            'bill_numbers': bill_numbers,
+            'message': f'Allocated {count} bill number(s) for {department}'
+        })
     except Exception as e:
-        logger.error(f"Error in save_bill: {e}")
+        logger.error(f"Error in allocate_bill_number: {e}")
         return jsonify({
             'success': False,
             'error': str(e),
-            'message': 'Failed to save bill'
+            'message': 'Failed to allocate bill number'
         }), 500
 
 @app.route('/api/bills', methods=['GET'])
@@ -335,13 +571,12 @@ def get_bills():
             limit = 50
         
         bills = db.get_bills(limit)
-        return jsonify({
+        return app.json.stream_response({
             'success': True,
-            'bills': bills,
             'count': len(bills),
             'limit': limit,
             'message': 'Bills retrieved successfully'
-        })
+        }, 'bills', bills, len(bills))
     except Exception as e:
         logger.error(f"Error in get_bills: {e}")
         return jsonify({
@@ -350,11 +585,206 @@ def get_bills():
             'message': 'Failed to retrieve bills'
         }), 500
 
+@app.route('/api/bills/archives', methods=['GET'])
+def get_bill_archives():
+    """List archived monthly bill partitions"""
+    try:
+        archives = db.list_bill_archives()
+        return jsonify({
+            'success': True,
+            'archives': archives,
+            'count': len(archives),
+            'archived_bills': sum(archive['bill_count'] for archive in archives),
+            'message': 'Bill archives retrieved successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error in get_bill_archives: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to retrieve bill archives'
+        }), 500
+
+@app.route('/api/bills/<int:bill_id>/render', methods=['GET'])
+def render_bill(bill_id):
+    """Render a saved bill for printing as HTML or PDF"""
+    try:
+        render_format = request.args.get('format', 'html').lower()
+        if render_format not in RENDER_FORMATS:
+            return jsonify({
+                'success': False,
+                'error': f"Unknown render format '{render_format}'",
+                'message': f"Supported formats: {', '.join(RENDER_FORMATS)}"
+            }), 400
+        
+        bill = db.get_bill(bill_id)
+        if bill is None:
+            return jsonify({
+                'success': False,
+                'error': 'Bill not found',
+                'message': f'No bill with id {bill_id}'
+            }), 404
+        
+        etag, body = get_render_cache().get_or_render(bill, render_format)
+        response = Response(body, content_type=RENDER_FORMATS[render_format])
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        disposition = 'attachment' if request.args.get('download', 'false').lower() == 'true' else 'inline'
+        response.headers['Content-Disposition'] = f'{disposition}; filename="bill_{bill["bill_number"]}.{render_format}"'
+        return response.make_conditional(request)
+    except Exception as e:
+        logger.error(f"Error in render_bill: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to render bill'
+        }), 500
+
+@app.route('/api/bills/render', methods=['POST'])
+def render_bills_batch():
+    """Queue a batch render of many bills into one printable file"""
+    data = request.get_json(silent=True) or {}
+    params = {'format': str(data.get('format', 'pdf')).lower()}
+    try:
+        if params['format'] not in RENDER_FORMATS:
+            raise ValueError(f"Unknown render format '{params['format']}'")
+        if data.get('ids'):
+            params['ids'] = [int(bill_id) for bill_id in data['ids']]
+        else:
+            for field in ('date', 'since', 'until'):
+                if data.get(field):
+                    datetime.fromisoformat(data[field])
+                    params[field] = data[field]
+            if len(params) == 1:
+                raise ValueError('Give ids, a date, or a since/until range')
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Expected {"format": "html|pdf", "ids": [...]} or a "date"/"since"/"until" ISO date'
+        }), 400
+    
+    try:
+        return queued_job_response('render_bills', params, 'Batch render queued')
+    except Exception as e:
+        logger.error(f"Error in render_bills_batch: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to queue batch render'
+        }), 500
+
+@app.route('/api/patients', methods=['GET'])
+def find_patients():
+    """Look up registered patients by OPD number prefix"""
+    try:
+        prefix = request.args.get('prefix', '')
+        limit = request.args.get('limit', 20, type=int)
+        if limit < 1 or limit > 200:
+            limit = 20
+        
+        patients = db.find_patients(prefix, limit)
+        return jsonify({
+            'success': True,
+            'patients': patients,
+            'count': len(patients),
+            'message': 'Patients retrieved successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error in find_patients: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to retrieve patients'
+        }), 500
+
+@app.route('/api/patients/<path:opd_number>/bills', methods=['GET'])
+def get_patient_bills(opd_number):
+    """Get a patient's bill history by OPD number"""
+    try:
+        limit = request.args.get('limit', 50, type=int)
+        if limit < 1 or limit > 1000:
+            limit = 50
+        
+        patient = db.get_patient(opd_number)
+        if patient is None:
+            return jsonify({
+                'success': False,
+                'error': 'Patient not found',
+                'message': f'No patient with OPD number {opd_number}'
+            }), 404
+        
+        bills = db.get_patient_bills(patient['id'], limit)
+        return jsonify({
+            'success': True,
+            'patient': patient,
+            'bills': bills,
+            'count': len(bills),
+            'limit': limit,
+            'message': 'Patient bills retrieved successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error in get_patient_bills: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to retrieve patient bills'
+        }), 500
+
+@app.route('/api/metering/rates', methods=['GET'])
+def get_metering_rates():
+    """Get the catalog prices used for metered O2 and ISO charges"""
+    try:
+        return jsonify({
+            'success': True,
+            'rates': load_rates(db),
+            'message': 'Metering rates retrieved successfully'
+        })
+    except MeteringError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Metered services are not set up in the catalog'
+        }), 409
+    except Exception as e:
+        logger.error(f"Error in get_metering_rates: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to retrieve metering rates'
+        }), 500
+
+@app.route('/api/metering/price', methods=['POST'])
+def price_metered_sessions():
+    """Price O2/ISO sessions from start/end times and catalog rates"""
+    try:
+        data = request.get_json(silent=True) or {}
+        result = price_sessions(data.get('sessions'), load_rates(db))
+        return jsonify({
+            'success': True,
+            **result,
+            'message': f"Priced {result['count']} metered sessions"
+        })
+    except MeteringError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'errors': e.errors,
+            'message': 'Sessions need service (o2|iso), start and end, and o2 an optional flow_rate in L/hr'
+        }), 400
+    except Exception as e:
+        logger.error(f"Error in price_metered_sessions: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to price metered sessions'
+        }), 500
+
 @app.route('/api/statistics', methods=['GET'])
 def get_statistics():
     """Get database statistics"""
     try:
-        stats = db.get_statistics()
+        stats = get_single_flight().do('statistics', db.get_statistics)
         return jsonify({
             'success': True,
             'statistics': stats,
@@ -368,6 +798,30 @@ def get_statistics():
             'message': 'Failed to retrieve statistics'
         }), 500
 
+@app.route('/api/events', methods=['GET'])
+def event_stream():
+    """Server-Sent Events are served by the ASGI entry point only.
+
+    Under WSGI every open stream would hold a request thread (with sync
+    gunicorn workers, a whole worker) for as long as the client stays
+    connected, so this route refuses instead. asgi.py answers /api/events
+    on its event loop before requests reach Flask.
+    """
+    return jsonify({
+        'success': False,
+        'error': 'Event stream requires the ASGI server',
+        'message': 'Run uvicorn asgi:application to enable /api/events; poll /api/items/changes instead'
+    }), 503
+
+@app.route('/api/events/info', methods=['GET'])
+def event_stream_info():
+    """Get event broadcaster statistics for this worker"""
+    return jsonify({
+        'success': True,
+        'events': get_broadcaster().get_info(),
+        'message': 'Event stream information retrieved successfully'
+    })
+
 @app.route('/api/database/info', methods=['GET'])
 def get_database_info():
     """Get database connection information"""
@@ -387,27 +841,31 @@ def get_database_info():
             'message': 'Failed to retrieve database information'
         }), 500
 
+@app.route('/api/database/outbox', methods=['GET'])
+def get_database_outbox():
+    """Get writes buffered on the fallback database and replay conflicts"""
+    try:
+        outbox = db.get_outbox_status()
+        
+        return jsonify({
+            'success': True,
+            'outbox': outbox,
+            'message': 'Outbox status retrieved successfully' if outbox is not None
+                       else 'This database backend has no fallback outbox'
+        })
+    except Exception as e:
+        logger.error(f"Error in get_database_outbox: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to retrieve outbox status'
+        }), 500
+
 @app.route('/api/database/test', methods=['GET'])
 def test_database_connection():
     """Test database connection with detailed diagnostics"""
     try:
-        # Test basic connection
-        db_info = db.get_connection_info()
-        
-        # Test query execution
-        test_results = {
-            'connection_status': db_info['connected'],
-            'database_type': db_info['database_type']
-        }
-        
-        if db_info['connected']:
-            # Test a simple query
-            try:
-                stats = db.get_statistics()
-                test_results['query_test'] = 'passed'
-                test_results['item_count'] = stats.get('total_items', 0)
-            except Exception as query_error:
-                test_results['query_test'] = f'failed: {str(query_error)}'
+        test_results = get_single_flight().do('database_test', run_database_test)
         
         return jsonify({
             'success': True,
@@ -423,29 +881,453 @@ def test_database_connection():
             'message': 'Database connection test failed'
         }), 500
 
-@app.route('/api/database/backup', methods=['GET'])
+def run_database_test() -> dict:
+    """Connection and query diagnostics behind /api/database/test"""
+    # Test basic connection
+    db_info = db.get_connection_info()
+    
+    # Test query execution
+    test_results = {
+        'connection_status': db_info['connected'],
+        'database_type': db_info['database_type']
+    }
+    
+    if db_info['connected']:
+        # Test a simple query
+        try:
+            stats = db.get_statistics()
+            test_results['query_test'] = 'passed'
+            test_results['item_count'] = stats.get('total_items', 0)
+        except Exception as query_error:
+            test_results['query_test'] = f'failed: {str(query_error)}'
+    
+    return test_results
+
+def queued_job_response(job_type: str, params: dict, message: str):
+    """Queue a job: 202 with its Location, or 503 with Retry-After when this worker's queue is full"""
+    try:
+        job = get_job_queue().submit(job_type, params)
+    except JobQueueFull as e:
+        response = jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Job queue is full, retry later'
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    response = jsonify({
+        'success': True,
+        'job': job_to_json(job),
+        'message': message
+    })
+    response.status_code = 202
+    response.headers['Location'] = f"/api/jobs/{job['id']}"
+    return response
+
+@app.route('/api/database/backup', methods=['GET', 'POST'])
 def backup_database():
-    """Export complete database backup"""
-    try:
-        backup_data = {
-            'timestamp': datetime.now().isoformat(),
-            'items': db.get_all_items(),
-            'bills': db.get_bills(1000),  # Last 1000 bills
-            'statistics': db.get_statistics(),
-            'database_info': db.get_connection_info()
+    """Queue a database backup; the file is downloadable from /api/jobs/<id>/download when it finishes"""
+    try:
+        params = {}
+        if 'bill_limit' in request.args:
+            params['bill_limit'] = request.args.get('bill_limit', type=int)
+            if params['bill_limit'] is None or params['bill_limit'] < 1:
+                return jsonify({
+                    'success': False,
+                    'error': 'Invalid bill_limit',
+                    'message': 'bill_limit must be a positive integer'
+                }), 400
+        return queued_job_response('backup', params, 'Database backup queued')
+    except Exception as e:
+        logger.error(f"Error in backup_database: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to queue database backup'
+        }), 500
+
+def export_response(name: str, columns, rows):
+    """Stream an export in the format given by ?format= as a chunked download"""
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({
+            'success': False,
+            'error': f"Unknown export format '{export_format}'",
+            'message': f"Supported formats: {', '.join(EXPORT_FORMATS)}"
+        }), 400
+    
+    content_type, extension = EXPORT_FORMATS[export_format]
+    filename = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    # stream_with_context keeps the request open until the last row; the admission slot is held until close
+    return Response(
+        stream_with_context(stream_export(export_format, columns, rows, sheet_name=name)),
+        content_type=content_type,
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no'
         }
+    )
+
+@app.route('/api/export/bills', methods=['GET'])
+def export_bills():
+    """Stream bills, or their line items with ?lines=true, as CSV or XLSX"""
+    try:
+        since = request.args.get('since')
+        until = request.args.get('until')
+        since = datetime.fromisoformat(since) if since else None
+        until = datetime.fromisoformat(until) if until else None
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'since and until must be ISO dates, e.g. 2026-01-01'
+        }), 400
+    
+    lines = request.args.get('lines', 'false').lower() == 'true'
+    rows = bill_rows(db.iter_bills(since, until), lines=lines)
+    return export_response('bill_lines' if lines else 'bills',
+                           BILL_LINE_EXPORT_COLUMNS if lines else BILL_EXPORT_COLUMNS, rows)
+
+@app.route('/api/export/items', methods=['GET'])
+def export_items():
+    """Stream the item catalog as CSV or XLSX"""
+    try:
+        items = get_catalog_cache().get(db).iter_items()
+    except Exception as e:
+        logger.error(f"Error in export_items: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to export items'
+        }), 500
+    
+    return export_response('items', ITEM_EXPORT_COLUMNS, item_rows(items))
+
+@app.route('/api/export/statistics', methods=['GET'])
+def export_statistics():
+    """Download database statistics as CSV or XLSX"""
+    try:
+        stats = get_single_flight().do('statistics', db.get_statistics)
+    except Exception as e:
+        logger.error(f"Error in export_statistics: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to export statistics'
+        }), 500
+    
+    return export_response('statistics', STATISTICS_EXPORT_COLUMNS, statistics_rows(stats))
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queue a background job and return its id immediately"""
+    try:
+        data = request.get_json(silent=True) or {}
+        job_type = data.get('type')
+        params = data.get('params') or {}
+        if not isinstance(params, dict):
+            return jsonify({
+                'success': False,
+                'error': 'Invalid params',
+                'message': 'params must be an object'
+            }), 400
+        
+        return queued_job_response(job_type, params, f'{job_type} job queued')
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': f"Available job types: {', '.join(sorted(JOB_TYPES))}"
+        }), 400
+    except Exception as e:
+        logger.error(f"Error in submit_job: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to queue job'
+        }), 500
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """Get recent background jobs"""
+    try:
+        limit = request.args.get('limit', 50, type=int)
+        if limit < 1 or limit > 500:
+            limit = 50
+        status = request.args.get('status')
         
+        jobs = db.list_jobs(limit, [status] if status else None)
         return jsonify({
             'success': True,
-            'backup_data': backup_data,
-            'message': 'Database backup created successfully'
+            'jobs': [job_to_json(job) for job in jobs],
+            'count': len(jobs),
+            'queue': get_job_queue().get_info(),
+            'message': 'Jobs retrieved successfully'
         })
     except Exception as e:
-        logger.error(f"Error in backup_database: {e}")
+        logger.error(f"Error in list_jobs: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to retrieve jobs'
+        }), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get a background job's status, progress and result"""
+    try:
+        job = db.get_job(job_id)
+        if job is None:
+            return jsonify({
+                'success': False,
+                'error': 'Job not found',
+                'message': f'No job with id {job_id}'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'job': job_to_json(job),
+            'message': 'Job retrieved successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error in get_job: {e}")
         return jsonify({
             'success': False,
             'error': str(e),
-            'message': 'Failed to create database backup'
+            'message': 'Failed to retrieve job'
+        }), 500
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running background job"""
+    try:
+        job = get_job_queue().cancel(job_id)
+        if job is None:
+            return jsonify({
+                'success': False,
+                'error': 'Job not found',
+                'message': f'No job with id {job_id}'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'job': job_to_json(job),
+            'message': 'Job already finished' if job['status'] in FINISHED_STATUSES and not job['cancel_requested']
+                       else 'Cancellation requested'
+        })
+    except Exception as e:
+        logger.error(f"Error in cancel_job: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to cancel job'
+        }), 500
+
+@app.route('/api/jobs/<job_id>/download', methods=['GET'])
+def download_job_output(job_id):
+    """Download the file a finished job produced"""
+    job = db.get_job(job_id)
+    path = (job or {}).get('result') or {}
+    path = path.get('path') if isinstance(path, dict) else None
+    if job is None or job['status'] != 'succeeded' or not path:
+        return jsonify({
+            'success': False,
+            'error': 'No output available',
+            'message': 'The job does not exist, has not finished, or produced no file'
+        }), 404
+    
+    output_dir = os.path.abspath(get_job_queue().output_dir)
+    return send_from_directory(output_dir, os.path.basename(path), as_attachment=True)
+
+@app.route('/api/maintenance', methods=['GET'])
+def get_maintenance_runs():
+    """Get the maintenance schedule and recent runs with per-task results and timings"""
+    try:
+        limit = request.args.get('limit', 20, type=int)
+        if limit < 1 or limit > 200:
+            limit = 20
+        
+        runs = db.list_maintenance_runs(limit)
+        return jsonify({
+            'success': True,
+            'schedule': get_maintenance_scheduler().get_info(),
+            'runs': [maintenance_run_to_json(run) for run in runs],
+            'count': len(runs),
+            'message': 'Maintenance runs retrieved successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error in get_maintenance_runs: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to retrieve maintenance runs'
+        }), 500
+
+@app.route('/api/maintenance/run', methods=['POST'])
+def run_maintenance_now():
+    """Queue a maintenance run outside the scheduled window"""
+    data = request.get_json(silent=True) or {}
+    config = get_maintenance_config()
+    try:
+        params = {
+            'tasks': validate_tasks(data.get('tasks') or list(MAINTENANCE_TASKS)),
+            'budget_seconds': float(data.get('budget_seconds', config['budget_seconds']))
+        }
+        if params['budget_seconds'] <= 0:
+            raise ValueError('budget_seconds must be positive')
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': f"tasks must be from {', '.join(MAINTENANCE_TASKS)} and budget_seconds a positive number"
+        }), 400
+    
+    try:
+        return queued_job_response('maintenance', params, 'Maintenance run queued')
+    except Exception as e:
+        logger.error(f"Error in run_maintenance_now: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to queue maintenance run'
+        }), 500
+
+@app.route('/api/admin/profiles', methods=['GET'])
+@admin_required
+def get_profiles():
+    """List saved request profiles and stack samples from every worker"""
+    try:
+        profiles = list_profiles()
+        return jsonify({
+            'success': True,
+            'profiles': profiles,
+            'count': len(profiles),
+            'worker': get_profilers().get_info(),
+            'message': 'Profiles retrieved successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error in get_profiles: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to retrieve profiles'
+        }), 500
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+@admin_required
+def get_profile(profile_id):
+    """Get one profile's statistics, or its progress while it runs in this worker"""
+    try:
+        profile = load_profile(profile_id) or get_profilers().running(profile_id)
+        if profile is None:
+            return jsonify({
+                'success': False,
+                'error': 'Profile not found',
+                'message': f'No finished profile {profile_id}; a running one is only visible from its own worker'
+            }), 404
+        return jsonify({
+            'success': True,
+            'profile': profile,
+            'message': 'Profile retrieved successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error in get_profile: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to retrieve profile'
+        }), 500
+
+def _start_profile(start, description):
+    """Shared body of the profile-starting endpoints: 202 with the new profile, 400/409 on bad input"""
+    try:
+        profile = start(request.get_json(silent=True) or {})
+    except ProfilingError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': f'Could not start {description}'
+        }), 409 if 'already' in str(e) else 400
+    response = jsonify({
+        'success': True,
+        'profile': profile,
+        'message': f'{description.capitalize()} started in worker {profile["pid"]}'
+    })
+    response.status_code = 202
+    response.headers['Location'] = f"/api/admin/profiles/{profile['id']}"
+    return response
+
+@app.route('/api/admin/profile/requests', methods=['POST'])
+@admin_required
+def profile_requests():
+    """Profile the next N requests handled by this worker with cProfile"""
+    try:
+        return _start_profile(get_profilers().requests.arm, 'request profiling')
+    except Exception as e:
+        logger.error(f"Error in profile_requests: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to start request profiling'
+        }), 500
+
+@app.route('/api/admin/profile/sample', methods=['POST'])
+@admin_required
+def profile_sample():
+    """Sample every thread of this worker for a number of seconds"""
+    try:
+        return _start_profile(get_profilers().sampler.start, 'stack sampling')
+    except Exception as e:
+        logger.error(f"Error in profile_sample: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to start stack sampling'
+        }), 500
+
+@app.route('/api/admin/memory', methods=['GET'])
+@admin_required
+def get_memory_profile():
+    """Get tracemalloc status and the snapshots kept by this worker"""
+    return jsonify({
+        'success': True,
+        'memory': get_profilers().memory.get_info(),
+        'message': 'Memory profiling status retrieved successfully'
+    })
+
+@app.route('/api/admin/memory/<action>', methods=['POST'])
+@admin_required
+def memory_profile_action(action):
+    """Take a tracemalloc snapshot, diff two snapshots, or stop tracing in this worker"""
+    memory = get_profilers().memory
+    actions = {'snapshot': memory.snapshot, 'diff': memory.diff, 'stop': lambda params: memory.stop()}
+    if action not in actions:
+        return jsonify({
+            'success': False,
+            'error': f"Unknown action '{action}'",
+            'message': f"Action must be one of: {', '.join(actions)}"
+        }), 404
+    try:
+        result = actions[action](request.get_json(silent=True) or {})
+        return jsonify({
+            'success': True,
+            'memory': result,
+            'message': f'Memory {action} completed'
+        })
+    except ProfilingError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': f'Memory {action} failed'
+        }), 400
+    except Exception as e:
+        logger.error(f"Error in memory_profile_action: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'message': f'Memory {action} failed'
         }), 500
 
 @app.route('/api/<path:path>')
@@ -457,14 +1339,45 @@ def api_fallback(path):
         'endpoint': f'/api/{path}',
         'available_endpoints': [
             'GET /api/items',
+            'GET /api/items/changes?since=<version>',
             'GET /api/items/category/<category>',
+            'GET /api/items/<id>',
+            'GET /api/items/search?name=<prefix>',
             'POST /api/items',
+            'POST /api/items/bulk',
             'PUT /api/items/<id>',
             'DELETE /api/items/<id>',
             'POST /api/bills',
+            'POST /api/bills/bulk',
+            'POST /api/bills/number',
             'GET /api/bills',
+            'GET /api/bills/archives',
+            'GET /api/bills/<id>/render?format=html|pdf',
+            'POST /api/bills/render',
+            'GET /api/patients?prefix=<opd>',
+            'GET /api/patients/<opd_number>/bills',
+            'GET /api/metering/rates',
+            'POST /api/metering/price',
             'GET /api/statistics',
-            'GET /api/database/info'
+            'GET /api/events',
+            'GET /api/database/info',
+            'GET /api/database/outbox',
+            'GET /api/export/bills?format=csv|xlsx&lines=true&since=&until=',
+            'GET /api/export/items?format=csv|xlsx',
+            'GET /api/export/statistics?format=csv|xlsx',
+            'POST /api/jobs',
+            'GET /api/jobs',
+            'GET /api/jobs/<id>',
+            'POST /api/jobs/<id>/cancel',
+            'GET /api/jobs/<id>/download',
+            'GET /api/maintenance',
+            'POST /api/maintenance/run',
+            'GET /api/admin/profiles',
+            'GET /api/admin/profiles/<id>',
+            'POST /api/admin/profile/requests',
+            'POST /api/admin/profile/sample',
+            'GET /api/admin/memory',
+            'POST /api/admin/memory/snapshot|diff|stop'
         ],
         'timestamp': datetime.now().isoformat()
     }), 404
@@ -504,6 +1417,73 @@ def internal_error(error):
         'status_code': 500
     }), 500
 
+@app.before_request
+def admission_control():
+    """Rate limit and shed API requests before they reach the database"""
+    if os.getenv('ADMISSION_ENABLED', 'True').lower() != 'true':
+        return None
+    route_class = classify(request.method, request.path, request.args)
+    if route_class is None:
+        return None
+    
+    trust_proxy = os.getenv('ADMISSION_TRUST_PROXY', 'False').lower() == 'true'
+    client = request.access_route[0] if trust_proxy and request.access_route else request.remote_addr
+    rejection = get_admission_controller().admit(client or 'unknown', route_class)
+    if rejection is None:
+        g.admission_class = route_class
+        return None
+    
+    status, retry_after, reason = rejection
+    logger.warning(f"🚦 Rejected {request.method} {request.path} from {client}: {reason}")
+    response = jsonify({
+        'success': False,
+        'error': reason,
+        'message': 'Too many requests, retry later' if status == 429 else 'Server is busy, retry later'
+    })
+    response.status_code = status
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@app.after_request
+def admission_hold_for_stream(response):
+    """Keep a streamed response's slot until its last chunk is sent, not just until the view returns"""
+    route_class = g.get('admission_class')
+    if route_class is not None and response.is_streamed:
+        g.pop('admission_class')
+        controller = get_admission_controller()
+        response.call_on_close(lambda: controller.release(route_class))
+    return response
+
+@app.teardown_request
+def admission_release(error=None):
+    """Free the in-flight slot taken by admission_control"""
+    route_class = g.pop('admission_class', None)
+    if route_class is not None:
+        get_admission_controller().release(route_class)
+
+@app.before_request
+def start_maintenance_scheduler():
+    """Start this worker's maintenance scheduler on its first request"""
+    if get_maintenance_config()['enabled']:
+        get_maintenance_scheduler().start()
+
+@app.before_request
+def start_request_profile():
+    """Profile this request if an admin armed the request profiler"""
+    profiler = get_profilers().requests.start_request(request.path)
+    if profiler is not None:
+        g.request_profile = (profiler, time.perf_counter())
+
+@app.teardown_request
+def finish_request_profile(error=None):
+    """Add this request to the running request profile"""
+    started = g.pop('request_profile', None)
+    if started is not None:
+        profiler, start = started
+        get_profilers().requests.finish_request(profiler, request.method, request.path,
+                                                g.pop('response_status', 500 if error else None),
+                                                (time.perf_counter() - start) * 1000)
+
 @app.before_request
 def log_request_info():
     """Log request information for debugging"""
@@ -513,10 +1493,42 @@ def log_request_info():
 @app.after_request
 def log_response_info(response):
     """Log response information"""
+    if 'request_profile' in g:
+        g.response_status = response.status_code
     if request.path.startswith('/api/') and response.status_code >= 400:
         logger.warning(f"API Error Response: {request.method} {request.path} -> {response.status_code}")
     return response
 
+# Read-your-writes across workers: the client carries its last write time
+LAST_WRITE_COOKIE = 'last_write_at'
+LAST_WRITE_HEADER = 'X-Last-Write-At'
+
+@app.before_request
+def track_client_writes():
+    """Send this client's reads to the primary for a while after its own writes"""
+    supplied = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+    try:
+        last_write_at = float(supplied) if supplied else 0.0
+    except ValueError:
+        last_write_at = 0.0
+    begin_client_request(last_write_at)
+
+@app.after_request
+def remember_client_write(response):
+    """Hand the write time back to the client so any worker honours it (replicas only)"""
+    wrote_at = client_wrote_at()
+    if wrote_at is not None:
+        value = f'{wrote_at:.3f}'
+        response.set_cookie(LAST_WRITE_COOKIE, value, max_age=int(get_read_your_writes_seconds()) + 1,
+                            httponly=True, samesite='Lax')
+        response.headers[LAST_WRITE_HEADER] = value
+    return response
+
+@app.teardown_request
+def stop_tracking_client_writes(error=None):
+    """Stop tracking once the response (including a streamed body) is done"""
+    end_client_request()
+
 # Serve static files
 @app.route('/<path:filename>')
 def static_files(filename):
@@ -545,10 +1557,12 @@ if __name__ == '__main__':
     print('   - Health Check: http://0.0.0.0:5000/health')
     print('   - Database Info: http://0.0.0.0:5000/api/database/info')
     print('⚡ Professional Flask-SQLite server ready!')
-    print('💾 Using SQLite database')
+    print(f'💾 Using {get_backend_name()} database backend')
     print('🔐 Professional error handling and logging enabled')
     print('🚀 Production-ready features active')
     
+    create_app()
+    
     # Display database connection info
     db_info = db.get_connection_info()
     print(f'📊 Database Type: {db_info["database_type"]}')
@@ -0,0 +1,340 @@
+
+import os
+import time
+import socket
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from database_backend import db
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Run order: cheap bookkeeping first, the full integrity scan last so it gets what budget is left
+MAINTENANCE_TASKS = ('wal_checkpoint', 'optimize', 'analyze', 'incremental_vacuum', 'integrity_check')
+
+# Tables checked and analyzed on MySQL; archives and logs are left alone
+MYSQL_TABLES = ('items', 'bills', 'patients')
+
+# Free pages released per incremental_vacuum step between budget checks
+VACUUM_STEP_PAGES = 2000
+
+class BudgetExhausted(Exception):
+    """The run's time budget ran out before this task started"""
+
+def get_maintenance_config() -> Dict:
+    """Maintenance schedule and limits from environment variables"""
+    tasks = [task.strip() for task in os.getenv('MAINTENANCE_TASKS', ','.join(MAINTENANCE_TASKS)).split(',')
+             if task.strip()]
+    return {
+        'enabled': os.getenv('MAINTENANCE_ENABLED', 'True').lower() == 'true',
+        'window': os.getenv('MAINTENANCE_WINDOW', '02:00-05:00'),
+        'tasks': tasks,
+        'budget_seconds': float(os.getenv('MAINTENANCE_BUDGET_SECONDS', 300)),
+        # Largest SQLite file converted to incremental auto_vacuum with a one-off full VACUUM
+        'vacuum_max_mb': float(os.getenv('MAINTENANCE_VACUUM_MAX_MB', 512)),
+        'check_seconds': float(os.getenv('MAINTENANCE_CHECK_SECONDS', 60))
+    }
+
+def validate_tasks(tasks: List[str]) -> List[str]:
+    unknown = [task for task in tasks if task not in MAINTENANCE_TASKS]
+    if unknown:
+        raise ValueError(f"Unknown maintenance task(s) {', '.join(unknown)} (expected {', '.join(MAINTENANCE_TASKS)})")
+    return [task for task in MAINTENANCE_TASKS if task in tasks]
+
+def parse_window(window: str) -> Tuple[int, int]:
+    """'HH:MM-HH:MM' local time as minutes after midnight; the end may be past midnight"""
+    start, _, end = window.partition('-')
+    minutes = []
+    for value in (start, end):
+        hours, _, mins = value.strip().partition(':')
+        minutes.append(int(hours) * 60 + int(mins or 0))
+    return minutes[0], minutes[1]
+
+def window_key(window: str, now: Optional[datetime] = None) -> Optional[str]:
+    """Date the window containing `now` opened on, or None outside the window"""
+    now = now or datetime.now()
+    start, end = parse_window(window)
+    minute = now.hour * 60 + now.minute
+    if start <= end:
+        return now.strftime('%Y-%m-%d') if start <= minute < end else None
+    if minute >= start:
+        return now.strftime('%Y-%m-%d')
+    if minute < end:
+        return (now - timedelta(days=1)).strftime('%Y-%m-%d')
+    return None
+
+def next_window_start(window: str, now: Optional[datetime] = None) -> datetime:
+    now = now or datetime.now()
+    start, _ = parse_window(window)
+    opens = now.replace(hour=start // 60, minute=start % 60, second=0, microsecond=0)
+    return opens if opens > now else opens + timedelta(days=1)
+
+# ---------------------------------------------------------------------------
+# SQLite tasks
+# ---------------------------------------------------------------------------
+
+class SQLiteMaintenance:
+    """Maintenance statements on one SQLite file.
+
+    Each task runs under a deadline enforced with a progress handler, so a
+    long ANALYZE, VACUUM or integrity_check is interrupted (and rolled back)
+    instead of running past the window.
+    """
+
+    def __init__(self, db_path: str, vacuum_max_mb: float):
+        self.db_path = db_path
+        self.vacuum_max_mb = vacuum_max_mb
+        # Autocommit: VACUUM cannot run inside a transaction
+        self.conn = sqlite3.connect(db_path, isolation_level=None, timeout=5)
+
+    def close(self):
+        self.conn.close()
+
+    def _pragma(self, statement: str):
+        return self.conn.execute(f'PRAGMA {statement}').fetchone()[0]
+
+    def run(self, task: str, deadline: float) -> Dict:
+        self.conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+        try:
+            return getattr(self, task)(deadline)
+        finally:
+            self.conn.set_progress_handler(None, 0)
+
+    def wal_checkpoint(self, deadline: float) -> Dict:
+        journal_mode = self._pragma('journal_mode')
+        if journal_mode != 'wal':
+            return {'status': 'skipped', 'reason': f'journal_mode is {journal_mode}'}
+        busy, log_frames, checkpointed = self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        return {'status': 'partial' if busy else 'ok', 'log_frames': log_frames, 'checkpointed_frames': checkpointed}
+
+    def optimize(self, deadline: float) -> Dict:
+        self.conn.execute('PRAGMA optimize').fetchall()
+        return {'status': 'ok'}
+
+    def analyze(self, deadline: float) -> Dict:
+        # Sample rather than scan every index row; plenty for the planner
+        self.conn.execute('PRAGMA analysis_limit = 1000')
+        self.conn.execute('ANALYZE')
+        return {'status': 'ok', 'analysis_limit': 1000}
+
+    def incremental_vacuum(self, deadline: float) -> Dict:
+        page_size = self._pragma('page_size')
+        freelist_before = self._pragma('freelist_count')
+        details = {'freelist_pages_before': freelist_before}
+
+        if self._pragma('auto_vacuum') != 2:
+            size_mb = self._pragma('page_count') * page_size / 1024 / 1024
+            if size_mb > self.vacuum_max_mb:
+                return {'status': 'skipped', **details,
+                        'reason': f'auto_vacuum is off and the file ({size_mb:.0f} MB) is over MAINTENANCE_VACUUM_MAX_MB'}
+            # One-off rewrite that switches the file to incremental auto_vacuum
+            self.conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            self.conn.execute('VACUUM')
+            details['converted_to_incremental'] = True
+        else:
+            while self._pragma('freelist_count') and time.monotonic() < deadline:
+                self.conn.execute(f'PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})').fetchall()
+
+        freelist_after = self._pragma('freelist_count')
+        details.update({
+            'freelist_pages_after': freelist_after,
+            'bytes_reclaimed': max(freelist_before - freelist_after, 0) * page_size
+        })
+        return {'status': 'partial' if freelist_after else 'ok', **details}
+
+    def integrity_check(self, deadline: float) -> Dict:
+        messages = [row[0] for row in self.conn.execute('PRAGMA integrity_check(100)')]
+        if messages == ['ok']:
+            return {'status': 'ok'}
+        logger.error(f"❌ Integrity check of {self.db_path} found problems: {messages[:5]}")
+        return {'status': 'failed', 'problems': messages}
+
+# ---------------------------------------------------------------------------
+# MySQL tasks
+# ---------------------------------------------------------------------------
+
+class MySQLMaintenance:
+    """ANALYZE TABLE and CHECK TABLE on the primary; InnoDB purges and checkpoints on its own"""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def close(self):
+        pass
+
+    def _table_statement(self, statement: str) -> Dict:
+        from sqlalchemy import text
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(statement)).fetchall()
+        # Result rows are (Table, Op, Msg_type, Msg_text)
+        problems = [f'{row[0]}: {row[3]}' for row in rows if row[2] in ('error', 'warning')]
+        return {'status': 'failed' if problems else 'ok', 'tables': list(MYSQL_TABLES), 'problems': problems}
+
+    def run(self, task: str, deadline: float) -> Dict:
+        if task == 'analyze':
+            return self._table_statement(f"ANALYZE TABLE {', '.join(MYSQL_TABLES)}")
+        if task == 'integrity_check':
+            return self._table_statement(f"CHECK TABLE {', '.join(MYSQL_TABLES)} QUICK")
+        return {'status': 'skipped', 'reason': 'not applicable to InnoDB'}
+
+def _open_maintenance(database, config: Dict):
+    engine = getattr(database, 'engine', None)
+    if engine is None:
+        return SQLiteMaintenance(database.db_path, config['vacuum_max_mb'])
+    if engine.dialect.name == 'sqlite':
+        # SQLAlchemy backend on SQLite (fallback or configured): same file-level maintenance
+        return SQLiteMaintenance(engine.url.database, config['vacuum_max_mb'])
+    return MySQLMaintenance(engine)
+
+def run_maintenance(database, tasks: List[str], budget_seconds: float,
+                    progress: Optional[Callable[[int, int, str], None]] = None) -> List[Dict]:
+    """Run tasks in order within a shared time budget; one result dict per task"""
+    config = get_maintenance_config()
+    deadline = time.monotonic() + budget_seconds
+    maintenance = _open_maintenance(database, config)
+    results = []
+    try:
+        for index, task in enumerate(tasks):
+            if progress:
+                progress(index, len(tasks), task)
+            start = time.perf_counter()
+            try:
+                if time.monotonic() >= deadline:
+                    raise BudgetExhausted()
+                result = maintenance.run(task, deadline)
+            except BudgetExhausted:
+                result = {'status': 'skipped', 'reason': 'time budget exhausted'}
+            except sqlite3.OperationalError as e:
+                if 'interrupted' not in str(e):
+                    logger.error(f"Maintenance task {task} failed: {e}")
+                    result = {'status': 'failed', 'error': str(e)}
+                else:
+                    result = {'status': 'interrupted', 'reason': 'time budget exhausted'}
+            except Exception as e:
+                logger.error(f"Maintenance task {task} failed: {e}")
+                result = {'status': 'failed', 'error': str(e)}
+            result = {'task': task, **result, 'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)}
+            logger.info(f"🧹 Maintenance {task}: {result['status']} in {result['elapsed_ms']}ms")
+            results.append(result)
+    finally:
+        maintenance.close()
+    return results
+
+def run_status(results: List[Dict]) -> str:
+    """Overall run status: failed if any task failed, partial if any stopped short"""
+    statuses = {result['status'] for result in results}
+    if 'failed' in statuses:
+        return 'failed'
+    if statuses & {'interrupted', 'partial'}:
+        return 'partial'
+    return 'succeeded'
+
+def execute_run(database, source: str, tasks: List[str], budget_seconds: float,
+                window: Optional[str] = None, progress=None) -> Optional[Dict]:
+    """Record, run and finish one maintenance run; None if another worker already claimed the window"""
+    run = {
+        'window_key': window,
+        'source': source,
+        'status': 'running',
+        'tasks': tasks,
+        'worker': f'{socket.gethostname()}:{os.getpid()}',
+        'started_at': time.time()
+    }
+    run_id = database.start_maintenance_run(run)
+    if run_id is None:
+        return None
+
+    start = time.perf_counter()
+    try:
+        results = run_maintenance(database, tasks, budget_seconds, progress)
+        status = run_status(results)
+    except Exception as e:
+        logger.error(f"Maintenance run {run_id} failed: {e}")
+        results, status = [{'task': None, 'status': 'failed', 'error': str(e)}], 'failed'
+    fields = {
+        'status': status,
+        'results': results,
+        'finished_at': time.time(),
+        'duration_ms': round((time.perf_counter() - start) * 1000, 2)
+    }
+    database.finish_maintenance_run(run_id, fields)
+    return {'id': run_id, **run, **fields}
+
+class MaintenanceScheduler:
+    """Per-worker thread that starts one maintenance run per off-peak window.
+
+    Every worker runs the check; the first to insert the window's run row
+    does the work and the others see the unique window key taken.
+    """
+
+    def __init__(self, database, config: Dict):
+        self.database = database
+        self.config = config
+        self.last_window = None
+        self.last_run = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name='maintenance-scheduler', daemon=True)
+            self._thread.start()
+            logger.info(f"🕑 Maintenance scheduler started (window {self.config['window']})")
+
+    def _loop(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Maintenance scheduler error: {e}")
+            time.sleep(self.config['check_seconds'])
+
+    def check(self, now: Optional[datetime] = None):
+        """Start this window's run if it is open and no run has claimed it yet"""
+        key = window_key(self.config['window'], now)
+        if key is None or key == self.last_window:
+            return
+        self.last_window = key
+        run = execute_run(self.database, 'scheduled', validate_tasks(self.config['tasks']),
+                          self.config['budget_seconds'], window=key)
+        if run is not None:
+            self.last_run = run
+
+    def get_info(self) -> Dict:
+        return {
+            'enabled': self.config['enabled'],
+            'running': self._thread is not None,
+            'window': self.config['window'],
+            'next_window': next_window_start(self.config['window']).isoformat(),
+            'tasks': self.config['tasks'],
+            'budget_seconds': self.config['budget_seconds']
+        }
+
+_scheduler = None
+_scheduler_pid = None
+_scheduler_lock = threading.Lock()
+
+def get_maintenance_scheduler() -> MaintenanceScheduler:
+    """Return this worker's maintenance scheduler, creating it after fork if needed"""
+    global _scheduler, _scheduler_pid
+    pid = os.getpid()
+    if _scheduler is None or _scheduler_pid != pid:
+        with _scheduler_lock:
+            if _scheduler is None or _scheduler_pid != pid:
+                _scheduler = MaintenanceScheduler(db, get_maintenance_config())
+                _scheduler_pid = pid
+    return _scheduler
+
+def maintenance_run_to_json(run: Dict) -> Dict:
+    """API view of a maintenance run with ISO timestamps"""
+    view = dict(run)
+    for field in ('started_at', 'finished_at'):
+        if view.get(field) is not None:
+            view[field] = datetime.fromtimestamp(view[field]).isoformat()
+    return view
@@ -0,0 +1,171 @@
+
+import math
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # optional: batches are priced in a plain loop with identical arithmetic
+    np = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+METERED_CATEGORY = 'O2, ISO'
+
+# Metered services priced from their catalog item. A session's billed
+# quantity is its duration in seconds times a per-second factor: liters
+# for O2 (flow rate in L/hr / 3600), minutes for ISO (1 / 60).
+METERED_SERVICES = {
+    'o2': {'item_name': 'O2 Service', 'unit': 'L', 'default_flow_rate': 2.0},
+    'iso': {'item_name': 'ISO Service', 'unit': 'min'},
+}
+
+# Largest batch priced in one call
+MAX_SESSIONS = 5000
+
+class MeteringError(ValueError):
+    """Invalid sessions or missing rates; errors lists {'index', 'error'} entries"""
+
+    def __init__(self, message: str, errors: Optional[List[Dict]] = None):
+        super().__init__(message)
+        self.errors = errors or []
+
+def load_rates(database) -> Dict[str, Dict]:
+    """Current price per unit for each metered service, from the catalog"""
+    items = {item['name']: item for item in database.get_items_by_category(METERED_CATEGORY)}
+    rates = {}
+    for service, spec in METERED_SERVICES.items():
+        item = items.get(spec['item_name'])
+        if item is None:
+            raise MeteringError(f"Catalog item '{spec['item_name']}' in '{METERED_CATEGORY}' is missing")
+        rates[service] = {
+            'item_id': item['id'],
+            'name': item['name'],
+            'type': item['type'],
+            'unit': spec['unit'],
+            'unit_price': float(item['price'])
+        }
+    return rates
+
+def _timestamp(value) -> float:
+    """Epoch seconds from an ISO string or a number; naive times are taken as UTC"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    parsed = datetime.fromisoformat(str(value))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def _parse_sessions(sessions: List[Dict]):
+    """Validate sessions into parallel lists: services, starts, ends, per-second factors"""
+    if not isinstance(sessions, list) or not sessions:
+        raise MeteringError('sessions must be a non-empty list')
+    if len(sessions) > MAX_SESSIONS:
+        raise MeteringError(f'At most {MAX_SESSIONS} sessions can be priced at once')
+
+    services, starts, ends, factors, flow_rates, errors = [], [], [], [], [], []
+    for index, session in enumerate(sessions):
+        try:
+            service = str(session.get('service', '')).lower()
+            spec = METERED_SERVICES.get(service)
+            if spec is None:
+                raise ValueError(f"Unknown service '{session.get('service')}' (expected one of {', '.join(METERED_SERVICES)})")
+            start = _timestamp(session['start'])
+            end = _timestamp(session['end'])
+            if end <= start:
+                raise ValueError('end must be after start')
+            if service == 'o2':
+                flow_rate = float(session.get('flow_rate') or spec['default_flow_rate'])
+                if flow_rate <= 0:
+                    raise ValueError('flow_rate must be positive')
+                factor = flow_rate / 3600
+            else:
+                flow_rate = None
+                factor = 1 / 60
+        except KeyError as e:
+            errors.append({'index': index, 'error': f'Missing field {e}'})
+            continue
+        except (TypeError, ValueError, AttributeError) as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+        services.append(service)
+        starts.append(start)
+        ends.append(end)
+        factors.append(factor)
+        flow_rates.append(flow_rate)
+
+    if errors:
+        raise MeteringError(f'{len(errors)} of {len(sessions)} sessions are invalid', errors)
+    return services, starts, ends, factors, flow_rates
+
+def _charges_vectorized(starts, ends, factors, prices):
+    seconds = np.asarray(ends, dtype=np.float64) - np.asarray(starts, dtype=np.float64)
+    quantities = seconds * np.asarray(factors, dtype=np.float64)
+    # Round half up to the paisa, in the same float operations as the loop below
+    charges = np.floor(quantities * np.asarray(prices, dtype=np.float64) * 100 + 0.5) / 100
+    return seconds.tolist(), quantities.tolist(), charges.tolist()
+
+def _charges_loop(starts, ends, factors, prices):
+    seconds = [end - start for start, end in zip(starts, ends)]
+    quantities = [duration * factor for duration, factor in zip(seconds, factors)]
+    charges = [math.floor(quantity * price * 100 + 0.5) / 100 for quantity, price in zip(quantities, prices)]
+    return seconds, quantities, charges
+
+def price_sessions(sessions: List[Dict], rates: Dict[str, Dict], vectorized: Optional[bool] = None) -> Dict:
+    """Price metered sessions in one pass; returns per-session charges, bill lines and the total.
+
+    Durations, quantities and charges are computed for the whole batch at
+    once (with numpy when installed), so every session in a bill is priced
+    with the same rates and rounding.
+    """
+    services, starts, ends, factors, flow_rates = _parse_sessions(sessions)
+    prices = [rates[service]['unit_price'] for service in services]
+
+    use_numpy = np is not None if vectorized is None else vectorized
+    compute = _charges_vectorized if use_numpy else _charges_loop
+    seconds, quantities, charges = compute(starts, ends, factors, prices)
+
+    priced = []
+    for index, service in enumerate(services):
+        rate = rates[service]
+        # Echo times as the client sent them
+        start, end = sessions[index]['start'], sessions[index]['end']
+        hours = seconds[index] / 3600
+        quantity = round(quantities[index], 2)
+        if service == 'o2':
+            detail = f"{quantity}{rate['unit']} total ({flow_rates[index]}L/hr × {hours:.2f}hrs)"
+        else:
+            detail = f"{quantity}{rate['unit']} ({hours:.2f}hrs)"
+        priced.append({
+            'service': service,
+            'item_id': rate['item_id'],
+            'start': start,
+            'end': end,
+            'minutes': round(seconds[index] / 60, 2),
+            'hours': round(hours, 4),
+            'flow_rate': flow_rates[index],
+            'quantity': quantity,
+            'unit': rate['unit'],
+            'unit_price': rate['unit_price'],
+            'charge': charges[index],
+            'bill_item': {
+                'category': METERED_CATEGORY,
+                'name': rate['name'],
+                'type': rate['type'],
+                'strength': detail,
+                'quantity': 1,
+                'price': charges[index],
+                'totalPrice': charges[index],
+                'description': f"{rate['name']}: {detail} from {start} to {end}"
+            }
+        })
+
+    return {
+        'sessions': priced,
+        'count': len(priced),
+        'total': round(math.fsum(charges), 2),
+        'vectorized': use_numpy
+    }
@@ -11,7 +11,9 @@ import logging
 from datetime import datetime
 from dotenv import load_dotenv
 from mysql_database import db, Base, Item, Bill, Setting
+from schema_migrations import SQLAlchemyMigrator, DataMigrationRunner, DATA_MIGRATIONS, latest_version
 from sqlalchemy import text
+from maintenance import MAINTENANCE_TASKS, execute_run, get_maintenance_config, validate_tasks
 
 # Load environment variables
 load_dotenv()
@@ -108,12 +110,12 @@ class DatabaseManager:
             
             # Drop all tables
             Base.metadata.drop_all(self.db.engine)
+            with self.db.engine.begin() as conn:
+                conn.execute(text("DROP TABLE IF EXISTS schema_version"))
+                conn.execute(text("DROP TABLE IF EXISTS data_migration_checkpoints"))
             
-            # Recreate tables
-            Base.metadata.create_all(self.db.engine)
-            
-            # Reseed sample data
-            self.db._seed_sample_data()
+            # Recreate tables, reseed sample data and restamp the schema version
+            self.db._ensure_schema()
             
             logger.info("✅ Database reset and reseeded successfully")
             return True
@@ -122,36 +124,85 @@ class DatabaseManager:
             logger.error(f"Error resetting database: {e}")
             return False
     
-    def optimize_database(self):
-        """Optimize database performance"""
+    def optimize_database(self, tasks=None):
+        """Run the database maintenance tasks now and log their results"""
         try:
-            logger.info("🔧 Optimizing database...")
+            config = get_maintenance_config()
+            tasks = validate_tasks(tasks or list(MAINTENANCE_TASKS))
+            logger.info(f"🔧 Running maintenance: {', '.join(tasks)} (budget {config['budget_seconds']}s)")
             
-            with self.db.get_session() as session:
-                # Add indexes if they don't exist
-                try:
-                    session.execute(text("CREATE INDEX IF NOT EXISTS idx_items_category ON items(category)"))
-                    session.execute(text("CREATE INDEX IF NOT EXISTS idx_items_name ON items(name)"))
-                    session.execute(text("CREATE INDEX IF NOT EXISTS idx_bills_bill_number ON bills(bill_number)"))
-                    session.execute(text("CREATE INDEX IF NOT EXISTS idx_bills_created_at ON bills(created_at)"))
-                    logger.info("✅ Database indexes optimized")
-                except Exception as e:
-                    logger.warning(f"Index optimization note: {e}")
-                
-                # Analyze tables for better query performance
-                try:
-                    session.execute(text("ANALYZE TABLE items"))
-                    session.execute(text("ANALYZE TABLE bills"))
-                    logger.info("✅ Database tables analyzed")
-                except Exception as e:
-                    logger.warning(f"Table analysis note: {e}")
-            
-            logger.info("✅ Database optimization completed")
-            return True
+            run = execute_run(self.db, 'manual', tasks, config['budget_seconds'])
+            for result in run['results']:
+                logger.info(f"  {result['task']:<20} {result['status']:<12} {result['elapsed_ms']:>10.2f} ms")
+            
+            logger.info(f"✅ Database maintenance {run['status']} in {run['duration_ms']}ms")
+            return run['status'] != 'failed'
             
         except Exception as e:
             logger.error(f"Error optimizing database: {e}")
             return False
+    
+    def run_migrations(self):
+        """Apply pending schema migrations"""
+        try:
+            migrator = SQLAlchemyMigrator(self.db.engine)
+            current = migrator.current_version()
+            logger.info(f"📋 Schema version: {current} (latest: {latest_version()})")
+            
+            applied = migrator.migrate()
+            if applied:
+                logger.info(f"✅ Applied migrations: {', '.join(str(v) for v in applied)}")
+            else:
+                logger.info("✅ Schema is up to date")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error applying migrations: {e}")
+            return False
+    
+    def show_migrations(self):
+        """Show applied and pending schema migrations"""
+        try:
+            migrator = SQLAlchemyMigrator(self.db.engine)
+            logger.info("📋 Applied migrations:")
+            for entry in migrator.applied():
+                logger.info(f"   {entry['version']}: {entry['description']} "
+                            f"({entry['applied_at']}, {entry['duration_ms']} ms)")
+            
+            pending = migrator.pending()
+            logger.info("⏳ Pending migrations:" if pending else "✅ No pending migrations")
+            for migration in pending:
+                logger.info(f"   {migration.version}: {migration.description}")
+            
+            runner = DataMigrationRunner(migrator)
+            for name in DATA_MIGRATIONS:
+                status = runner.status(name)
+                logger.info(f"🔄 Data migration {name}: {status['status'] if status else 'not started'}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error reading migrations: {e}")
+            return False
+    
+    def run_data_migration(self, name, pause=0.0):
+        """Run or resume a batched data migration"""
+        try:
+            if name not in DATA_MIGRATIONS:
+                logger.error(f"Unknown data migration: {name}")
+                logger.info(f"Available: {', '.join(DATA_MIGRATIONS) or 'none'}")
+                return False
+            
+            runner = DataMigrationRunner(SQLAlchemyMigrator(self.db.engine))
+            checkpoint = runner.run(DATA_MIGRATIONS[name], pause=pause)
+            logger.info(f"✅ {name}: {checkpoint['rows_done']} rows, status {checkpoint['status']}")
+            return checkpoint['status'] == 'completed'
+            
+        except KeyboardInterrupt:
+            logger.warning(f"⚠️ {name} interrupted; rerun the command to resume from the last checkpoint")
+            return False
+        except Exception as e:
+            logger.error(f"Error running data migration {name}: {e}")
+            return False
 
 def main():
     """Main function for database management"""
@@ -164,7 +215,10 @@ def main():
         print("  backup     - Create database backup")
         print("  stats      - Show database statistics")
         print("  reset      - Reset database (DANGEROUS)")
-        print("  optimize   - Optimize database performance")
+        print("  optimize [task,...] - Run maintenance now (ANALYZE, PRAGMA optimize, vacuum, integrity check)")
+        print("  migrate    - Apply pending schema migrations")
+        print("  migrations - Show applied and pending migrations")
+        print("  data-migrate <name> [pause_seconds] - Run or resume a batched data migration")
         sys.exit(1)
     
     command = sys.argv[1].lower()
@@ -196,7 +250,30 @@ def main():
             sys.exit(1)
     
     elif command == 'optimize':
-        if manager.optimize_database():
+        tasks = sys.argv[2].split(',') if len(sys.argv) > 2 else None
+        if manager.optimize_database(tasks):
+            sys.exit(0)
+        else:
+            sys.exit(1)
+    
+    elif command == 'migrate':
+        if manager.run_migrations():
+            sys.exit(0)
+        else:
+            sys.exit(1)
+    
+    elif command == 'migrations':
+        if manager.show_migrations():
+            sys.exit(0)
+        else:
+            sys.exit(1)
+    
+    elif command == 'data-migrate':
+        if len(sys.argv) < 3:
+            logger.error("Usage: python migrate_database.py data-migrate <name> [pause_seconds]")
+            sys.exit(1)
+        pause = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+        if manager.run_data_migration(sys.argv[2], pause):
             sys.exit(0)
         else:
             sys.exit(1)
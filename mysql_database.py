@@ -1,17 +1,27 @@
 
 import os
 import json
+import time
 import logging
+import threading
+import uuid
 from datetime import datetime
-from typing import List, Dict, Optional, Any
+from typing import Callable, List, Dict, Optional, Any, Iterator
 from contextlib import contextmanager
-from sqlalchemy import create_engine, Column, Integer, String, Float, Text, DateTime, JSON, text
+from sqlalchemy import event, create_engine, Column, Integer, String, Float, Text, DateTime, JSON, Boolean, ForeignKey, Index, MetaData, Table, text, select, insert, update, delete, func, literal, inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.pool import QueuePool
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 import mysql.connector
 from mysql.connector import Error as MySQLError
+import fast_json
+from database_backend import (HospitalDatabase, LazyDatabase, DuplicateBillNumberError, is_bill_number_conflict,
+                              client_last_write_at, note_rows_written,
+                              finish_client_transaction, get_read_your_writes_seconds,
+                              get_item_changes_retention)
+from schema_migrations import SQLAlchemyMigrator, latest_version, normalize_opd_number
+from bill_archive import archives_in_range, month_start, next_month, month_key
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,6 +29,9 @@ logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# JSON columns (bill items) are encoded and parsed with the fast codec
+JSON_CODEC = {'json_serializer': fast_json.dumps, 'json_deserializer': fast_json.loads}
+
 class Item(Base):
     __tablename__ = 'items'
     
@@ -45,6 +58,16 @@ class Item(Base):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+class Patient(Base):
+    __tablename__ = 'patients'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # The unique index serves exact and prefix (range) lookups
+    opd_number = Column(String(100), unique=True, nullable=False)
+    name = Column(String(255))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class Bill(Base):
     __tablename__ = 'bills'
     
@@ -55,6 +78,7 @@ class Bill(Base):
     total_amount = Column(Float, nullable=False)
     items_json = Column(JSON)
     created_at = Column(DateTime, default=datetime.utcnow)
+    patient_id = Column(Integer, ForeignKey('patients.id', name='fk_bills_patient'))
     
     def to_dict(self):
         return {
@@ -67,6 +91,225 @@ class Bill(Base):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+class ItemChange(Base):
+    __tablename__ = 'item_changes'
+    
+    version = Column(Integer, primary_key=True, autoincrement=True)
+    item_id = Column(Integer, nullable=False)
+    operation = Column(String(10), nullable=False)
+    changed_at = Column(DateTime, default=datetime.utcnow)
+
+class BillSequence(Base):
+    __tablename__ = 'bill_sequences'
+    
+    department = Column(String(50), primary_key=True)
+    next_value = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class IdempotencyKey(Base):
+    __tablename__ = 'idempotency_keys'
+    
+    idempotency_key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer)
+    response_body = Column(Text)
+    expires_at = Column(Float, nullable=False, index=True)
+
+class Job(Base):
+    __tablename__ = 'jobs'
+    
+    id = Column(String(36), primary_key=True)
+    job_type = Column(String(50), nullable=False)
+    status = Column(String(20), nullable=False, index=True)
+    params = Column(JSON)
+    progress = Column(Float, nullable=False, default=0)
+    message = Column(Text)
+    result = Column(JSON)
+    error = Column(Text)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    worker = Column(String(100))
+    created_at = Column(Float, nullable=False, index=True)
+    started_at = Column(Float)
+    finished_at = Column(Float)
+
+class MaintenanceRun(Base):
+    __tablename__ = 'maintenance_runs'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # Date of the scheduled window the run belongs to; unique so one worker claims it
+    window_key = Column(String(10), unique=True)
+    source = Column(String(20), nullable=False)
+    status = Column(String(20), nullable=False)
+    tasks = Column(JSON)
+    results = Column(JSON)
+    worker = Column(String(100))
+    started_at = Column(Float, nullable=False, index=True)
+    finished_at = Column(Float)
+    duration_ms = Column(Float)
+
+class OutboxEntry(Base):
+    """A write made while running on the SQLite fallback, waiting to be replayed"""
+    __tablename__ = 'fallback_outbox'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    entry_key = Column(String(36), unique=True, nullable=False)
+    operation = Column(String(20), nullable=False)
+    local_id = Column(Integer)
+    payload = Column(JSON, nullable=False)
+    status = Column(String(20), nullable=False, default='pending', index=True)
+    primary_id = Column(Integer)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    replayed_at = Column(DateTime)
+
+class OutboxReplay(Base):
+    """Outbox entries already applied on the primary (makes replay idempotent)"""
+    __tablename__ = 'outbox_replays'
+    
+    entry_key = Column(String(36), primary_key=True)
+    status = Column(String(20), nullable=False)
+    primary_id = Column(Integer)
+    error = Column(Text)
+    replayed_at = Column(DateTime, default=datetime.utcnow)
+
+# Column projections for read paths that build dicts straight from rows,
+# skipping ORM instances and the identity map
+ITEM_COLUMNS = (Item.id, Item.category, Item.name, Item.type, Item.strength,
+                Item.price, Item.description, Item.created_at, Item.updated_at)
+BILL_COLUMNS = (Bill.id, Bill.bill_number, Bill.patient_name, Bill.opd_number,
+                Bill.total_amount, Bill.items_json, Bill.created_at)
+
+JOB_COLUMNS = ('id', 'job_type', 'status', 'params', 'progress', 'message', 'result', 'error',
+               'cancel_requested', 'worker', 'created_at', 'started_at', 'finished_at')
+JOB_TABLE_COLUMNS = tuple(getattr(Job, column) for column in JOB_COLUMNS)
+
+MAINTENANCE_RUN_COLUMNS = ('id', 'window_key', 'source', 'status', 'tasks', 'results', 'worker',
+                           'started_at', 'finished_at', 'duration_ms')
+MAINTENANCE_RUN_TABLE_COLUMNS = tuple(getattr(MaintenanceRun, column) for column in MAINTENANCE_RUN_COLUMNS)
+
+# Rows per executemany round trip in the bulk write paths
+BULK_CHUNK_SIZE = 1000
+
+def _track_written_rows(conn, cursor, statement, parameters, context, executemany):
+    """Engine hook: note INSERT/UPDATE/DELETE statements that changed rows for read-your-writes"""
+    if (context.isinsert or context.isupdate or context.isdelete) and cursor.rowcount != 0:
+        note_rows_written()
+
+def item_row_to_dict(row) -> Dict:
+    """Build the API item dict from an ITEM_COLUMNS row"""
+    return {
+        'id': row[0],
+        'category': row[1],
+        'name': row[2],
+        'type': row[3],
+        'strength': row[4],
+        'price': row[5],
+        'description': row[6],
+        'created_at': row[7].isoformat() if row[7] else None,
+        'updated_at': row[8].isoformat() if row[8] else None
+    }
+
+def bill_row_to_dict(row) -> Dict:
+    """Build the API bill dict from a BILL_COLUMNS row"""
+    return {
+        'id': row[0],
+        'bill_number': row[1],
+        'patient_name': row[2],
+        'opd_number': row[3],
+        'total_amount': row[4],
+        'items': row[5],
+        'created_at': row[6].isoformat() if row[6] else None
+    }
+
+def job_row_to_dict(row) -> Dict:
+    """Build a job dict from a JOB_TABLE_COLUMNS row"""
+    job = dict(zip(JOB_COLUMNS, row))
+    job['params'] = job['params'] or {}
+    job['cancel_requested'] = bool(job['cancel_requested'])
+    return job
+
+def _item_values(item_data: Dict) -> Dict:
+    """Column values for an item insert/update"""
+    return {
+        'category': item_data['category'],
+        'name': item_data['name'],
+        'type': item_data.get('type', ''),
+        'strength': item_data.get('strength', ''),
+        'price': item_data['price'],
+        'description': item_data.get('description', '')
+    }
+
+def _bill_values(bill_data: Dict) -> Dict:
+    """Column values for a bill insert"""
+    return {
+        'bill_number': bill_data['bill_number'],
+        'patient_name': bill_data.get('patient_name', ''),
+        'opd_number': bill_data.get('opd_number', ''),
+        'total_amount': bill_data['total_amount'],
+        'items_json': bill_data['items']
+    }
+
+def _chunks(rows: List, size: int = BULK_CHUNK_SIZE):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+PATIENT_COLUMNS = (Patient.id, Patient.opd_number, Patient.name, Patient.created_at, Patient.updated_at)
+
+def patient_row_to_dict(row) -> Dict:
+    """Build the API patient dict from a PATIENT_COLUMNS row"""
+    return {
+        'id': row[0],
+        'opd_number': row[1],
+        'name': row[2],
+        'created_at': row[3].isoformat() if row[3] else None,
+        'updated_at': row[4].isoformat() if row[4] else None
+    }
+
+def resolve_patient_ids(session: Session, bills: List[Dict]) -> Dict[str, int]:
+    """Patient id per OPD number for bills about to be saved, registering new patients"""
+    names = {}
+    for bill in bills:
+        opd = normalize_opd_number(bill.get('opd_number'))
+        if opd:
+            names[opd] = bill.get('patient_name') or names.get(opd, '')
+    if not names:
+        return {}
+    
+    known = {}
+    for chunk in _chunks(list(names)):
+        for opd, patient_id, name in session.execute(
+                select(Patient.opd_number, Patient.id, Patient.name).where(Patient.opd_number.in_(chunk))):
+            known[opd] = (patient_id, name)
+    
+    missing = [opd for opd in names if opd not in known]
+    if missing:
+        try:
+            with session.begin_nested():
+                session.execute(insert(Patient), [{'opd_number': opd, 'name': names[opd]} for opd in missing])
+        except IntegrityError:
+            # Another worker registered some of them first; insert the rest one by one
+            for opd in missing:
+                try:
+                    with session.begin_nested():
+                        session.execute(insert(Patient).values(opd_number=opd, name=names[opd]))
+                except IntegrityError:
+                    pass
+        for chunk in _chunks(missing):
+            for opd, patient_id in session.execute(
+                    select(Patient.opd_number, Patient.id).where(Patient.opd_number.in_(chunk))):
+                known[opd] = (patient_id, names[opd])
+    
+    for opd, name in names.items():
+        if name and known[opd][1] != name:
+            session.execute(update(Patient).where(Patient.id == known[opd][0])
+                            .values(name=name, updated_at=datetime.utcnow()))
+    return {opd: patient_id for opd, (patient_id, _) in known.items()}
+
+def _with_patient_ids(session: Session, rows: List[Dict]) -> List[Dict]:
+    """Bill insert values with patient_id filled in"""
+    patient_ids = resolve_patient_ids(session, rows)
+    return [{**row, 'patient_id': patient_ids.get(normalize_opd_number(row['opd_number']))} for row in rows]
+
 class Setting(Base):
     __tablename__ = 'settings'
     
@@ -74,11 +317,74 @@ class Setting(Base):
     value = Column(Text, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-class MySQLHospitalDB:
-    def __init__(self):
-        self.engine = None
+class BillArchive(Base):
+    __tablename__ = 'bill_archives'
+    
+    month = Column(String(7), primary_key=True)
+    location = Column(String(255), nullable=False)
+    first_id = Column(Integer)
+    last_id = Column(Integer)
+    bill_count = Column(Integer, nullable=False, default=0)
+    total_amount = Column(Float, nullable=False, default=0)
+    bytes = Column(Integer)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+ARCHIVE_CATALOG_COLUMNS = (BillArchive.month, BillArchive.location, BillArchive.first_id, BillArchive.last_id,
+                           BillArchive.bill_count, BillArchive.total_amount, BillArchive.bytes,
+                           BillArchive.archived_at)
+
+def archive_row_to_dict(row) -> Dict:
+    """Build an archive catalog dict from an ARCHIVE_CATALOG_COLUMNS row"""
+    archive = {column.key: value for column, value in zip(ARCHIVE_CATALOG_COLUMNS, row)}
+    archive['archived_at'] = row[7].isoformat() if row[7] else None
+    return archive
+
+# Monthly archive tables live outside Base.metadata so create_all never touches them
+_archive_metadata = MetaData()
+_archive_metadata_lock = threading.Lock()
+
+def archive_table(name: str) -> Table:
+    """A closed month's bills: the bills columns without the foreign key, compressed rows on MySQL"""
+    with _archive_metadata_lock:
+        table = _archive_metadata.tables.get(name)
+        if table is None:
+            table = Table(
+                name, _archive_metadata,
+                Column('id', Integer, primary_key=True, autoincrement=False),
+                Column('bill_number', String(100), nullable=False),
+                Column('patient_name', String(255)),
+                Column('opd_number', String(100)),
+                Column('total_amount', Float, nullable=False),
+                Column('items_json', JSON),
+                Column('created_at', DateTime),
+                Column('patient_id', Integer),
+                Index(f'idx_{name}_created_at', 'created_at'),
+                Index(f'idx_{name}_patient_created', 'patient_id', 'created_at'),
+                mysql_row_format='COMPRESSED'
+            )
+        return table
+
+def archive_bill_columns(table: Table):
+    """The BILL_COLUMNS projection on an archive table"""
+    return (table.c.id, table.c.bill_number, table.c.patient_name, table.c.opd_number,
+            table.c.total_amount, table.c.items_json, table.c.created_at)
+
+class MySQLHospitalDB(HospitalDatabase):
+    def __init__(self, engine=None):
+        self.engine = engine
         self.SessionLocal = None
         self.connected = False
+        self.schema_version = 0
+        self.init_timings = {}
+        self.item_changes_retention = get_item_changes_retention()
+        self.replicas = []
+        self._replica_cursor = 0
+        self._replica_lock = threading.Lock()
+        self.fallback_active = False
+        self.primary_engine = None
+        self.fallback_engine = None
+        self.last_replay = None
+        self._switch_lock = threading.RLock()
         self._initialize_connection()
     
     def _get_database_config(self):
@@ -93,6 +399,46 @@ class MySQLHospitalDB:
             'collation': 'utf8mb4_unicode_ci'
         }
     
+    def _get_pool_config(self):
+        """Get connection pool tuning from environment variables with fallbacks"""
+        return {
+            'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 20)),
+            'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 3600)),
+            'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'True').lower() == 'true',
+            'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30))
+        }
+    
+    def _get_replica_config(self):
+        """Get read-replica routing settings from environment variables"""
+        hosts = [h.strip() for h in os.getenv('DB_REPLICA_HOSTS', '').split(',') if h.strip()]
+        return {
+            'hosts': hosts,
+            # A client's reads go to the primary for this long after its own last write
+            'read_your_writes_seconds': get_read_your_writes_seconds(),
+            # How long a failed replica is skipped before being tried again
+            'retry_seconds': float(os.getenv('DB_REPLICA_RETRY_SECONDS', 30))
+        }
+    
+    def _get_fallback_config(self):
+        """Get SQLite fallback and outbox replay settings from environment variables"""
+        return {
+            'path': os.path.join(os.getcwd(), 'hospital_billing_fallback.db'),
+            # How often a process running on the fallback checks whether MySQL is back
+            'recheck_seconds': float(os.getenv('FALLBACK_RECHECK_SECONDS', 30)),
+            # Outbox entries replayed per primary transaction
+            'replay_batch_size': int(os.getenv('FALLBACK_REPLAY_BATCH_SIZE', 100))
+        }
+    
+    def _build_connection_string(self, host, port):
+        """Build the SQLAlchemy URL for a MySQL server"""
+        config = self._get_database_config()
+        return (
+            f"mysql+pymysql://{config['user']}:{config['password']}@"
+            f"{host}:{port}/{config['database']}"
+            f"?charset={config['charset']}"
+        )
+    
     def _create_database_if_not_exists(self):
         """Create database if it doesn't exist"""
         config = self._get_database_config()
@@ -127,47 +473,78 @@ class MySQLHospitalDB:
             logger.error(f"❌ Database setup error: {e}")
             return False
     
+    def _ensure_schema(self):
+        """Apply pending schema migrations and seed data on a fresh database"""
+        start = time.perf_counter()
+        migrator = SQLAlchemyMigrator(self.engine)
+        stored_version = migrator.current_version()
+        self.init_timings['schema_check_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        
+        if stored_version >= latest_version():
+            self.schema_version = stored_version
+            return
+        
+        start = time.perf_counter()
+        applied = migrator.migrate()
+        self.init_timings['migrate_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        self.schema_version = latest_version()
+        logger.info(f"✅ Schema migrations applied: {applied}")
+        
+        # Only the process that created the tables (migration 1) seeds them
+        if 1 in applied:
+            start = time.perf_counter()
+            self._seed_sample_data()
+            self.init_timings['seed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    
     def _initialize_connection(self):
         """Initialize database connection with proper error handling"""
+        if self.engine is not None:
+            # Engine supplied by the caller (benchmarks, tools): use it as-is
+            self.SessionLocal = sessionmaker(bind=self.engine)
+            self.connected = True
+            self._ensure_schema()
+            return
+        
         try:
-            # First ensure database exists
-            if not self._create_database_if_not_exists():
-                logger.warning("⚠️ Could not set up database, falling back to SQLite")
-                return self._fallback_to_sqlite()
-            
             config = self._get_database_config()
             
             # Create SQLAlchemy engine with connection pooling
-            connection_string = (
-                f"mysql+pymysql://{config['user']}:{config['password']}@"
-                f"{config['host']}:{config['port']}/{config['database']}"
-                f"?charset={config['charset']}"
-            )
+            connection_string = self._build_connection_string(config['host'], config['port'])
             
             self.engine = create_engine(
                 connection_string,
                 poolclass=QueuePool,
-                pool_size=10,
-                max_overflow=20,
-                pool_pre_ping=True,
-                pool_recycle=3600,
-                echo=False
+                echo=False,
+                **JSON_CODEC,
+                **self._get_pool_config()
             )
             
-            # Test connection
-            with self.engine.connect() as conn:
-                conn.execute(text("SELECT 1"))
+            # Test connection; only provision the database and user when it fails
+            start = time.perf_counter()
+            try:
+                with self.engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+            except Exception as e:
+                logger.warning(f"⚠️ Initial MySQL connection failed ({e}), attempting database setup")
+                if not self._create_database_if_not_exists():
+                    logger.warning("⚠️ Could not set up database, falling back to SQLite")
+                    return self._fallback_to_sqlite()
+                with self.engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+            self.init_timings['connect_ms'] = round((time.perf_counter() - start) * 1000, 2)
             
             self.SessionLocal = sessionmaker(bind=self.engine)
-            
-            # Create tables
-            Base.metadata.create_all(self.engine)
-            
             self.connected = True
             logger.info("✅ MySQL connection established successfully")
             
-            # Seed with sample data if needed
-            self._seed_sample_data()
+            # Create tables and seed only if the stored schema version is behind
+            self._ensure_schema()
+            
+            self._initialize_replicas()
+            
+            # Writes left behind by a process that stopped while on the fallback
+            if os.path.exists(self._get_fallback_config()['path']):
+                self._start_outbox_worker()
             
         except Exception as e:
             logger.error(f"❌ MySQL connection failed: {e}")
@@ -177,48 +554,193 @@ class MySQLHospitalDB:
     def _fallback_to_sqlite(self):
         """Fallback to SQLite if MySQL is not available"""
         try:
-            sqlite_path = os.path.join(os.getcwd(), 'hospital_billing_fallback.db')
+            sqlite_path = self._get_fallback_config()['path']
             connection_string = f"sqlite:///{sqlite_path}"
             
-            self.engine = create_engine(connection_string, echo=False)
-            self.SessionLocal = sessionmaker(bind=self.engine)
+            # Keep the MySQL engine so the outbox worker can tell when it is back
+            if self.engine is not None and self.engine.dialect.name == 'mysql':
+                self.primary_engine = self.engine
             
-            # Create tables
-            Base.metadata.create_all(self.engine)
+            self.engine = create_engine(connection_string, echo=False, **JSON_CODEC)
+            self.fallback_engine = self.engine
+            self.SessionLocal = sessionmaker(bind=self.engine)
             
             self.connected = True
+            self.fallback_active = True
             logger.info("✅ SQLite fallback connection established")
             
-            # Seed with sample data if needed
-            self._seed_sample_data()
+            # Create tables and seed only if the stored schema version is behind
+            self._ensure_schema()
+            
+            if self.primary_engine is not None:
+                self._start_outbox_worker()
             
         except Exception as e:
             logger.error(f"❌ Even SQLite fallback failed: {e}")
             self.connected = False
     
+    def _start_outbox_worker(self):
+        """Start the background thread that replays the fallback outbox"""
+        thread = threading.Thread(target=self._outbox_worker, name='fallback-outbox', daemon=True)
+        thread.start()
+    
+    def _outbox_worker(self):
+        """Wait for the primary while on the fallback, or drain leftovers once"""
+        config = self._get_fallback_config()
+        if not self.fallback_active:
+            try:
+                self.replay_outbox()
+            except Exception as e:
+                logger.warning(f"⚠️ Could not replay leftover fallback writes: {e}")
+            return
+        
+        while self.fallback_active:
+            time.sleep(config['recheck_seconds'])
+            self.try_switch_to_primary()
+    
+    def replay_outbox(self) -> Dict:
+        """Replay pending fallback writes onto the primary"""
+        from fallback_outbox import OutboxReplayer
+        
+        primary = self.primary_engine if self.fallback_active else self.engine
+        if self.fallback_engine is None:
+            self.fallback_engine = create_engine(f"sqlite:///{self._get_fallback_config()['path']}", echo=False, **JSON_CODEC)
+        if not inspect(self.fallback_engine).has_table('fallback_outbox'):
+            return {'batches': 0, 'replayed': 0, 'conflicts': 0}
+        
+        replayer = OutboxReplayer(self.fallback_engine, primary, self._get_fallback_config()['replay_batch_size'])
+        summary = dict(replayer.replay(), finished_at=datetime.utcnow().isoformat())
+        if summary['batches'] or self.last_replay is None:
+            self.last_replay = summary
+        return summary
+    
+    def try_switch_to_primary(self) -> bool:
+        """Move back to MySQL if it is reachable again, replaying the outbox first"""
+        if not self.fallback_active:
+            return True
+        try:
+            with self.primary_engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        except Exception:
+            return False
+        
+        logger.info("🔄 Primary MySQL is reachable again, replaying fallback writes")
+        try:
+            SQLAlchemyMigrator(self.primary_engine).migrate()
+            # Most of the backlog replays while requests keep writing to the fallback ...
+            self.replay_outbox()
+            # ... then writes pause briefly while the tail is replayed and the engine swapped
+            with self._switch_lock:
+                self.replay_outbox()
+                self.engine = self.primary_engine
+                self.SessionLocal = sessionmaker(bind=self.engine)
+                self.schema_version = latest_version()
+                self.fallback_active = False
+            self._initialize_replicas()
+            logger.info("✅ Switched back to the MySQL primary")
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ Switch back to the primary failed, staying on SQLite fallback: {e}")
+            return False
+    
+    def _initialize_replicas(self):
+        """Create engines for the configured read replicas (MySQL primary only)"""
+        for entry in self._get_replica_config()['hosts']:
+            host, _, port = entry.partition(':')
+            port = int(port) if port else self._get_database_config()['port']
+            engine = create_engine(
+                self._build_connection_string(host, port),
+                poolclass=QueuePool,
+                echo=False,
+                **JSON_CODEC,
+                **self._get_pool_config()
+            )
+            self.replicas.append({
+                'host': host,
+                'port': port,
+                'engine': engine,
+                'SessionLocal': sessionmaker(bind=engine),
+                'down_until': 0.0,
+                'last_error': None
+            })
+        if self.replicas:
+            event.listen(self.engine, 'after_cursor_execute', _track_written_rows)
+            logger.info(f"✅ Read replicas configured: {', '.join(r['host'] for r in self.replicas)}")
+    
+    def _open_read_session(self) -> Session:
+        """Open a session on a healthy replica, failing over to the primary.
+
+        Only client requests read from replicas, and only once the client's
+        last write is older than read_your_writes_seconds; background work
+        (jobs, maintenance, startup) always reads the primary.
+        """
+        config = self._get_replica_config()
+        last_write_at = client_last_write_at()
+        if (not self.replicas or last_write_at is None
+                or time.time() - last_write_at < config['read_your_writes_seconds']):
+            return self.SessionLocal()
+        
+        now = time.time()
+        with self._replica_lock:
+            start = self._replica_cursor
+            self._replica_cursor = (self._replica_cursor + 1) % len(self.replicas)
+        
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if replica['down_until'] > now:
+                continue
+            session = replica['SessionLocal']()
+            try:
+                # Check out a connection now (pre-ping included) so failures surface here
+                session.connection()
+                return session
+            except SQLAlchemyError as e:
+                session.close()
+                replica['down_until'] = now + config['retry_seconds']
+                replica['last_error'] = str(e)
+                logger.warning(f"⚠️ Read replica {replica['host']} unavailable, skipping for {config['retry_seconds']}s: {e}")
+        
+        return self.SessionLocal()
+    
     @contextmanager
-    def get_session(self) -> Session:
-        """Get database session with proper error handling"""
+    def get_session(self, read_only: bool = False) -> Session:
+        """Get database session with proper error handling.
+
+        Read-only sessions are routed to a read replica when one is configured
+        and healthy; everything else uses the primary. On the SQLite fallback,
+        write methods also queue their changes in the outbox for replay.
+        """
         if not self.connected:
             raise Exception("Database not connected")
         
-        session = self.SessionLocal()
+        # Fallback writes hold the switch lock so none land after the final outbox replay
+        lock = self._switch_lock if self.fallback_active and not read_only else None
+        if lock:
+            lock.acquire()
+        
+        session = self._open_read_session() if read_only else self.SessionLocal()
         try:
             yield session
             session.commit()
+            if not read_only:
+                finish_client_transaction(committed=True)
         except Exception as e:
             session.rollback()
+            if not read_only:
+                finish_client_transaction(committed=False)
             logger.error(f"Database transaction error: {e}")
             raise
         finally:
             session.close()
+            if lock:
+                lock.release()
     
     def _seed_sample_data(self):
         """Seed database with sample medical data if empty"""
         try:
             with self.get_session() as session:
                 # Check if data exists
-                if session.query(Item).count() > 0:
+                if session.execute(select(func.count()).select_from(Item)).scalar() > 0:
                     return
                 
                 # Sample data for different categories
@@ -252,11 +774,9 @@ class MySQLHospitalDB:
                     {'category': 'O2, ISO', 'name': 'ISO Service', 'type': 'Isoflurane Therapy', 'strength': 'Per minute', 'price': 30, 'description': 'Isoflurane therapy per minute'},
                 ]
                 
-                for item_data in sample_items:
-                    item = Item(**item_data)
-                    session.add(item)
-                
-                session.commit()
+                session.execute(insert(Item), sample_items)
+                # Logged like any other insert, so the seeded catalog has a version clients can sync from
+                self._record_new_item_changes(session, 0)
                 logger.info(f"✅ Seeded database with {len(sample_items)} sample items")
                 
         except Exception as e:
@@ -265,9 +785,11 @@ class MySQLHospitalDB:
     def get_all_items(self) -> List[Dict]:
         """Get all items from database"""
         try:
-            with self.get_session() as session:
-                items = session.query(Item).order_by(Item.category, Item.name).all()
-                return [item.to_dict() for item in items]
+            with self.get_session(read_only=True) as session:
+                rows = session.execute(
+                    select(*ITEM_COLUMNS).order_by(Item.category, Item.name)
+                ).all()
+                return [item_row_to_dict(row) for row in rows]
         except Exception as e:
             logger.error(f"Error getting all items: {e}")
             raise
@@ -275,9 +797,11 @@ class MySQLHospitalDB:
     def get_items_by_category(self, category: str) -> List[Dict]:
         """Get items by category"""
         try:
-            with self.get_session() as session:
-                items = session.query(Item).filter(Item.category == category).order_by(Item.name).all()
-                return [item.to_dict() for item in items]
+            with self.get_session(read_only=True) as session:
+                rows = session.execute(
+                    select(*ITEM_COLUMNS).where(Item.category == category).order_by(Item.name)
+                ).all()
+                return [item_row_to_dict(row) for row in rows]
         except Exception as e:
             logger.error(f"Error getting items by category: {e}")
             raise
@@ -286,37 +810,94 @@ class MySQLHospitalDB:
         """Add new item to database"""
         try:
             with self.get_session() as session:
-                item = Item(
-                    category=item_data['category'],
-                    name=item_data['name'],
-                    type=item_data.get('type', ''),
-                    strength=item_data.get('strength', ''),
-                    price=item_data['price'],
-                    description=item_data.get('description', '')
-                )
-                session.add(item)
-                session.flush()  # Get the ID
-                return item.id
+                values = _item_values(item_data)
+                result = session.execute(insert(Item).values(**values))
+                item_id = result.inserted_primary_key[0]
+                self._record_item_changes(session, [item_id], 'upsert')
+                self._record_outbox(session, [('add_item', item_id, values)])
+                return item_id
         except Exception as e:
             logger.error(f"Error adding item: {e}")
             raise
     
+    def bulk_add_items(self, items: List[Dict]) -> int:
+        """Insert many items with executemany batches in one transaction"""
+        try:
+            with self.get_session() as session:
+                max_id = session.execute(select(func.coalesce(func.max(Item.id), 0))).scalar()
+                rows = [_item_values(item) for item in items]
+                for chunk in _chunks(rows):
+                    session.execute(insert(Item), chunk)
+                self._record_new_item_changes(session, max_id)
+                if self.fallback_active:
+                    new_ids = self._new_item_ids(session, max_id)
+                    self._record_outbox(session, [('add_item', item_id, row) for item_id, row in zip(new_ids, rows)])
+                return len(items)
+        except Exception as e:
+            logger.error(f"Error bulk adding items: {e}")
+            raise
+    
+    def bulk_upsert_items(self, items: List[Dict]) -> int:
+        """Insert items, updating in place those whose 'id' already exists"""
+        try:
+            now = datetime.utcnow()
+            rows = []
+            for item in items:
+                values = _item_values(item)
+                values['updated_at'] = now
+                if item.get('id') is not None:
+                    values['id'] = item['id']
+                rows.append(values)
+            
+            keyed = [row for row in rows if 'id' in row]
+            unkeyed = [row for row in rows if 'id' not in row]
+            update_columns = ['category', 'name', 'type', 'strength', 'price', 'description', 'updated_at']
+            
+            with self.get_session() as session:
+                max_id = session.execute(select(func.coalesce(func.max(Item.id), 0))).scalar()
+                dialect = self.engine.dialect.name
+                if keyed:
+                    if dialect == 'mysql':
+                        from sqlalchemy.dialects.mysql import insert as dialect_insert
+                        stmt = dialect_insert(Item)
+                        stmt = stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in update_columns})
+                    else:
+                        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+                        stmt = dialect_insert(Item)
+                        stmt = stmt.on_conflict_do_update(
+                            index_elements=['id'], set_={c: stmt.excluded[c] for c in update_columns})
+                    for chunk in _chunks(keyed):
+                        session.execute(stmt, chunk)
+                
+                for chunk in _chunks(unkeyed):
+                    session.execute(insert(Item), chunk)
+                
+                self._record_item_changes(session, [row['id'] for row in keyed if row['id'] <= max_id], 'upsert')
+                self._record_new_item_changes(session, max_id)
+                if self.fallback_active:
+                    new_items = [item for item in items if item.get('id') is None]
+                    new_ids = self._new_item_ids(session, max_id)
+                    self._record_outbox(session, [
+                        ('upsert_item', item['id'], _item_values(item)) for item in items if item.get('id') is not None
+                    ] + [('add_item', item_id, _item_values(item)) for item_id, item in zip(new_ids, new_items)])
+                return len(rows)
+        except Exception as e:
+            logger.error(f"Error bulk upserting items: {e}")
+            raise
+    
     def update_item(self, item_id: int, item_data: Dict) -> bool:
         """Update existing item"""
         try:
             with self.get_session() as session:
-                item = session.query(Item).filter(Item.id == item_id).first()
-                if not item:
+                values = _item_values(item_data)
+                result = session.execute(
+                    update(Item).where(Item.id == item_id)
+                    .values(**values, updated_at=datetime.utcnow())
+                )
+                if result.rowcount == 0:
                     return False
-                
-                item.category = item_data['category']
-                item.name = item_data['name']
-                item.type = item_data.get('type', '')
-                item.strength = item_data.get('strength', '')
-                item.price = item_data['price']
-                item.description = item_data.get('description', '')
-                item.updated_at = datetime.utcnow()
-                
+                self._record_item_changes(session, [item_id], 'upsert')
+                self._record_outbox(session, [('update_item', item_id, values)])
                 return True
         except Exception as e:
             logger.error(f"Error updating item: {e}")
@@ -326,48 +907,528 @@ class MySQLHospitalDB:
         """Delete item from database"""
         try:
             with self.get_session() as session:
-                item = session.query(Item).filter(Item.id == item_id).first()
-                if not item:
+                result = session.execute(delete(Item).where(Item.id == item_id))
+                if result.rowcount == 0:
                     return False
-                
-                session.delete(item)
+                self._record_item_changes(session, [item_id], 'delete')
+                self._record_outbox(session, [('delete_item', item_id, {})])
                 return True
         except Exception as e:
             logger.error(f"Error deleting item: {e}")
             raise
     
+    def _record_item_changes(self, session: Session, item_ids: List[int], operation: str):
+        """Append change-log rows in the caller's transaction"""
+        if item_ids:
+            session.execute(insert(ItemChange), [
+                {'item_id': item_id, 'operation': operation} for item_id in item_ids
+            ])
+            self._trim_item_changes(session)
+    
+    def _record_new_item_changes(self, session: Session, max_id: int):
+        """Log every item inserted above max_id in the caller's transaction.
+
+        On MySQL this can also pick up rows committed concurrently by other
+        writers; logging an extra upsert only makes clients refetch it.
+        """
+        session.execute(
+            insert(ItemChange).from_select(
+                ['item_id', 'operation', 'changed_at'],
+                select(Item.id, literal('upsert'), literal(datetime.utcnow()))
+                .where(Item.id > max_id).order_by(Item.id)
+            )
+        )
+        self._trim_item_changes(session)
+    
+    def _trim_item_changes(self, session: Session):
+        """Drop change-log entries older than the retention horizon; clients behind it get a full resync"""
+        if self.item_changes_retention <= 0:
+            return
+        # Two statements: MySQL cannot delete from a table it also reads in a subquery
+        version = session.execute(select(func.max(ItemChange.version))).scalar() or 0
+        if version > self.item_changes_retention:
+            session.execute(delete(ItemChange).where(ItemChange.version <= version - self.item_changes_retention))
+    
+    def _new_item_ids(self, session: Session, max_id: int) -> List[int]:
+        """Ids of the items inserted above max_id, in insert order"""
+        return session.execute(select(Item.id).where(Item.id > max_id).order_by(Item.id)).scalars().all()
+    
+    def _record_outbox(self, session: Session, entries: List[tuple]):
+        """Queue (operation, local_id, values) writes for replay when on the fallback"""
+        if not self.fallback_active or not entries:
+            return
+        for chunk in _chunks(entries):
+            session.execute(insert(OutboxEntry), [{
+                'entry_key': str(uuid.uuid4()),
+                'operation': operation,
+                'local_id': local_id,
+                'payload': values,
+                'status': 'pending'
+            } for operation, local_id, values in chunk])
+    
+    def get_outbox_status(self) -> Optional[Dict]:
+        """Fallback outbox counts, recent conflicts and the last replay"""
+        from fallback_outbox import get_outbox_status
+        
+        status = {'fallback_active': self.fallback_active, 'last_replay': self.last_replay}
+        if self.fallback_engine is not None and inspect(self.fallback_engine).has_table('fallback_outbox'):
+            status.update(get_outbox_status(self.fallback_engine))
+        return status
+    
+    def get_catalog_version(self) -> int:
+        """Latest item change-log version (0 if nothing changed yet)"""
+        try:
+            with self.get_session(read_only=True) as session:
+                return session.execute(select(func.coalesce(func.max(ItemChange.version), 0))).scalar()
+        except Exception as e:
+            logger.error(f"Error getting catalog version: {e}")
+            raise
+    
+    def get_item_changes(self, since: int) -> Dict:
+        """Items upserted and ids deleted after catalog version `since`"""
+        try:
+            with self.get_session(read_only=True) as session:
+                min_version, version = session.execute(
+                    select(func.coalesce(func.min(ItemChange.version), 0),
+                           func.coalesce(func.max(ItemChange.version), 0))
+                ).one()
+                
+                # Unknown or pruned history: the client has to replace its copy
+                if since <= 0 or since > version or since < min_version - 1:
+                    rows = session.execute(select(*ITEM_COLUMNS).order_by(Item.category, Item.name)).all()
+                    return {'version': version, 'full_resync': True,
+                            'items': [item_row_to_dict(row) for row in rows], 'deleted': []}
+                
+                # Keep only the last operation per item
+                changes = session.execute(
+                    select(ItemChange.item_id, ItemChange.operation)
+                    .where(ItemChange.version > since).order_by(ItemChange.version)
+                ).all()
+                last_operation = {item_id: operation for item_id, operation in changes}
+                upserted = [item_id for item_id, op in last_operation.items() if op == 'upsert']
+                deleted = [item_id for item_id, op in last_operation.items() if op == 'delete']
+                
+                items = []
+                for chunk in _chunks(upserted, 500):
+                    rows = session.execute(select(*ITEM_COLUMNS).where(Item.id.in_(chunk))).all()
+                    items.extend(item_row_to_dict(row) for row in rows)
+                
+                return {'version': version, 'full_resync': False, 'items': items, 'deleted': deleted}
+        except Exception as e:
+            logger.error(f"Error getting item changes: {e}")
+            raise
+    
     def save_bill(self, bill_data: Dict) -> int:
         """Save bill to database"""
         try:
             with self.get_session() as session:
-                bill = Bill(
-                    bill_number=bill_data['bill_number'],
-                    patient_name=bill_data.get('patient_name', ''),
-                    opd_number=bill_data.get('opd_number', ''),
-                    total_amount=bill_data['total_amount'],
-                    items_json=bill_data['items']
-                )
-                session.add(bill)
-                session.flush()
-                return bill.id
+                values = _bill_values(bill_data)
+                result = session.execute(insert(Bill).values(**_with_patient_ids(session, [values])[0]))
+                bill_id = result.inserted_primary_key[0]
+                # Patient ids are local to each database; the replay resolves them on the primary
+                self._record_outbox(session, [('save_bill', bill_id, values)])
+                return bill_id
+        except IntegrityError as e:
+            if is_bill_number_conflict(e.orig):
+                raise DuplicateBillNumberError(f"Bill number '{bill_data['bill_number']}' is already used") from e
+            logger.error(f"Error saving bill: {e}")
+            raise
         except Exception as e:
             logger.error(f"Error saving bill: {e}")
             raise
     
-    def get_bills(self, limit: int = 50) -> List[Dict]:
-        """Get recent bills"""
+    def bulk_save_bills(self, bills: List[Dict]) -> int:
+        """Insert many bills with executemany batches in one transaction"""
+        try:
+            with self.get_session() as session:
+                rows = [_bill_values(bill) for bill in bills]
+                for chunk in _chunks(_with_patient_ids(session, rows)):
+                    session.execute(insert(Bill), chunk)
+                self._record_outbox(session, [('save_bill', None, row) for row in rows])
+                return len(bills)
+        except IntegrityError as e:
+            if is_bill_number_conflict(e.orig):
+                raise DuplicateBillNumberError('A bill number in this batch is already used') from e
+            logger.error(f"Error bulk saving bills: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Error bulk saving bills: {e}")
+            raise
+    
+    def reserve_bill_numbers(self, department: str, count: int) -> int:
+        """Reserve a block of sequence values for a department in one transaction"""
         try:
             with self.get_session() as session:
-                bills = session.query(Bill).order_by(Bill.created_at.desc()).limit(limit).all()
-                return [bill.to_dict() for bill in bills]
+                # Update first so the row lock (MySQL) or write lock (SQLite) is taken up front
+                advance = (update(BillSequence).where(BillSequence.department == department)
+                           .values(next_value=BillSequence.next_value + count, updated_at=datetime.utcnow()))
+                if session.execute(advance).rowcount == 0:
+                    try:
+                        with session.begin_nested():
+                            session.execute(insert(BillSequence).values(department=department, next_value=1 + count))
+                        return 1
+                    except IntegrityError:
+                        # Another worker created the row first
+                        session.execute(advance)
+                next_value = session.execute(
+                    select(BillSequence.next_value).where(BillSequence.department == department)
+                ).scalar()
+                return next_value - count
+        except Exception as e:
+            logger.error(f"Error reserving bill numbers: {e}")
+            raise
+    
+    def get_bills(self, limit: int = 50) -> List[Dict]:
+        """Get recent bills, reading archives only when the hot table has fewer than limit"""
+        try:
+            with self.get_session(read_only=True) as session:
+                rows = session.execute(
+                    select(*BILL_COLUMNS).order_by(Bill.created_at.desc()).limit(limit)
+                ).all()
+                bills = [bill_row_to_dict(row) for row in rows]
+                
+                if len(bills) < limit:
+                    for archive in reversed(self._list_archives(session)):
+                        table = archive_table(archive['location'])
+                        rows = session.execute(
+                            select(*archive_bill_columns(table))
+                            .order_by(table.c.created_at.desc()).limit(limit - len(bills))
+                        ).all()
+                        bills.extend(bill_row_to_dict(row) for row in rows)
+                        if len(bills) >= limit:
+                            break
+                return bills
         except Exception as e:
             logger.error(f"Error getting bills: {e}")
             raise
     
+    def get_bill(self, bill_id: int) -> Optional[Dict]:
+        """Get one bill by id, from the hot table or the archive whose id range covers it"""
+        try:
+            with self.get_session(read_only=True) as session:
+                row = session.execute(select(*BILL_COLUMNS).where(Bill.id == bill_id)).first()
+                if row is not None:
+                    return bill_row_to_dict(row)
+                
+                locations = session.execute(
+                    select(BillArchive.location)
+                    .where(BillArchive.first_id <= bill_id, BillArchive.last_id >= bill_id)
+                ).scalars().all()
+                for location in locations:
+                    table = archive_table(location)
+                    row = session.execute(select(*archive_bill_columns(table)).where(table.c.id == bill_id)).first()
+                    if row is not None:
+                        return bill_row_to_dict(row)
+                return None
+        except Exception as e:
+            logger.error(f"Error getting bill: {e}")
+            raise
+    
+    def get_patient(self, opd_number: str) -> Optional[Dict]:
+        """Get a patient by exact OPD number"""
+        try:
+            with self.get_session(read_only=True) as session:
+                row = session.execute(
+                    select(*PATIENT_COLUMNS).where(Patient.opd_number == normalize_opd_number(opd_number))
+                ).first()
+                return patient_row_to_dict(row) if row else None
+        except Exception as e:
+            logger.error(f"Error getting patient: {e}")
+            raise
+    
+    def find_patients(self, prefix: str, limit: int = 20) -> List[Dict]:
+        """Patients whose OPD number starts with prefix, as an index range scan"""
+        try:
+            prefix = normalize_opd_number(prefix)
+            query = select(*PATIENT_COLUMNS)
+            if prefix:
+                upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+                query = query.where(Patient.opd_number >= prefix, Patient.opd_number < upper)
+            with self.get_session(read_only=True) as session:
+                rows = session.execute(query.order_by(Patient.opd_number).limit(limit)).all()
+                return [patient_row_to_dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Error finding patients: {e}")
+            raise
+    
+    def get_patient_bills(self, patient_id: int, limit: int = 50) -> List[Dict]:
+        """A patient's most recent bills through the (patient_id, created_at) index, newest partition first"""
+        try:
+            with self.get_session(read_only=True) as session:
+                rows = session.execute(
+                    select(*BILL_COLUMNS).where(Bill.patient_id == patient_id)
+                    .order_by(Bill.created_at.desc()).limit(limit)
+                ).all()
+                bills = [bill_row_to_dict(row) for row in rows]
+                
+                if len(bills) < limit:
+                    for archive in reversed(self._list_archives(session)):
+                        table = archive_table(archive['location'])
+                        rows = session.execute(
+                            select(*archive_bill_columns(table)).where(table.c.patient_id == patient_id)
+                            .order_by(table.c.created_at.desc()).limit(limit - len(bills))
+                        ).all()
+                        bills.extend(bill_row_to_dict(row) for row in rows)
+                        if len(bills) >= limit:
+                            break
+                return bills
+        except Exception as e:
+            logger.error(f"Error getting patient bills: {e}")
+            raise
+    
+    def iter_bills(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                   batch_size: int = 1000) -> Iterator[Dict]:
+        """Stream bills oldest first through server-side cursors: touched archives, then the hot table"""
+        try:
+            with self.get_session(read_only=True) as session:
+                tables = [archive_table(archive['location'])
+                          for archive in archives_in_range(self._list_archives(session), since, until)]
+                for table in tables + [Bill.__table__]:
+                    query = select(*archive_bill_columns(table))
+                    if since:
+                        query = query.where(table.c.created_at >= since)
+                    if until:
+                        query = query.where(table.c.created_at < until)
+                    result = session.execute(query.order_by(table.c.id).execution_options(yield_per=batch_size))
+                    for rows in result.partitions():
+                        for row in rows:
+                            yield bill_row_to_dict(row)
+        except Exception as e:
+            logger.error(f"Error streaming bills: {e}")
+            raise
+    
+    def _list_archives(self, session: Session) -> List[Dict]:
+        rows = session.execute(select(*ARCHIVE_CATALOG_COLUMNS).order_by(BillArchive.month)).all()
+        return [archive_row_to_dict(row) for row in rows]
+    
+    def list_bill_archives(self) -> List[Dict]:
+        """Archived months, oldest first"""
+        try:
+            with self.get_session(read_only=True) as session:
+                return self._list_archives(session)
+        except Exception as e:
+            logger.error(f"Error listing bill archives: {e}")
+            raise
+    
+    def archive_bills(self, before: datetime, progress: Optional[Callable[[int, int], None]] = None) -> List[Dict]:
+        """Move bills created before `before` into one archive table per month"""
+        if self.fallback_active:
+            raise RuntimeError('Bills cannot be archived while running on the SQLite fallback')
+        try:
+            # Only months that hold bills: each step is one index seek to the next bill after the last month
+            months = []
+            with self.get_session() as session:
+                after = None
+                while True:
+                    query = select(func.min(Bill.created_at)).where(Bill.created_at < before)
+                    if after is not None:
+                        query = query.where(Bill.created_at >= after)
+                    oldest = session.execute(query).scalar()
+                    if oldest is None:
+                        break
+                    months.append(month_start(oldest))
+                    after = next_month(months[-1])
+            
+            archived = []
+            for index, start in enumerate(months):
+                end = min(next_month(start), before)
+                name = f"bills_archive_{month_key(start).replace('-', '_')}"
+                table = archive_table(name)
+                # DDL outside the copy transaction: MySQL commits it implicitly
+                table.create(self.engine, checkfirst=True)
+                
+                with self.get_session() as session:
+                    bounds = (Bill.created_at >= start, Bill.created_at < end)
+                    last_id = session.execute(select(func.max(Bill.id)).where(*bounds)).scalar()
+                    if last_id is not None:
+                        columns = [column.name for column in table.columns]
+                        session.execute(insert(table).from_select(
+                            columns, select(*[Bill.__table__.c[column] for column in columns])
+                            .where(*bounds, Bill.id <= last_id)))
+                        moved = session.execute(delete(Bill).where(*bounds, Bill.id <= last_id)).rowcount
+                        
+                        count, total, first_id, max_id = session.execute(
+                            select(func.count(), func.coalesce(func.sum(table.c.total_amount), 0),
+                                   func.min(table.c.id), func.max(table.c.id))
+                        ).one()
+                        session.execute(delete(BillArchive).where(BillArchive.month == month_key(start)))
+                        session.execute(insert(BillArchive).values(
+                            month=month_key(start), location=name, first_id=first_id, last_id=max_id,
+                            bill_count=count, total_amount=total, archived_at=datetime.utcnow()))
+                        
+                        logger.info(f"🗄️ Archived {moved} bills from {month_key(start)} to {name}")
+                        archived.append({'month': month_key(start), 'moved': moved, 'location': name,
+                                         'bill_count': count, 'total_amount': total,
+                                         'first_id': first_id, 'last_id': max_id})
+                if progress:
+                    progress(index + 1, len(months))
+            return archived
+        except Exception as e:
+            logger.error(f"Error archiving bills: {e}")
+            raise
+    
+    def claim_idempotency_key(self, key: str, request_hash: str, expires_at: float) -> Optional[Dict]:
+        """Claim a key, or return the live record holding it"""
+        try:
+            with self.get_session() as session:
+                try:
+                    with session.begin_nested():
+                        session.execute(insert(IdempotencyKey).values(
+                            idempotency_key=key, request_hash=request_hash, expires_at=expires_at))
+                    return None
+                except IntegrityError:
+                    pass
+                
+                # Key exists: take it over only if it has expired
+                takeover = session.execute(
+                    update(IdempotencyKey)
+                    .where(IdempotencyKey.idempotency_key == key, IdempotencyKey.expires_at <= time.time())
+                    .values(request_hash=request_hash, status_code=None, response_body=None, expires_at=expires_at)
+                )
+                if takeover.rowcount:
+                    return None
+                
+                row = session.execute(
+                    select(IdempotencyKey.request_hash, IdempotencyKey.status_code,
+                           IdempotencyKey.response_body, IdempotencyKey.expires_at)
+                    .where(IdempotencyKey.idempotency_key == key)
+                ).one()
+                return {'request_hash': row[0], 'status_code': row[1], 'response_body': row[2], 'expires_at': row[3]}
+        except Exception as e:
+            logger.error(f"Error claiming idempotency key: {e}")
+            raise
+    
+    def complete_idempotency_key(self, key: str, status_code: int, response_body: str, expires_at: float):
+        """Store the response for a claimed key"""
+        try:
+            with self.get_session() as session:
+                session.execute(
+                    update(IdempotencyKey).where(IdempotencyKey.idempotency_key == key)
+                    .values(status_code=status_code, response_body=response_body, expires_at=expires_at)
+                )
+        except Exception as e:
+            logger.error(f"Error completing idempotency key: {e}")
+            raise
+    
+    def release_idempotency_key(self, key: str):
+        """Drop an unfinished claim so the request can be retried"""
+        try:
+            with self.get_session() as session:
+                session.execute(
+                    delete(IdempotencyKey)
+                    .where(IdempotencyKey.idempotency_key == key, IdempotencyKey.status_code.is_(None))
+                )
+        except Exception as e:
+            logger.error(f"Error releasing idempotency key: {e}")
+            raise
+    
+    def purge_idempotency_keys(self, now: float) -> int:
+        """Delete expired idempotency keys"""
+        try:
+            with self.get_session() as session:
+                return session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < now)).rowcount
+        except Exception as e:
+            logger.error(f"Error purging idempotency keys: {e}")
+            raise
+    
+    def create_job(self, job: Dict):
+        """Insert a new background job row"""
+        try:
+            with self.get_session() as session:
+                session.execute(insert(Job).values(
+                    id=job['id'],
+                    job_type=job['job_type'],
+                    status=job['status'],
+                    params=job.get('params') or {},
+                    message=job.get('message'),
+                    worker=job.get('worker'),
+                    created_at=job['created_at']
+                ))
+        except Exception as e:
+            logger.error(f"Error creating job: {e}")
+            raise
+    
+    def update_job(self, job_id: str, fields: Dict) -> bool:
+        """Update the given job columns"""
+        try:
+            values = {column: value for column, value in fields.items() if column in JOB_COLUMNS and column != 'id'}
+            with self.get_session() as session:
+                return session.execute(update(Job).where(Job.id == job_id).values(**values)).rowcount > 0
+        except Exception as e:
+            logger.error(f"Error updating job: {e}")
+            raise
+    
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Get one job by id"""
+        try:
+            with self.get_session(read_only=True) as session:
+                row = session.execute(select(*JOB_TABLE_COLUMNS).where(Job.id == job_id)).first()
+                return job_row_to_dict(row) if row else None
+        except Exception as e:
+            logger.error(f"Error getting job: {e}")
+            raise
+    
+    def list_jobs(self, limit: int = 50, statuses: Optional[List[str]] = None) -> List[Dict]:
+        """Get recent jobs, newest first"""
+        try:
+            with self.get_session(read_only=True) as session:
+                query = select(*JOB_TABLE_COLUMNS)
+                if statuses:
+                    query = query.where(Job.status.in_(statuses))
+                rows = session.execute(query.order_by(Job.created_at.desc()).limit(limit)).all()
+                return [job_row_to_dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Error listing jobs: {e}")
+            raise
+    
+    def start_maintenance_run(self, run: Dict) -> Optional[int]:
+        """Insert a running maintenance run; None if its window_key is already taken"""
+        try:
+            with self.get_session() as session:
+                try:
+                    with session.begin_nested():
+                        result = session.execute(insert(MaintenanceRun).values(
+                            window_key=run.get('window_key'),
+                            source=run['source'],
+                            status=run['status'],
+                            tasks=run.get('tasks') or [],
+                            worker=run.get('worker'),
+                            started_at=run['started_at']
+                        ))
+                except IntegrityError:
+                    return None
+                return result.inserted_primary_key[0]
+        except Exception as e:
+            logger.error(f"Error starting maintenance run: {e}")
+            raise
+    
+    def finish_maintenance_run(self, run_id: int, fields: Dict):
+        """Store a maintenance run's status, results and timings"""
+        try:
+            values = {column: value for column, value in fields.items()
+                      if column in MAINTENANCE_RUN_COLUMNS and column != 'id'}
+            with self.get_session() as session:
+                session.execute(update(MaintenanceRun).where(MaintenanceRun.id == run_id).values(**values))
+        except Exception as e:
+            logger.error(f"Error finishing maintenance run: {e}")
+            raise
+    
+    def list_maintenance_runs(self, limit: int = 20) -> List[Dict]:
+        """Get recent maintenance runs, newest first"""
+        try:
+            with self.get_session(read_only=True) as session:
+                rows = session.execute(
+                    select(*MAINTENANCE_RUN_TABLE_COLUMNS).order_by(MaintenanceRun.started_at.desc()).limit(limit)
+                ).all()
+                return [dict(zip(MAINTENANCE_RUN_COLUMNS, row)) for row in rows]
+        except Exception as e:
+            logger.error(f"Error listing maintenance runs: {e}")
+            raise
+    
     def get_statistics(self) -> Dict:
         """Get database statistics"""
         try:
-            with self.get_session() as session:
+            with self.get_session(read_only=True) as session:
                 stats = {}
                 
                 # Total items by category
@@ -377,12 +1438,10 @@ class MySQLHospitalDB:
                 stats['items_by_category'] = {row[0]: row[1] for row in category_counts}
                 
                 # Total items
-                total_items = session.query(Item).count()
-                stats['total_items'] = total_items
+                stats['total_items'] = session.execute(select(func.count()).select_from(Item)).scalar()
                 
                 # Total bills
-                total_bills = session.query(Bill).count()
-                stats['total_bills'] = total_bills
+                stats['total_bills'] = session.execute(select(func.count()).select_from(Bill)).scalar()
                 
                 # Revenue statistics
                 revenue_result = session.execute(
@@ -390,22 +1449,65 @@ class MySQLHospitalDB:
                 ).fetchone()
                 stats['total_revenue'] = revenue_result[0] if revenue_result else 0
                 
+                # Archived months are counted from their catalog rows, not scanned
+                archived_bills, archived_revenue = session.execute(
+                    select(func.coalesce(func.sum(BillArchive.bill_count), 0),
+                           func.coalesce(func.sum(BillArchive.total_amount), 0))
+                ).one()
+                stats['archived_bills'] = int(archived_bills)
+                stats['total_bills'] += int(archived_bills)
+                stats['total_revenue'] += archived_revenue
+                
                 return stats
         except Exception as e:
             logger.error(f"Error getting statistics: {e}")
             raise
     
+    def _get_pool_info(self) -> Dict:
+        """Describe the engine's pool: configured tuning plus live usage"""
+        if not self.engine:
+            return None
+        
+        pool = self.engine.pool
+        info = {'pool_class': type(pool).__name__}
+        if self.engine.dialect.name == 'mysql':
+            info.update(self._get_pool_config())
+        if isinstance(pool, QueuePool):
+            info.update({
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': pool.overflow()
+            })
+        return info
+    
     def get_connection_info(self) -> Dict:
         """Get database connection information"""
         config = self._get_database_config()
+        is_mysql = self.engine is not None and self.engine.dialect.name == 'mysql'
         return {
             'connected': self.connected,
+            'database_type': 'MySQL' if is_mysql else 'SQLite (fallback)',
             'host': config['host'],
             'port': config['port'],
             'database': config['database'],
             'user': config['user'],
-            'engine_url': str(self.engine.url).replace(config['password'], '***') if self.engine else None
+            'engine_url': str(self.engine.url).replace(config['password'], '***') if self.engine else None,
+            'schema_version': self.schema_version,
+            'init_timings': self.init_timings,
+            'pool': self._get_pool_info(),
+            'replicas': [{
+                'host': replica['host'],
+                'port': replica['port'],
+                'healthy': replica['down_until'] <= time.time(),
+                'last_error': replica['last_error'],
+                'pool': {
+                    'checked_out': replica['engine'].pool.checkedout(),
+                    'checked_in': replica['engine'].pool.checkedin()
+                }
+            } for replica in self.replicas],
+            'read_your_writes_seconds': self._get_replica_config()['read_your_writes_seconds'],
+            'fallback_active': self.fallback_active
         }
 
-# Global database instance
-db = MySQLHospitalDB()
+# Global database instance, created lazily in each worker process
+db = LazyDatabase(MySQLHospitalDB, 'MySQL database')
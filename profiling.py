@@ -0,0 +1,500 @@
+
+import os
+import sys
+import hmac
+import time
+import uuid
+import pstats
+import sysconfig
+import cProfile
+import logging
+import threading
+import tracemalloc
+from collections import Counter, OrderedDict
+from datetime import datetime
+from functools import wraps
+from typing import Dict, List, Optional
+from flask import request, jsonify
+import fast_json
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
+# Bounds on what one admin request can ask for
+MAX_PROFILED_REQUESTS = 1000
+MAX_SAMPLE_SECONDS = 120
+MIN_SAMPLE_INTERVAL_MS = 1
+MAX_TOP = 200
+MAX_SNAPSHOTS = 5
+
+# Finished profiles kept in the profile directory
+KEEP_PROFILES = 50
+
+# A sampled thread whose innermost Python frame is in one of these files is waiting, not working
+IDLE_FILES = ('threading.py', 'selectors.py', 'queue.py', 'socketserver.py', 'socket.py')
+
+SORT_KEYS = ('cumulative', 'tottime')
+GROUP_BY = ('lineno', 'filename', 'traceback')
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+_STDLIB_DIR = sysconfig.get_paths()['stdlib']
+
+class ProfilingError(ValueError):
+    """Invalid profiling request, or one that conflicts with a profile already running"""
+
+def admin_required(view):
+    """Allow the view only with the ADMIN_TOKEN in the X-Admin-Token header (or a Bearer token).
+
+    Without ADMIN_TOKEN configured, admin endpoints are disabled entirely.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        expected = os.getenv('ADMIN_TOKEN', '')
+        if not expected:
+            return jsonify({
+                'success': False,
+                'error': 'Admin endpoints are disabled',
+                'message': 'Set ADMIN_TOKEN to enable admin endpoints'
+            }), 403
+        supplied = request.headers.get(ADMIN_TOKEN_HEADER, '')
+        authorization = request.headers.get('Authorization', '')
+        if not supplied and authorization.startswith('Bearer '):
+            supplied = authorization[len('Bearer '):]
+        if not hmac.compare_digest(supplied.encode(), expected.encode()):
+            logger.warning(f"🔒 Rejected admin request {request.method} {request.path} from {request.remote_addr}")
+            return jsonify({
+                'success': False,
+                'error': 'Unauthorized',
+                'message': f'A valid {ADMIN_TOKEN_HEADER} header is required'
+            }), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def get_profile_dir() -> str:
+    return os.getenv('PROFILE_DIR', 'profiles')
+
+def _bounded_int(params: Dict, name: str, default: int, low: int, high: int) -> int:
+    try:
+        value = int(params.get(name, default))
+    except (TypeError, ValueError):
+        raise ProfilingError(f'{name} must be an integer')
+    if not low <= value <= high:
+        raise ProfilingError(f'{name} must be between {low} and {high}')
+    return value
+
+def _short_path(filename: str) -> str:
+    """File path relative to the app, site-packages or the stdlib, for readable reports"""
+    if filename.startswith(_BASE_DIR + os.sep):
+        return filename[len(_BASE_DIR) + 1:]
+    marker = filename.rfind('site-packages' + os.sep)
+    if marker != -1:
+        return filename[marker + len('site-packages') + 1:]
+    if filename.startswith(_STDLIB_DIR + os.sep):
+        return filename[len(_STDLIB_DIR) + 1:]
+    return filename
+
+def _new_profile(kind: str, params: Dict) -> Dict:
+    now = datetime.now()
+    return {
+        'id': f"{kind}-{now:%Y%m%d-%H%M%S}-{os.getpid()}-{uuid.uuid4().hex[:6]}",
+        'kind': kind,
+        'status': 'running',
+        'pid': os.getpid(),
+        'params': params,
+        'started_at': now.isoformat(),
+        'finished_at': None
+    }
+
+def save_profile(profile: Dict) -> str:
+    """Write a finished profile to the profile directory and prune the oldest ones"""
+    directory = get_profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{profile['id']}.json")
+    partial_path = f'{path}.partial'
+    with open(partial_path, 'wb') as f:
+        f.write(fast_json.dumps_bytes(profile))
+    os.replace(partial_path, path)
+
+    files = sorted((name for name in os.listdir(directory) if name.endswith('.json')),
+                   key=lambda name: os.path.getmtime(os.path.join(directory, name)))
+    for name in files[:-KEEP_PROFILES]:
+        os.remove(os.path.join(directory, name))
+    return path
+
+def load_profile(profile_id: str) -> Optional[Dict]:
+    if os.sep in profile_id or profile_id.startswith('.'):
+        return None
+    try:
+        with open(os.path.join(get_profile_dir(), f'{profile_id}.json'), 'rb') as f:
+            return fast_json.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+def list_profiles(limit: int = KEEP_PROFILES) -> List[Dict]:
+    """Saved profiles from every worker, newest first, without their statistics"""
+    directory = get_profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    summaries = []
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        profile = load_profile(name[:-len('.json')])
+        if profile is not None:
+            summaries.append({key: value for key, value in profile.items()
+                              if key not in ('functions', 'stacks', 'requests')})
+    summaries.sort(key=lambda profile: profile['started_at'], reverse=True)
+    return summaries[:limit]
+
+# ---------------------------------------------------------------------------
+# Deterministic profiling of the next N requests
+# ---------------------------------------------------------------------------
+
+def _top_functions(stats: pstats.Stats, sort: str, top: int) -> List[Dict]:
+    rows = []
+    for (filename, line, function), (primitive, calls, own, cumulative, _) in stats.stats.items():
+        rows.append({
+            'function': function,
+            'file': _short_path(filename),
+            'line': line,
+            'calls': calls,
+            'primitive_calls': primitive,
+            'own_ms': round(own * 1000, 3),
+            'cumulative_ms': round(cumulative * 1000, 3),
+            'per_call_us': round(cumulative / calls * 1e6, 1) if calls else 0
+        })
+    key = 'cumulative_ms' if sort == 'cumulative' else 'own_ms'
+    rows.sort(key=lambda row: row[key], reverse=True)
+    return rows[:top]
+
+class RequestProfiler:
+    """cProfile over the next N matching requests of this worker, aggregated into one report.
+
+    One request is profiled at a time; requests that arrive while another
+    is being profiled run normally and are not counted.
+    """
+
+    def __init__(self):
+        self.profile = None
+        self._stats = None
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+
+    def arm(self, params: Dict) -> Dict:
+        count = _bounded_int(params, 'count', 10, 1, MAX_PROFILED_REQUESTS)
+        top = _bounded_int(params, 'top', 30, 1, MAX_TOP)
+        sort = str(params.get('sort', 'cumulative'))
+        if sort not in SORT_KEYS:
+            raise ProfilingError(f"sort must be one of {', '.join(SORT_KEYS)}")
+        path_prefix = str(params.get('path_prefix') or '/api/')
+        with self._lock:
+            if self.profile is not None:
+                raise ProfilingError(f"Profile {self.profile['id']} is already collecting requests in this worker")
+            self.profile = _new_profile('requests', {'count': count, 'top': top, 'sort': sort,
+                                                     'path_prefix': path_prefix})
+            self.profile['requests'] = []
+            self._stats = None
+            logger.info(f"🔬 Profiling the next {count} requests under {path_prefix} in process {os.getpid()}")
+            return dict(self.profile)
+
+    def start_request(self, path: str) -> Optional[cProfile.Profile]:
+        """A running profiler for this request, or None when it is not being profiled"""
+        profile = self.profile
+        if profile is None or path.startswith('/api/admin/') or not path.startswith(profile['params']['path_prefix']):
+            return None
+        if not self._active.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def finish_request(self, profiler: cProfile.Profile, method: str, path: str, status: Optional[int],
+                       elapsed_ms: float):
+        profiler.disable()
+        self._active.release()
+        with self._lock:
+            profile = self.profile
+            if profile is None:
+                return
+            if self._stats is None:
+                self._stats = pstats.Stats(profiler)
+            else:
+                self._stats.add(profiler)
+            profile['requests'].append({'method': method, 'path': path, 'status': status,
+                                        'ms': round(elapsed_ms, 2)})
+            if len(profile['requests']) < profile['params']['count']:
+                return
+            params = profile['params']
+            profile.update({
+                'status': 'finished',
+                'finished_at': datetime.now().isoformat(),
+                'total_ms': round(sum(entry['ms'] for entry in profile['requests']), 2),
+                'functions': _top_functions(self._stats, params['sort'], params['top'])
+            })
+            self.profile = None
+            self._stats = None
+        try:
+            save_profile(profile)
+            logger.info(f"🔬 Request profile {profile['id']} finished")
+        except OSError as e:
+            logger.error(f"❌ Failed to save request profile {profile['id']}: {e}")
+
+# ---------------------------------------------------------------------------
+# Statistical sampling of every thread in this worker
+# ---------------------------------------------------------------------------
+
+class StackSampler:
+    """Background thread that samples all thread stacks of this worker at a fixed interval.
+
+    Reading sys._current_frames() costs a few microseconds per thread, so
+    sampling every 10 ms adds only a few percent to the worker. Stacks are kept at
+    function granularity and reported as the hottest functions (own and
+    inclusive samples) plus folded stacks for flame graph tools.
+    """
+
+    def __init__(self):
+        self.profile = None
+        self._lock = threading.Lock()
+
+    def start(self, params: Dict) -> Dict:
+        seconds = _bounded_int(params, 'seconds', 10, 1, MAX_SAMPLE_SECONDS)
+        interval_ms = _bounded_int(params, 'interval_ms', 10, MIN_SAMPLE_INTERVAL_MS, 1000)
+        top = _bounded_int(params, 'top', 30, 1, MAX_TOP)
+        include_idle = bool(params.get('include_idle', False))
+        with self._lock:
+            if self.profile is not None:
+                raise ProfilingError(f"Sample {self.profile['id']} is already running in this worker")
+            self.profile = _new_profile('sample', {'seconds': seconds, 'interval_ms': interval_ms, 'top': top,
+                                                   'include_idle': include_idle})
+            profile = dict(self.profile)
+        threading.Thread(target=self._run, args=(self.profile,), name='stack-sampler', daemon=True).start()
+        logger.info(f"🔬 Sampling process {os.getpid()} for {seconds}s every {interval_ms} ms")
+        return profile
+
+    def _run(self, profile: Dict):
+        params = profile['params']
+        own_thread = threading.get_ident()
+        interval = params['interval_ms'] / 1000
+        stacks, own, inclusive, threads = Counter(), Counter(), Counter(), Counter()
+        ticks = samples = idle = 0
+        try:
+            deadline = time.monotonic() + params['seconds']
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_thread:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append((code.co_filename, code.co_name, code.co_firstlineno))
+                        frame = frame.f_back
+                    if not params['include_idle'] and os.path.basename(stack[0][0]) in IDLE_FILES:
+                        idle += 1
+                        continue
+                    stack.reverse()
+                    stacks[tuple(stack)] += 1
+                    own[stack[-1]] += 1
+                    for function in set(stack):
+                        inclusive[function] += 1
+                    threads[names.get(thread_id, str(thread_id))] += 1
+                    samples += 1
+                ticks += 1
+                time.sleep(interval)
+
+            top = params['top']
+
+            def label(function):
+                return f'{_short_path(function[0])}:{function[1]}'
+
+            profile.update({
+                'status': 'finished',
+                'ticks': ticks,
+                'samples': samples,
+                'idle_samples': idle,
+                'functions': [{
+                    'function': function[1],
+                    'file': _short_path(function[0]),
+                    'line': function[2],
+                    'inclusive_samples': count,
+                    'own_samples': own.get(function, 0),
+                    'inclusive_pct': round(count / samples * 100, 2) if samples else 0
+                } for function, count in inclusive.most_common(top)],
+                'stacks': [{'stack': ';'.join(label(function) for function in stack), 'samples': count}
+                           for stack, count in stacks.most_common(top)],
+                'threads': dict(threads.most_common())
+            })
+        except Exception as e:
+            logger.error(f"❌ Stack sampling failed: {e}")
+            profile.update({'status': 'failed', 'error': str(e)})
+        profile['finished_at'] = datetime.now().isoformat()
+        with self._lock:
+            self.profile = None
+        try:
+            save_profile(profile)
+            logger.info(f"🔬 Sample {profile['id']} finished: {samples} samples over {ticks} ticks")
+        except OSError as e:
+            logger.error(f"❌ Failed to save sample {profile['id']}: {e}")
+
+# ---------------------------------------------------------------------------
+# tracemalloc snapshots and diffs
+# ---------------------------------------------------------------------------
+
+def _snapshot_filters(patterns: List[str]) -> List[tracemalloc.Filter]:
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+               tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+               tracemalloc.Filter(False, '<unknown>')]
+    for pattern in patterns:
+        # Bare module names such as 'flask_database.py' match wherever the file lives
+        filters.append(tracemalloc.Filter(True, pattern if os.sep in pattern else f'*{os.sep}{pattern}'))
+    return filters
+
+def _stat_location(stat, group_by: str) -> str:
+    frames = stat.traceback
+    if group_by == 'traceback':
+        return ' <- '.join(f'{_short_path(frame.filename)}:{frame.lineno}' for frame in frames)
+    if group_by == 'filename':
+        return _short_path(frames[0].filename)
+    return f'{_short_path(frames[0].filename)}:{frames[0].lineno}'
+
+class MemoryProfiler:
+    """tracemalloc snapshots of this worker, kept in memory for diffs.
+
+    Tracing starts with the first snapshot (which is therefore the
+    baseline) and costs memory and CPU on every allocation until stopped.
+    """
+
+    def __init__(self):
+        self.snapshots = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _parse(self, params: Dict):
+        top = _bounded_int(params, 'top', 30, 1, MAX_TOP)
+        group_by = str(params.get('group_by', 'lineno'))
+        if group_by not in GROUP_BY:
+            raise ProfilingError(f"group_by must be one of {', '.join(GROUP_BY)}")
+        patterns = params.get('filter') or []
+        if isinstance(patterns, str):
+            patterns = [pattern.strip() for pattern in patterns.split(',') if pattern.strip()]
+        if not isinstance(patterns, list):
+            raise ProfilingError('filter must be a list of file name patterns')
+        return top, group_by, [str(pattern) for pattern in patterns]
+
+    def _take(self, frames: int) -> Dict:
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(frames)
+            logger.info(f"🧠 tracemalloc started with {frames} frames in process {os.getpid()}")
+        snapshot = tracemalloc.take_snapshot()
+        snapshot_id = f"mem-{datetime.now():%H%M%S}-{uuid.uuid4().hex[:6]}"
+        self.snapshots[snapshot_id] = {'taken_at': datetime.now().isoformat(), 'snapshot': snapshot}
+        while len(self.snapshots) > MAX_SNAPSHOTS:
+            self.snapshots.popitem(last=False)
+        return {'id': snapshot_id, 'tracing_started': started}
+
+    def snapshot(self, params: Dict) -> Dict:
+        """Take a snapshot and report where the traced memory is"""
+        top, group_by, patterns = self._parse(params)
+        frames = _bounded_int(params, 'frames', 10, 1, 100)
+        with self._lock:
+            taken = self._take(frames)
+            snapshot = self.snapshots[taken['id']]['snapshot'].filter_traces(_snapshot_filters(patterns))
+        stats = snapshot.statistics(group_by)
+        return dict(taken, **self._memory_info(), group_by=group_by, filter=patterns,
+                    total_kb=round(sum(stat.size for stat in stats) / 1024, 1),
+                    top=[{'location': _stat_location(stat, group_by), 'size_kb': round(stat.size / 1024, 1),
+                          'count': stat.count} for stat in stats[:top]])
+
+    def diff(self, params: Dict) -> Dict:
+        """Compare two snapshots ('to' defaults to a new one) by growth"""
+        top, group_by, patterns = self._parse(params)
+        with self._lock:
+            entry = self.snapshots.get(params.get('from'))
+            if entry is None:
+                raise ProfilingError(f"Unknown snapshot '{params.get('from')}' in process {os.getpid()}")
+            to_id = params.get('to')
+            if to_id is None:
+                if not tracemalloc.is_tracing():
+                    raise ProfilingError('tracemalloc is not running; take a snapshot first')
+                to_id = self._take(tracemalloc.get_traceback_limit())['id']
+            elif to_id not in self.snapshots:
+                raise ProfilingError(f"Unknown snapshot '{to_id}' in process {os.getpid()}")
+            filters = _snapshot_filters(patterns)
+            old = entry['snapshot'].filter_traces(filters)
+            new = self.snapshots[to_id]['snapshot'].filter_traces(filters)
+        stats = new.compare_to(old, group_by)
+        return dict(self._memory_info(), **{
+            'from': params.get('from'),
+            'to': to_id,
+            'group_by': group_by,
+            'filter': patterns,
+            'size_diff_kb': round(sum(stat.size_diff for stat in stats) / 1024, 1),
+            'top': [{'location': _stat_location(stat, group_by), 'size_kb': round(stat.size / 1024, 1),
+                     'size_diff_kb': round(stat.size_diff / 1024, 1), 'count': stat.count,
+                     'count_diff': stat.count_diff} for stat in stats[:top]]
+        })
+
+    def stop(self) -> Dict:
+        with self._lock:
+            was_tracing = tracemalloc.is_tracing()
+            tracemalloc.stop()
+            self.snapshots.clear()
+        if was_tracing:
+            logger.info(f"🧠 tracemalloc stopped in process {os.getpid()}")
+        return {'was_tracing': was_tracing}
+
+    def _memory_info(self) -> Dict:
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            'pid': os.getpid(),
+            'tracing': tracemalloc.is_tracing(),
+            'traced_kb': round(current / 1024, 1),
+            'peak_kb': round(peak / 1024, 1),
+            'overhead_kb': round(tracemalloc.get_tracemalloc_memory() / 1024, 1)
+        }
+
+    def get_info(self) -> Dict:
+        return dict(self._memory_info(), snapshots=[
+            {'id': snapshot_id, 'taken_at': entry['taken_at']} for snapshot_id, entry in self.snapshots.items()])
+
+class Profilers:
+    """This worker's request profiler, stack sampler and memory profiler"""
+
+    def __init__(self):
+        self.requests = RequestProfiler()
+        self.sampler = StackSampler()
+        self.memory = MemoryProfiler()
+
+    def get_info(self) -> Dict:
+        return {
+            'pid': os.getpid(),
+            'profiling_requests': self.requests.profile['id'] if self.requests.profile else None,
+            'sampling': self.sampler.profile['id'] if self.sampler.profile else None,
+            'memory': self.memory.get_info(),
+            'profile_dir': get_profile_dir()
+        }
+
+    def running(self, profile_id: str) -> Optional[Dict]:
+        """The in-progress profile with this id, if it runs in this worker"""
+        for profile in (self.requests.profile, self.sampler.profile):
+            if profile is not None and profile['id'] == profile_id:
+                return {key: value for key, value in profile.items() if key != 'requests'}
+        return None
+
+_profilers = None
+_profilers_pid = None
+_profilers_lock = threading.Lock()
+
+def get_profilers() -> Profilers:
+    """Return this worker's profilers, creating them after fork if needed"""
+    global _profilers, _profilers_pid
+    pid = os.getpid()
+    if _profilers is None or _profilers_pid != pid:
+        with _profilers_lock:
+            if _profilers is None or _profilers_pid != pid:
+                _profilers = Profilers()
+                _profilers_pid = pid
+    return _profilers
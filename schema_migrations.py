@@ -0,0 +1,650 @@
+
+import time
+import sqlite3
+import logging
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Callable
+from sqlalchemy import text, inspect, Index
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class MigrationConnection:
+    """Small wrapper giving migrations one API over sqlite3 and SQLAlchemy.
+
+    SQL is written with named parameters (``:name``), which both sqlite3 and
+    SQLAlchemy ``text()`` understand. ``raw`` is the underlying connection for
+    steps that need backend-specific calls (e.g. ``metadata.create_all``).
+    """
+
+    def __init__(self, raw, dialect: str, backend: str):
+        self.raw = raw
+        self.dialect = dialect
+        self.backend = backend
+
+    def execute(self, sql: str, params: Optional[Dict] = None) -> List:
+        """Execute a statement and return its rows (empty for DDL/DML)"""
+        params = params or {}
+        if self.backend == 'sqlite':
+            return self.raw.execute(sql, params).fetchall()
+        result = self.raw.execute(text(sql), params)
+        return result.fetchall() if result.returns_rows else []
+
+    def has_table(self, table: str) -> bool:
+        if self.backend == 'sqlite':
+            return bool(self.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name", {'name': table}))
+        return inspect(self.raw).has_table(table)
+
+    def has_column(self, table: str, column: str) -> bool:
+        if self.backend == 'sqlite':
+            return any(row[1] == column for row in self.execute(f'PRAGMA table_info({table})'))
+        return any(col['name'] == column for col in inspect(self.raw).get_columns(table))
+
+    def has_index(self, table: str, index: str) -> bool:
+        if self.backend == 'sqlite':
+            return bool(self.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name", {'name': index}))
+        return any(idx['name'] == index for idx in inspect(self.raw).get_indexes(table))
+
+    def create_index(self, name: str, *columns):
+        """Create an index on model columns unless it exists, without leaving it on the shared model table"""
+        index = Index(name, *columns)
+        # Index() registers itself on the Table; a later create_all in this process would build it twice
+        index.table.indexes.discard(index)
+        if not self.has_index(index.table.name, name):
+            index.create(self.raw)
+
+class Migration:
+    """One ordered schema change with a step per backend"""
+
+    def __init__(self, version: int, description: str,
+                 sqlite: Callable[[MigrationConnection], None],
+                 sqlalchemy: Callable[[MigrationConnection], None]):
+        self.version = version
+        self.description = description
+        self.sqlite = sqlite
+        self.sqlalchemy = sqlalchemy
+
+# Ordered list of schema migrations; append new ones with the next version
+MIGRATIONS: List[Migration] = []
+
+def register_migration(version: int, description: str, sqlite, sqlalchemy):
+    """Register a schema migration; versions must be strictly increasing"""
+    if MIGRATIONS and version <= MIGRATIONS[-1].version:
+        raise ValueError(f"Migration version {version} must be greater than {MIGRATIONS[-1].version}")
+    MIGRATIONS.append(Migration(version, description, sqlite, sqlalchemy))
+
+def latest_version() -> int:
+    """Schema version the code expects"""
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+# ---------------------------------------------------------------------------
+# Migration scripts
+# ---------------------------------------------------------------------------
+
+def _initial_schema_sqlite(conn: MigrationConnection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT NOT NULL,
+            name TEXT NOT NULL,
+            type TEXT,
+            strength TEXT,
+            price REAL NOT NULL,
+            description TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bills (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bill_number TEXT UNIQUE NOT NULL,
+            patient_name TEXT,
+            opd_number TEXT,
+            total_amount REAL NOT NULL,
+            items_json TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_items_category ON items(category)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_bills_number ON bills(bill_number)')
+
+def _initial_schema_sqlalchemy(conn: MigrationConnection):
+    from mysql_database import Base, Item, Bill, Setting, Patient
+    # bills.patient_id references patients, so fresh databases get it here; migration 8 adds it to older ones
+    Base.metadata.create_all(conn.raw, tables=[Item.__table__, Patient.__table__, Bill.__table__, Setting.__table__])
+
+register_migration(1, 'Initial items, bills and settings tables',
+                   sqlite=_initial_schema_sqlite, sqlalchemy=_initial_schema_sqlalchemy)
+
+def _listing_indexes_sqlite(conn: MigrationConnection):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_items_category_name ON items(category, name)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_bills_created_at ON bills(created_at)')
+
+def _listing_indexes_sqlalchemy(conn: MigrationConnection):
+    from mysql_database import Item, Bill
+    conn.create_index('idx_items_category_name', Item.__table__.c.category, Item.__table__.c.name)
+    conn.create_index('idx_bills_created_at', Bill.__table__.c.created_at)
+
+register_migration(2, 'Indexes for catalog listing order and recent bills',
+                   sqlite=_listing_indexes_sqlite, sqlalchemy=_listing_indexes_sqlalchemy)
+
+def _item_changes_sqlite(conn: MigrationConnection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS item_changes (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER NOT NULL,
+            operation TEXT NOT NULL,
+            changed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _item_changes_sqlalchemy(conn: MigrationConnection):
+    from mysql_database import ItemChange
+    ItemChange.__table__.create(conn.raw, checkfirst=True)
+
+register_migration(3, 'Item change log for delta catalog sync',
+                   sqlite=_item_changes_sqlite, sqlalchemy=_item_changes_sqlalchemy)
+
+def _fallback_outbox_sqlite(conn: MigrationConnection):
+    # The raw sqlite3 backend has no primary to replay fallback writes to
+    pass
+
+def _fallback_outbox_sqlalchemy(conn: MigrationConnection):
+    from mysql_database import OutboxEntry, OutboxReplay
+    OutboxEntry.__table__.create(conn.raw, checkfirst=True)
+    OutboxReplay.__table__.create(conn.raw, checkfirst=True)
+
+register_migration(4, 'Fallback write outbox and primary replay log',
+                   sqlite=_fallback_outbox_sqlite, sqlalchemy=_fallback_outbox_sqlalchemy)
+
+def _bill_sequences_sqlite(conn: MigrationConnection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bill_sequences (
+            department TEXT PRIMARY KEY,
+            next_value INTEGER NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _bill_sequences_sqlalchemy(conn: MigrationConnection):
+    from mysql_database import BillSequence
+    BillSequence.__table__.create(conn.raw, checkfirst=True)
+
+register_migration(5, 'Per-department bill number sequences',
+                   sqlite=_bill_sequences_sqlite, sqlalchemy=_bill_sequences_sqlalchemy)
+
+def _idempotency_keys_sqlite(conn: MigrationConnection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            idempotency_key TEXT PRIMARY KEY,
+            request_hash TEXT NOT NULL,
+            status_code INTEGER,
+            response_body TEXT,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys(expires_at)')
+
+def _idempotency_keys_sqlalchemy(conn: MigrationConnection):
+    from mysql_database import IdempotencyKey
+    IdempotencyKey.__table__.create(conn.raw, checkfirst=True)
+
+register_migration(6, 'Stored responses for Idempotency-Key replays',
+                   sqlite=_idempotency_keys_sqlite, sqlalchemy=_idempotency_keys_sqlalchemy)
+
+def _jobs_sqlite(conn: MigrationConnection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            job_type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            params TEXT,
+            progress REAL NOT NULL DEFAULT 0,
+            message TEXT,
+            result TEXT,
+            error TEXT,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs(created_at)')
+
+def _jobs_sqlalchemy(conn: MigrationConnection):
+    from mysql_database import Job
+    Job.__table__.create(conn.raw, checkfirst=True)
+
+register_migration(7, 'Background jobs',
+                   sqlite=_jobs_sqlite, sqlalchemy=_jobs_sqlalchemy)
+
+def _patients_sqlite(conn: MigrationConnection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS patients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            opd_number TEXT UNIQUE NOT NULL,
+            name TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    if not conn.has_column('bills', 'patient_id'):
+        conn.execute('ALTER TABLE bills ADD COLUMN patient_id INTEGER REFERENCES patients(id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_bills_patient_created ON bills(patient_id, created_at)')
+
+def _patients_sqlalchemy(conn: MigrationConnection):
+    from mysql_database import Patient, Bill
+    Patient.__table__.create(conn.raw, checkfirst=True)
+    if not conn.has_column('bills', 'patient_id'):
+        if conn.dialect == 'sqlite':
+            conn.execute('ALTER TABLE bills ADD COLUMN patient_id INTEGER REFERENCES patients(id)')
+        else:
+            conn.execute('ALTER TABLE bills ADD COLUMN patient_id INTEGER NULL, '
+                         'ADD CONSTRAINT fk_bills_patient FOREIGN KEY (patient_id) REFERENCES patients(id)')
+    conn.create_index('idx_bills_patient_created', Bill.__table__.c.patient_id, Bill.__table__.c.created_at)
+
+register_migration(8, 'Patient registry with bills.patient_id foreign key',
+                   sqlite=_patients_sqlite, sqlalchemy=_patients_sqlalchemy)
+
+def _bill_archives_sqlite(conn: MigrationConnection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bill_archives (
+            month TEXT PRIMARY KEY,
+            location TEXT NOT NULL,
+            first_id INTEGER,
+            last_id INTEGER,
+            bill_count INTEGER NOT NULL DEFAULT 0,
+            total_amount REAL NOT NULL DEFAULT 0,
+            bytes INTEGER,
+            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _bill_archives_sqlalchemy(conn: MigrationConnection):
+    from mysql_database import BillArchive
+    BillArchive.__table__.create(conn.raw, checkfirst=True)
+
+register_migration(9, 'Catalog of archived monthly bill partitions',
+                   sqlite=_bill_archives_sqlite, sqlalchemy=_bill_archives_sqlalchemy)
+
+def _maintenance_runs_sqlite(conn: MigrationConnection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            window_key TEXT UNIQUE,
+            source TEXT NOT NULL,
+            status TEXT NOT NULL,
+            tasks TEXT,
+            results TEXT,
+            worker TEXT,
+            started_at REAL NOT NULL,
+            finished_at REAL,
+            duration_ms REAL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_maintenance_runs_started_at ON maintenance_runs(started_at)')
+
+def _maintenance_runs_sqlalchemy(conn: MigrationConnection):
+    from mysql_database import MaintenanceRun
+    MaintenanceRun.__table__.create(conn.raw, checkfirst=True)
+
+register_migration(10, 'Database maintenance run log',
+                   sqlite=_maintenance_runs_sqlite, sqlalchemy=_maintenance_runs_sqlalchemy)
+
+# ---------------------------------------------------------------------------
+# Schema migration runners
+# ---------------------------------------------------------------------------
+
+_SCHEMA_VERSION_DDL = '''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description VARCHAR(255) NOT NULL,
+        applied_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        duration_ms FLOAT
+    )
+'''
+
+_CHECKPOINT_DDL = '''
+    CREATE TABLE IF NOT EXISTS data_migration_checkpoints (
+        name VARCHAR(100) PRIMARY KEY,
+        last_id INTEGER NOT NULL DEFAULT 0,
+        rows_done INTEGER NOT NULL DEFAULT 0,
+        status VARCHAR(20) NOT NULL DEFAULT 'running',
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# How long a worker waits for another one to finish migrating before giving up
+MIGRATION_LOCK_TIMEOUT = 120
+MIGRATION_LOCK_NAME = 'hospital_billing_schema_migration'
+
+class BaseMigrator(ABC):
+    """Applies pending MIGRATIONS in order and records them in schema_version"""
+
+    backend = None
+
+    @abstractmethod
+    def transaction(self, lock: bool = False):
+        """Context manager yielding a MigrationConnection inside a transaction.
+
+        With lock=True the transaction also holds the migration lock, so
+        workers starting together apply each migration exactly once.
+        """
+
+    def _bootstrap(self, conn: MigrationConnection):
+        conn.execute(_SCHEMA_VERSION_DDL)
+        conn.execute(_CHECKPOINT_DDL)
+
+    def current_version(self) -> int:
+        """Highest applied migration version (0 for a fresh database)"""
+        with self.transaction() as conn:
+            if not conn.has_table('schema_version'):
+                return 0
+            row = conn.execute('SELECT MAX(version) FROM schema_version')[0]
+            return row[0] or 0
+
+    def applied(self) -> List[Dict]:
+        """History of applied migrations"""
+        with self.transaction() as conn:
+            if not conn.has_table('schema_version'):
+                return []
+            rows = conn.execute(
+                'SELECT version, description, applied_at, duration_ms FROM schema_version ORDER BY version')
+            return [{
+                'version': row[0],
+                'description': row[1],
+                'applied_at': str(row[2]) if row[2] else None,
+                'duration_ms': row[3]
+            } for row in rows]
+
+    def pending(self) -> List[Migration]:
+        """Migrations newer than the stored version"""
+        current = self.current_version()
+        return [m for m in MIGRATIONS if m.version > current]
+
+    def _after_migrate(self, conn: MigrationConnection, version: int):
+        """Hook for backend-specific bookkeeping after a migration"""
+
+    def _is_applied(self, conn: MigrationConnection, version: int) -> bool:
+        return bool(conn.execute('SELECT 1 FROM schema_version WHERE version = :version', {'version': version}))
+
+    def migrate(self, target: Optional[int] = None) -> List[int]:
+        """Apply pending migrations up to target, each in its own locked transaction.
+
+        The version is read again under the lock, so a migration another
+        worker applied in the meantime is skipped instead of failing.
+        """
+        with self.transaction(lock=True) as conn:
+            self._bootstrap(conn)
+
+        applied = []
+        for migration in self.pending():
+            if target is not None and migration.version > target:
+                break
+
+            step = migration.sqlite if self.backend == 'sqlite' else migration.sqlalchemy
+            with self.transaction(lock=True) as conn:
+                if self._is_applied(conn, migration.version):
+                    logger.info(f"ℹ️ Migration {migration.version} already applied by another process")
+                    continue
+                start = time.perf_counter()
+                step(conn)
+                duration_ms = round((time.perf_counter() - start) * 1000, 2)
+                conn.execute(
+                    'INSERT INTO schema_version (version, description, duration_ms) '
+                    'VALUES (:version, :description, :duration_ms)',
+                    {'version': migration.version, 'description': migration.description,
+                     'duration_ms': duration_ms})
+                self._after_migrate(conn, migration.version)
+
+            applied.append(migration.version)
+            logger.info(f"✅ Applied migration {migration.version}: {migration.description} ({duration_ms} ms)")
+
+        return applied
+
+class SQLiteMigrator(BaseMigrator):
+    """Migration runner for the raw sqlite3 backend (flask_database)"""
+
+    backend = 'sqlite'
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+    @contextmanager
+    def transaction(self, lock: bool = False):
+        # Autocommit mode plus explicit BEGIN so DDL is transactional too;
+        # BEGIN IMMEDIATE takes the write lock up front, serializing migrators
+        raw = sqlite3.connect(self.db_path, isolation_level=None, timeout=MIGRATION_LOCK_TIMEOUT)
+        conn = MigrationConnection(raw, 'sqlite', 'sqlite')
+        try:
+            raw.execute('BEGIN IMMEDIATE' if lock else 'BEGIN')
+            yield conn
+            raw.execute('COMMIT')
+        except Exception:
+            raw.execute('ROLLBACK')
+            raise
+        finally:
+            raw.close()
+
+    def _after_migrate(self, conn: MigrationConnection, version: int):
+        # Mirror the version in the file header for the cheap startup check
+        conn.execute(f'PRAGMA user_version = {int(version)}')
+
+class SQLAlchemyMigrator(BaseMigrator):
+    """Migration runner for SQLAlchemy engines (mysql_database and its SQLite fallback).
+
+    MySQL commits DDL implicitly, so a failed migration there can be partially
+    applied; steps therefore check for existing tables, columns and indexes.
+    """
+
+    backend = 'sqlalchemy'
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    @contextmanager
+    def transaction(self, lock: bool = False):
+        dialect = self.engine.dialect.name
+        with self.engine.connect() as raw:
+            # MySQL DDL commits implicitly, so the lock is a named session lock held
+            # until after the commit; SQLite takes its write lock with BEGIN IMMEDIATE
+            named_lock = lock and dialect == 'mysql'
+            if named_lock:
+                acquired = raw.execute(text('SELECT GET_LOCK(:name, :timeout)'),
+                                       {'name': MIGRATION_LOCK_NAME, 'timeout': MIGRATION_LOCK_TIMEOUT}).scalar()
+                raw.commit()
+                if acquired != 1:
+                    raise RuntimeError(f'Timed out waiting for the schema migration lock after {MIGRATION_LOCK_TIMEOUT}s')
+            try:
+                with raw.begin():
+                    if lock and dialect == 'sqlite':
+                        raw.exec_driver_sql('BEGIN IMMEDIATE')
+                    yield MigrationConnection(raw, dialect, 'sqlalchemy')
+            finally:
+                if named_lock:
+                    try:
+                        raw.execute(text('SELECT RELEASE_LOCK(:name)'), {'name': MIGRATION_LOCK_NAME})
+                        raw.commit()
+                    except Exception as e:
+                        # Closing the connection is the only other way to free a session lock
+                        logger.warning(f"⚠️ Could not release the schema migration lock: {e}")
+                        raw.invalidate()
+
+# ---------------------------------------------------------------------------
+# Batched, resumable data migrations
+# ---------------------------------------------------------------------------
+
+class DataMigration(ABC):
+    """Base class for an online rewrite of one table in small batches.
+
+    Rows are read by primary key (keyset pagination), so each batch is an
+    index range scan no matter how large the table is. Each batch and its
+    checkpoint commit in the same transaction; after an interruption the
+    runner resumes right after the last committed id.
+    """
+
+    name: str = None
+    table: str = None
+    columns: str = '*'
+    key_column: str = 'id'
+    batch_size: int = 1000
+
+    @abstractmethod
+    def process_batch(self, conn: MigrationConnection, rows: List) -> None:
+        """Rewrite one batch of rows inside the runner's transaction"""
+
+# Registered data migrations by name, run through `migrate_database.py data-migrate`
+DATA_MIGRATIONS: Dict[str, DataMigration] = {}
+
+def register_data_migration(migration_cls):
+    """Class decorator adding a DataMigration to DATA_MIGRATIONS"""
+    DATA_MIGRATIONS[migration_cls.name] = migration_cls()
+    return migration_cls
+
+class DataMigrationRunner:
+    """Runs DataMigration batches with checkpoints on any BaseMigrator backend"""
+
+    def __init__(self, migrator: BaseMigrator):
+        self.migrator = migrator
+
+    def _load_checkpoint(self, conn: MigrationConnection, name: str) -> Dict:
+        rows = conn.execute(
+            'SELECT last_id, rows_done, status FROM data_migration_checkpoints WHERE name = :name',
+            {'name': name})
+        if not rows:
+            conn.execute(
+                "INSERT INTO data_migration_checkpoints (name, last_id, rows_done, status) "
+                "VALUES (:name, 0, 0, 'running')", {'name': name})
+            return {'last_id': 0, 'rows_done': 0, 'status': 'running'}
+        return {'last_id': rows[0][0], 'rows_done': rows[0][1], 'status': rows[0][2]}
+
+    def status(self, name: str) -> Optional[Dict]:
+        """Checkpoint of a data migration, or None if it never ran"""
+        with self.migrator.transaction() as conn:
+            if not conn.has_table('data_migration_checkpoints'):
+                return None
+            rows = conn.execute(
+                'SELECT last_id, rows_done, status, updated_at FROM data_migration_checkpoints WHERE name = :name',
+                {'name': name})
+            if not rows:
+                return None
+            return {'name': name, 'last_id': rows[0][0], 'rows_done': rows[0][1],
+                    'status': rows[0][2], 'updated_at': str(rows[0][3])}
+
+    def run(self, migration: DataMigration, pause: float = 0.0,
+            max_batches: Optional[int] = None) -> Dict:
+        """Process batches until the table is exhausted or max_batches is reached.
+
+        ``pause`` sleeps between batches so live traffic keeps getting the
+        database; rerunning after a crash or Ctrl-C continues from the
+        checkpoint.
+        """
+        with self.migrator.transaction() as conn:
+            self.migrator._bootstrap(conn)
+            checkpoint = self._load_checkpoint(conn, migration.name)
+
+        if checkpoint['status'] == 'completed':
+            logger.info(f"Data migration '{migration.name}' already completed")
+            return checkpoint
+
+        batches = 0
+        start = time.perf_counter()
+        while max_batches is None or batches < max_batches:
+            with self.migrator.transaction() as conn:
+                rows = conn.execute(
+                    f'SELECT {migration.columns} FROM {migration.table} '
+                    f'WHERE {migration.key_column} > :last_id '
+                    f'ORDER BY {migration.key_column} LIMIT :batch_size',
+                    {'last_id': checkpoint['last_id'], 'batch_size': migration.batch_size})
+
+                if not rows:
+                    checkpoint['status'] = 'completed'
+                else:
+                    migration.process_batch(conn, rows)
+                    checkpoint['last_id'] = rows[-1][0]
+                    checkpoint['rows_done'] += len(rows)
+
+                conn.execute(
+                    'UPDATE data_migration_checkpoints SET last_id = :last_id, rows_done = :rows_done, '
+                    'status = :status, updated_at = CURRENT_TIMESTAMP WHERE name = :name',
+                    {**checkpoint, 'name': migration.name})
+
+            if checkpoint['status'] == 'completed':
+                break
+
+            batches += 1
+            logger.info(f"🔄 {migration.name}: {checkpoint['rows_done']} rows migrated (last id {checkpoint['last_id']})")
+            if pause:
+                time.sleep(pause)
+
+        elapsed = round(time.perf_counter() - start, 2)
+        logger.info(f"✅ {migration.name}: {checkpoint['status']} after {batches} batches in {elapsed}s")
+        return checkpoint
+
+def normalize_opd_number(value) -> str:
+    """Registry key for an OPD/hospital number: surrounding whitespace is ignored"""
+    return str(value or '').strip()
+
+def upsert_patient_sql(dialect: str) -> str:
+    """Insert a patient, or refresh its name when a newer bill carries one"""
+    if dialect == 'mysql':
+        return ('INSERT INTO patients (opd_number, name, created_at, updated_at) '
+                'VALUES (:opd_number, :name, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP) '
+                "ON DUPLICATE KEY UPDATE name = IF(VALUES(name) != '', VALUES(name), name)")
+    return ('INSERT INTO patients (opd_number, name, created_at, updated_at) '
+            'VALUES (:opd_number, :name, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP) '
+            "ON CONFLICT (opd_number) DO UPDATE SET name = excluded.name, updated_at = CURRENT_TIMESTAMP "
+            "WHERE excluded.name != ''")
+
+@register_data_migration
+class BackfillBillPatients(DataMigration):
+    """Register a patient for every OPD number on existing bills and link the bills to it"""
+
+    name = 'backfill_bill_patients'
+    table = 'bills'
+    columns = 'id, patient_name, opd_number, patient_id'
+    batch_size = 1000
+
+    def process_batch(self, conn: MigrationConnection, rows: List) -> None:
+        # Raw OPD strings per registry key, and the latest name seen for each
+        raw_values, names = {}, {}
+        for _, patient_name, opd_number, patient_id in rows:
+            opd = normalize_opd_number(opd_number)
+            if not opd or patient_id is not None:
+                continue
+            raw_values.setdefault(opd, set()).add(opd_number)
+            names[opd] = patient_name or names.get(opd, '')
+        if not names:
+            return
+
+        upsert = upsert_patient_sql(conn.dialect)
+        for opd, name in names.items():
+            conn.execute(upsert, {'opd_number': opd, 'name': name})
+
+        opds = list(names)
+        placeholders = ', '.join(f':o{i}' for i in range(len(opds)))
+        patient_ids = dict(conn.execute(
+            f'SELECT opd_number, id FROM patients WHERE opd_number IN ({placeholders})',
+            {f'o{i}': opd for i, opd in enumerate(opds)}))
+
+        # One update per distinct OPD number, confined to this batch's id range
+        for opd, values in raw_values.items():
+            for raw in values:
+                conn.execute(
+                    'UPDATE bills SET patient_id = :patient_id '
+                    'WHERE id >= :first AND id <= :last AND opd_number = :raw AND patient_id IS NULL',
+                    {'patient_id': patient_ids[opd], 'first': rows[0][0], 'last': rows[-1][0], 'raw': raw})
@@ -0,0 +1,113 @@
+
+import os
+import time
+import logging
+import threading
+from typing import Callable, Any, Dict
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class _Call:
+    """One in-flight execution that concurrent callers wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.stale = False
+
+class SingleFlight:
+    """Coalesces concurrent identical reads into one execution per worker.
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait for it and share its result (or its exception). With ttl > 0
+    the result is also reused for that many seconds after it finishes.
+    Invalidating a key (after a write) detaches the execution in flight, so
+    later callers never get a result read before the write. Results are
+    shared objects, so callers must treat them as read-only.
+    """
+
+    def __init__(self, ttl: float = 0.0):
+        self.ttl = ttl
+        self.executions = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+        self._calls = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, func: Callable[[], Any]) -> Any:
+        """Return func()'s result, sharing one execution among concurrent callers"""
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                self.cache_hits += 1
+                return cached[1]
+
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                if call.error is None and self.ttl > 0 and not call.stale:
+                    self._results[key] = (time.monotonic() + self.ttl, call.result)
+            call.done.set()
+
+    def invalidate(self, *keys: str):
+        """Drop cached results so the next read runs fresh; no keys drops everything"""
+        with self._lock:
+            for key in keys or list(self._calls) + list(self._results):
+                self._results.pop(key, None)
+                call = self._calls.pop(key, None)
+                if call is not None:
+                    call.stale = True
+
+    def get_info(self) -> Dict:
+        """Coalescing statistics for this worker"""
+        return {
+            'pid': os.getpid(),
+            'ttl_seconds': self.ttl,
+            'in_flight': len(self._calls),
+            'executions': self.executions,
+            'coalesced': self.coalesced,
+            'cache_hits': self.cache_hits
+        }
+
+_single_flight = None
+_single_flight_pid = None
+_single_flight_lock = threading.Lock()
+
+def get_single_flight() -> SingleFlight:
+    """Return this worker's coalescer, creating it after fork if needed"""
+    global _single_flight, _single_flight_pid
+    pid = os.getpid()
+    if _single_flight is None or _single_flight_pid != pid:
+        with _single_flight_lock:
+            if _single_flight is None or _single_flight_pid != pid:
+                _single_flight = SingleFlight(ttl=float(os.getenv('SINGLE_FLIGHT_TTL_SECONDS', 0)))
+                _single_flight_pid = pid
+    return _single_flight
@@ -0,0 +1,42 @@
+"""
+Shared fixtures: the repository root on sys.path, and a Flask test client
+backed by a fresh SQLite database for each test.
+"""
+
+import os
+import sys
+import importlib
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Per-process singletons (module, attribute) that cache a database handle or worker state
+SINGLETONS = (
+    ('admission', '_controller'),
+    ('bill_numbers', '_allocator'),
+    ('bill_render', '_render_cache'),
+    ('catalog_store', '_catalog_cache'),
+    ('event_stream', '_broadcaster'),
+    ('idempotency', '_store'),
+    ('jobs', '_job_queue'),
+    ('single_flight', '_single_flight'),
+)
+
+@pytest.fixture
+def app_client(tmp_path, monkeypatch):
+    """Test client for main.app on an empty SQLite database in tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('DATABASE_BACKEND', 'sqlite')
+    monkeypatch.setenv('SQLITE_DB_PATH', str(tmp_path / 'hospital_billing_test.db'))
+    monkeypatch.setenv('MAINTENANCE_ENABLED', 'False')
+    monkeypatch.setenv('CATALOG_SNAPSHOT_PATH', '')
+    monkeypatch.setenv('EVENTS_SOCKET_DIR', str(tmp_path / 'events'))
+    for module, attribute in SINGLETONS:
+        monkeypatch.setattr(importlib.import_module(module), attribute, None)
+
+    import main
+    from database_backend import db
+    db._reset_after_fork()
+    yield main.app.test_client()
+    db._reset_after_fork()
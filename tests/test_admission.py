@@ -0,0 +1,168 @@
+"""
+Tests for admission control (admission.py and its hooks in main.py).
+"""
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import admission
+from admission import AdmissionController, TokenBucket, classify, load_route_classes, HEAVY_BILL_LIMIT
+
+# ---------------------------------------------------------------------------
+# Route classes
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize('method, path, args, expected', [
+    # Saving bills and allocating numbers outrank everything
+    ('POST', '/api/bills', {}, 'critical'),
+    ('POST', '/api/bills/number', {}, 'critical'),
+    # Bulk saves and batch renders must not outrank single bills
+    ('POST', '/api/bills/bulk', {}, 'heavy'),
+    ('POST', '/api/bills/render', {}, 'heavy'),
+    ('GET', '/api/database/backup', {}, 'heavy'),
+    ('POST', '/api/database/backup', {}, 'heavy'),
+    ('GET', '/api/export/bills', {}, 'heavy'),
+    ('GET', '/api/bills', {'limit': str(HEAVY_BILL_LIMIT + 1)}, 'heavy'),
+    ('GET', '/api/bills', {'limit': str(HEAVY_BILL_LIMIT)}, 'read'),
+    ('GET', '/api/bills', {}, 'read'),
+    # Single-flight reads stay cheap
+    ('GET', '/api/statistics', {}, 'read'),
+    ('GET', '/api/database/test', {}, 'read'),
+    ('GET', '/api/items', {}, 'read'),
+    ('POST', '/api/items', {}, 'write'),
+    ('PUT', '/api/items/3', {}, 'write'),
+    ('DELETE', '/api/items/3', {}, 'write'),
+    ('POST', '/api/jobs', {}, 'write'),
+    # Not admission controlled
+    ('GET', '/', {}, None),
+    ('GET', '/static/app.js', {}, None),
+    ('GET', '/api/events', {}, None),
+    ('OPTIONS', '/api/bills', {}, None),
+    ('GET', '/api/admin/profiles', {}, None),
+])
+def test_classify(method, path, args, expected):
+    assert classify(method, path, MultiDict(args)) == expected
+
+# ---------------------------------------------------------------------------
+# Token buckets
+# ---------------------------------------------------------------------------
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, 'monotonic', clock)
+    return clock
+
+def test_bucket_burst_then_refill(clock):
+    bucket = TokenBucket(rate=2.0, burst=3)
+    assert [bucket.take() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take() == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert bucket.take() == 0.0
+    assert bucket.take() == pytest.approx(0.5)
+
+    # Refill never exceeds the burst
+    clock.now += 60
+    assert [bucket.take() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take() > 0
+
+def test_rate_limited_client_gets_429_with_retry_after(clock):
+    controller = AdmissionController(classes={'write': {'rate': 0.5, 'burst': 1, 'shed_at': 1.0}})
+    assert controller.admit('10.0.0.1', 'write') is None
+    controller.release('write')
+    assert controller.admit('10.0.0.1', 'write') == (429, 2, 'Rate limit exceeded for write requests')
+    # Buckets are per client
+    assert controller.admit('10.0.0.2', 'write') is None
+
+    clock.now += 2
+    controller.release('write')
+    assert controller.admit('10.0.0.1', 'write') is None
+    assert controller.rate_limited['write'] == 1
+
+def test_route_class_overrides(monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT_HEAVY', '2,9')
+    monkeypatch.setenv('RATE_LIMIT_READ', '50')
+    classes = load_route_classes()
+    assert (classes['heavy']['rate'], classes['heavy']['burst']) == (2.0, 9)
+    assert (classes['read']['rate'], classes['read']['burst']) == (50.0, admission.ROUTE_CLASSES['read']['burst'])
+
+# ---------------------------------------------------------------------------
+# Shedding
+# ---------------------------------------------------------------------------
+
+def fill(controller: AdmissionController, route_class: str, count: int):
+    for n in range(count):
+        assert controller.admit(f'filler-{route_class}-{n}', route_class) is None
+
+@pytest.mark.parametrize('route_class', ['heavy', 'read', 'write', 'critical'])
+def test_each_class_is_shed_at_its_share(route_class):
+    controller = AdmissionController(max_in_flight=20, heavy_concurrency=20)
+    limit = int(20 * controller.classes[route_class]['shed_at'])
+    # Busy with critical work up to just below this class's share: still admitted
+    fill(controller, 'critical', limit - 1)
+    assert controller.admit('client', route_class) is None
+    # At the share: shed with 503, and the client keeps its tokens
+    status, retry_after, reason = controller.admit('client', route_class)
+    assert status == 503
+    assert reason == f'Server busy, {route_class} requests are being shed'
+    assert controller.shed[route_class] == 1
+
+def test_lower_classes_are_shed_first():
+    controller = AdmissionController(max_in_flight=10, heavy_concurrency=10)
+    fill(controller, 'read', 8)
+    assert controller.admit('client', 'heavy')[0] == 503
+    assert controller.admit('client', 'read')[0] == 503
+    assert controller.admit('client', 'write') is None
+    assert controller.admit('client', 'write')[0] == 503
+    assert controller.admit('client', 'critical') is None
+    assert controller.admit('client', 'critical')[0] == 503
+
+def test_heavy_concurrency_cap():
+    controller = AdmissionController(max_in_flight=32, heavy_concurrency=2)
+    fill(controller, 'heavy', 2)
+    assert controller.admit('client', 'heavy') == (503, 2, 'Too many heavy requests in progress')
+    controller.release('heavy')
+    assert controller.admit('client', 'heavy') is None
+
+# ---------------------------------------------------------------------------
+# Request hooks
+# ---------------------------------------------------------------------------
+
+def test_streamed_export_holds_its_slot_until_closed(app_client):
+    controller = admission.get_admission_controller()
+    response = app_client.get('/api/export/items', buffered=False)
+    assert response.status_code == 200
+    assert controller.in_flight['heavy'] == 1
+
+    body = b''.join(response.response)
+    response.close()
+    assert body
+    assert controller.in_flight['heavy'] == 0
+    assert controller.admitted['heavy'] == 1
+
+def test_rejections_reach_the_client(app_client, monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT_WRITE', '0.1,1')
+    monkeypatch.setattr(admission, '_controller', None)
+    item = {'category': 'Lab', 'name': 'ESR', 'price': 100}
+    assert app_client.post('/api/items', json=item).status_code == 201
+    response = app_client.post('/api/items', json=dict(item, name='CRP'))
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.get_json()['success'] is False
+
+def test_bill_saves_are_not_rate_limited_by_bulk_traffic(app_client, monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT_HEAVY', '0.01,1')
+    monkeypatch.setattr(admission, '_controller', None)
+    bill = {'total_amount': 10, 'items': [{'name': 'CBC', 'price': 10}]}
+    bulk = {'bills': [dict(bill, bill_number='BULK-1')]}
+    assert app_client.post('/api/bills/bulk', json=bulk).status_code == 201
+    assert app_client.post('/api/bills/bulk', json={'bills': [dict(bill, bill_number='BULK-2')]}).status_code == 429
+    assert app_client.post('/api/bills', json=dict(bill, bill_number='ONE-1')).status_code == 201
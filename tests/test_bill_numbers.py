@@ -0,0 +1,103 @@
+"""
+Tests for server-side bill number allocation (bill_numbers.py).
+"""
+
+import threading
+from datetime import datetime
+
+import pytest
+
+from bill_numbers import BillNumberAllocator, DEFAULT_FORMATS, get_department_formats
+
+@pytest.fixture
+def database(tmp_path):
+    from flask_database import HospitalDB
+    return HospitalDB(str(tmp_path / 'bill_numbers.db'))
+
+def sequence(number: str) -> int:
+    return int(number.rsplit('-', 1)[1])
+
+def test_number_formats(database):
+    allocator = BillNumberAllocator(database, block_size=5, formats=dict(DEFAULT_FORMATS))
+    year = datetime.now().year
+    assert allocator.allocate('outpatient') == f'BILL-{year}-000001'
+    assert allocator.allocate('inpatient') == f'IP-{year}-000001'
+    assert allocator.allocate() == f'BILL-{year}-000002'
+
+def test_numbers_run_in_order_across_blocks(database):
+    allocator = BillNumberAllocator(database, block_size=3, formats=dict(DEFAULT_FORMATS))
+    numbers = allocator.allocate_many('outpatient', 10)
+    assert [sequence(number) for number in numbers] == list(range(1, 11))
+    # One lease per block of three
+    assert allocator.leases == 4
+    assert allocator.get_info()['remaining_in_block'] == {'outpatient': 2}
+
+def test_workers_lease_disjoint_blocks(database):
+    first = BillNumberAllocator(database, block_size=4, formats=dict(DEFAULT_FORMATS))
+    second = BillNumberAllocator(database, block_size=4, formats=dict(DEFAULT_FORMATS))
+    numbers = []
+    for _ in range(5):
+        numbers += [first.allocate('inpatient'), second.allocate('inpatient')]
+    values = [sequence(number) for number in numbers]
+    assert len(set(values)) == len(values)
+    # Increasing per worker, not gap-free overall
+    assert values[0::2] == sorted(values[0::2])
+    assert values[1::2] == sorted(values[1::2])
+    # Blocks 1-4 and 5-8, then 9-12 and 13-16
+    assert sorted(values) == [1, 2, 3, 4, 5, 6, 7, 8, 9, 13]
+
+def test_concurrent_allocation_is_unique(database):
+    allocator = BillNumberAllocator(database, block_size=7, formats=dict(DEFAULT_FORMATS))
+    numbers = []
+    lock = threading.Lock()
+
+    def allocate():
+        batch = [allocator.allocate('outpatient') for _ in range(25)]
+        with lock:
+            numbers.extend(batch)
+
+    threads = [threading.Thread(target=allocate) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(sequence(number) for number in numbers) == list(range(1, 201))
+
+def test_unknown_department(database):
+    allocator = BillNumberAllocator(database, formats=dict(DEFAULT_FORMATS))
+    with pytest.raises(ValueError, match="Unknown department 'pharmacy'"):
+        allocator.allocate('pharmacy')
+
+def test_format_overrides(monkeypatch, database):
+    monkeypatch.setenv('BILL_NUMBER_FORMAT_OUTPATIENT', 'OPD{year}{month:02d}-{seq:04d}')
+    allocator = BillNumberAllocator(database, formats=get_department_formats())
+    now = datetime.now()
+    assert allocator.allocate('outpatient') == f'OPD{now.year}{now.month:02d}-0001'
+
+# ---------------------------------------------------------------------------
+# Endpoints
+# ---------------------------------------------------------------------------
+
+def test_number_endpoint(app_client):
+    response = app_client.post('/api/bills/number', json={'department': 'inpatient', 'count': 3})
+    assert response.status_code == 200
+    numbers = response.get_json()['bill_numbers']
+    assert [sequence(number) for number in numbers] == [1, 2, 3]
+    assert all(number.startswith('IP-') for number in numbers)
+
+def test_unknown_department_is_a_400(app_client):
+    response = app_client.post('/api/bills/number', json={'department': 'pharmacy'})
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Invalid department'
+
+    bill = {'department': 'pharmacy', 'total_amount': 10, 'items': [{'name': 'CBC', 'price': 10}]}
+    response = app_client.post('/api/bills', json=bill)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Invalid department'
+
+def test_bills_without_a_number_get_one(app_client):
+    bill = {'total_amount': 10, 'items': [{'name': 'CBC', 'price': 10}]}
+    first = app_client.post('/api/bills', json=bill).get_json()['bill_number']
+    second = app_client.post('/api/bills', json=dict(bill, department='outpatient')).get_json()['bill_number']
+    assert first.startswith('BILL-')
+    assert sequence(second) == sequence(first) + 1
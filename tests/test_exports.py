@@ -0,0 +1,80 @@
+"""
+Tests for the streamed CSV/XLSX exports (exports.py and the /api/export routes).
+"""
+
+import io
+import csv
+import zipfile
+
+import exports
+from exports import EXPORT_FORMATS, BILL_LINE_EXPORT_COLUMNS, stream_csv, stream_xlsx
+
+def save_bills(client, count: int):
+    for n in range(count):
+        response = client.post('/api/bills', json={
+            'bill_number': f'EXP-{n:03d}',
+            'patient_name': f'Patient {n}',
+            'total_amount': 10 * (n + 1),
+            'items': [{'name': 'CBC', 'category': 'Lab', 'quantity': 1, 'price': 250, 'totalPrice': 250},
+                      {'name': 'Paracetamol', 'category': 'Medicine', 'quantity': 2, 'price': 2, 'totalPrice': 4}]
+        })
+        assert response.status_code == 201, response.get_json()
+
+def read_csv(body: bytes):
+    text = body.decode('utf-8')
+    assert text.startswith('\ufeff')
+    return list(csv.reader(io.StringIO(text[1:])))
+
+def test_csv_export_headers(app_client):
+    response = app_client.get('/api/export/items?format=csv')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'text/csv; charset=utf-8'
+    assert response.headers.getlist('Content-Type') == ['text/csv; charset=utf-8']
+    assert response.headers['Content-Disposition'].startswith('attachment; filename="items_')
+    assert response.headers['Content-Disposition'].endswith('.csv"')
+    assert response.headers['Cache-Control'] == 'no-store'
+    assert response.is_streamed
+
+def test_xlsx_export_headers(app_client):
+    response = app_client.get('/api/export/statistics?format=xlsx')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == EXPORT_FORMATS['xlsx'][0]
+    workbook = zipfile.ZipFile(io.BytesIO(response.data))
+    assert 'xl/worksheets/sheet1.xml' in workbook.namelist()
+
+def test_unknown_format_is_rejected(app_client):
+    response = app_client.get('/api/export/items?format=pdf')
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+def test_bill_lines_export_streams_rows(app_client):
+    save_bills(app_client, 3)
+    response = app_client.get('/api/export/bills?lines=true', buffered=False)
+    assert response.status_code == 200
+    chunks = list(response.response)
+    response.close()
+
+    rows = read_csv(b''.join(chunks))
+    assert rows[0] == list(BILL_LINE_EXPORT_COLUMNS)
+    assert len(rows) == 1 + 3 * 2
+    assert {row[1] for row in rows[1:]} == {'EXP-000', 'EXP-001', 'EXP-002'}
+    assert [row[6] for row in rows[1:3]] == ['CBC', 'Paracetamol']
+
+def test_csv_is_flushed_every_flush_rows(monkeypatch):
+    monkeypatch.setattr(exports, 'FLUSH_ROWS', 2)
+    chunks = list(stream_csv(('n',), [(n,) for n in range(5)]))
+    assert len(chunks) == 3
+    assert ''.join(chunks) == '\ufeffn\r\n0\r\n1\r\n2\r\n3\r\n4\r\n'
+
+def test_csv_neutralizes_formulas():
+    rows = read_csv(''.join(stream_csv(('name',), [('=SUM(A1)',), ('-5',), ('plain',)])).encode('utf-8'))
+    assert [row[0] for row in rows[1:]] == ["'=SUM(A1)", "'-5", 'plain']
+
+def test_xlsx_rows_round_trip(monkeypatch):
+    monkeypatch.setattr(exports, 'FLUSH_ROWS', 2)
+    body = b''.join(stream_xlsx(('name', 'price'), [('A & B', 1), ('C', 2.5), (None, True)], 'Items'))
+    sheet = zipfile.ZipFile(io.BytesIO(body)).read('xl/worksheets/sheet1.xml').decode('utf-8')
+    assert sheet.count('<row>') == 4
+    assert 'A &amp; B' in sheet
+    assert '<c><v>2.5</v></c>' in sheet
+    assert '<c t="b"><v>1</v></c>' in sheet
@@ -0,0 +1,134 @@
+"""
+Tests for Idempotency-Key handling (idempotency.py).
+"""
+
+import pytest
+
+from idempotency import IdempotencyStore, MAX_KEY_LENGTH
+
+@pytest.fixture
+def database(tmp_path):
+    from flask_database import HospitalDB
+    return HospitalDB(str(tmp_path / 'idempotency.db'))
+
+# ---------------------------------------------------------------------------
+# Store
+# ---------------------------------------------------------------------------
+
+def test_claim_then_replay(database):
+    store = IdempotencyStore(database)
+    assert store.begin('key-1', 'hash-a') == ('new', None)
+    outcome, record = store.begin('key-1', 'hash-a')
+    assert outcome == 'in_progress'
+
+    store.complete('key-1', 'hash-a', 201, '{"success":true}')
+    outcome, record = store.begin('key-1', 'hash-a')
+    assert outcome == 'replay'
+    assert (record['status_code'], record['response_body']) == (201, '{"success":true}')
+    assert store.memory_hits == 1
+
+def test_replay_from_another_worker(database):
+    first = IdempotencyStore(database)
+    first.begin('key-1', 'hash-a')
+    first.complete('key-1', 'hash-a', 201, '{"bill_id":1}')
+
+    # A second store has nothing in memory and answers from the table
+    second = IdempotencyStore(database)
+    outcome, record = second.begin('key-1', 'hash-a')
+    assert outcome == 'replay'
+    assert record['response_body'] == '{"bill_id":1}'
+    assert second.database_hits == 1
+
+def test_different_request_under_the_same_key(database):
+    store = IdempotencyStore(database)
+    store.begin('key-1', 'hash-a')
+    assert store.begin('key-1', 'hash-b')[0] == 'mismatch'
+    store.complete('key-1', 'hash-a', 201, '{}')
+    assert store.begin('key-1', 'hash-b')[0] == 'mismatch'
+
+def test_released_claims_can_be_retried(database):
+    store = IdempotencyStore(database)
+    store.begin('key-1', 'hash-a')
+    store.release('key-1')
+    assert store.begin('key-1', 'hash-b') == ('new', None)
+
+def test_expired_claims_are_taken_over(database):
+    store = IdempotencyStore(database, claim_seconds=-1)
+    store.begin('key-1', 'hash-a')
+    assert store.begin('key-1', 'hash-a') == ('new', None)
+
+def test_memory_cache_is_bounded(database):
+    store = IdempotencyStore(database, max_entries=2)
+    for n in range(3):
+        store.begin(f'key-{n}', 'hash')
+        store.complete(f'key-{n}', 'hash', 201, '{}')
+    assert store.get_info()['cached_responses'] == 2
+    # The evicted response is still replayed from the table
+    assert store.begin('key-0', 'hash')[0] == 'replay'
+
+# ---------------------------------------------------------------------------
+# Decorated endpoints
+# ---------------------------------------------------------------------------
+
+BILL = {'bill_number': 'IDEM-1', 'patient_name': 'A', 'total_amount': 10, 'items': [{'name': 'CBC', 'price': 10}]}
+
+def bill_count(client) -> int:
+    return len(client.get('/api/bills?limit=100').get_json()['bills'])
+
+def test_repeat_replays_the_stored_response(app_client):
+    headers = {'Idempotency-Key': 'save-1'}
+    first = app_client.post('/api/bills', json=BILL, headers=headers)
+    assert first.status_code == 201
+    assert 'Idempotent-Replayed' not in first.headers
+
+    second = app_client.post('/api/bills', json=BILL, headers=headers)
+    assert second.status_code == 201
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert second.get_json() == first.get_json()
+    assert bill_count(app_client) == 1
+
+def test_same_key_with_a_different_body_is_rejected(app_client):
+    headers = {'Idempotency-Key': 'save-1'}
+    assert app_client.post('/api/bills', json=BILL, headers=headers).status_code == 201
+    response = app_client.post('/api/bills', json=dict(BILL, total_amount=20), headers=headers)
+    assert response.status_code == 422
+    assert response.get_json()['error'] == 'Idempotency-Key reused with a different request'
+    assert bill_count(app_client) == 1
+
+def test_rejected_requests_are_not_stored(app_client):
+    headers = {'Idempotency-Key': 'save-1'}
+    invalid = dict(BILL, total_amount='lots')
+    assert app_client.post('/api/bills', json=invalid, headers=headers).status_code == 400
+    # The 400 was released, so a corrected payload goes through under the same key
+    response = app_client.post('/api/bills', json=BILL, headers=headers)
+    assert response.status_code == 201
+    assert 'Idempotent-Replayed' not in response.headers
+
+def test_conflicts_are_not_stored(app_client):
+    assert app_client.post('/api/bills', json=BILL).status_code == 201
+    headers = {'Idempotency-Key': 'save-2'}
+    assert app_client.post('/api/bills', json=BILL, headers=headers).status_code == 409
+    response = app_client.post('/api/bills', json=dict(BILL, bill_number='IDEM-2'), headers=headers)
+    assert response.status_code == 201
+
+def test_server_errors_are_not_stored(app_client, monkeypatch):
+    from database_backend import db
+
+    def unavailable(bill_data):
+        raise RuntimeError('database unavailable')
+
+    headers = {'Idempotency-Key': 'save-1'}
+    monkeypatch.setattr(db.get(), 'save_bill', unavailable)
+    assert app_client.post('/api/bills', json=BILL, headers=headers).status_code == 500
+    monkeypatch.undo()
+    response = app_client.post('/api/bills', json=BILL, headers=headers)
+    assert response.status_code == 201
+    assert 'Idempotent-Replayed' not in response.headers
+
+def test_requests_without_a_key_run_every_time(app_client):
+    assert app_client.post('/api/bills', json=BILL).status_code == 201
+    assert app_client.post('/api/bills', json=BILL).status_code == 409
+
+def test_overlong_keys_are_rejected(app_client):
+    response = app_client.post('/api/bills', json=BILL, headers={'Idempotency-Key': 'k' * (MAX_KEY_LENGTH + 1)})
+    assert response.status_code == 400
@@ -0,0 +1,179 @@
+"""
+Tests for metered O2/ISO pricing (metering.py).
+"""
+
+import random
+
+import pytest
+
+import metering
+from metering import MAX_SESSIONS, MeteringError, load_rates, price_sessions
+
+RATES = {
+    'o2': {'item_id': 1, 'name': 'O2 Service', 'type': 'Oxygen Therapy', 'unit': 'L', 'unit_price': 65.0},
+    'iso': {'item_id': 2, 'name': 'ISO Service', 'type': 'Isoflurane Therapy', 'unit': 'min', 'unit_price': 30.0},
+}
+
+def session(service: str, start: str, end: str, **fields) -> dict:
+    return {'service': service, 'start': start, 'end': end, **fields}
+
+# ---------------------------------------------------------------------------
+# Charges match the browser calculators in app.js
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize('liters_hour, start, end, total_hours', [
+    (2.0, '2026-03-01T08:00:00', '2026-03-01T11:30:00', 3.5),
+    (5.0, '2026-03-01T22:15:00', '2026-03-02T01:45:00', 3.5),
+    (1.5, '2026-03-01T08:00:00', '2026-03-01T08:20:00', 1 / 3),
+])
+def test_o2_charge_matches_app_js(liters_hour, start, end, total_hours):
+    result = price_sessions([session('o2', start, end, flow_rate=liters_hour)], RATES, vectorized=False)
+    priced = result['sessions'][0]
+    # app.js: litersHour * totalHours * window.compactO2BaseRate
+    assert priced['charge'] == pytest.approx(liters_hour * total_hours * 65.0, abs=0.005)
+    assert priced['quantity'] == round(liters_hour * total_hours, 2)
+    assert priced['bill_item']['price'] == priced['charge']
+    assert priced['bill_item']['quantity'] == 1
+    assert priced['bill_item']['category'] == 'O2, ISO'
+
+def test_o2_uses_the_default_flow_rate():
+    priced = price_sessions([session('o2', '2026-03-01T08:00:00', '2026-03-01T09:00:00')], RATES,
+                            vectorized=False)['sessions'][0]
+    assert priced['flow_rate'] == 2.0
+    assert priced['charge'] == 130.0
+
+@pytest.mark.parametrize('start, end, total_minutes', [
+    ('2026-03-01T08:00:00', '2026-03-01T08:45:00', 45),
+    ('2026-03-01T23:50:00', '2026-03-02T00:10:30', 20.5),
+])
+def test_iso_charge_matches_app_js(start, end, total_minutes):
+    priced = price_sessions([session('iso', start, end)], RATES, vectorized=False)['sessions'][0]
+    # app.js: totalMinutes * window.compactISOBaseRate
+    assert priced['charge'] == pytest.approx(total_minutes * 30.0, abs=0.005)
+    assert priced['minutes'] == total_minutes
+    assert priced['unit'] == 'min'
+
+def test_times_accept_offsets_and_epoch_seconds():
+    sessions = [session('iso', '2026-03-01T14:00:00+06:00', '2026-03-01T08:30:00'),
+                session('iso', 1772352000, 1772353800)]
+    result = price_sessions(sessions, RATES, vectorized=False)
+    assert [priced['minutes'] for priced in result['sessions']] == [30.0, 30.0]
+    # Times are echoed as sent
+    assert result['sessions'][1]['start'] == 1772352000
+
+def test_total_is_the_sum_of_charges():
+    sessions = [session('o2', '2026-03-01T08:00:00', '2026-03-01T09:00:00', flow_rate=3),
+                session('iso', '2026-03-01T08:00:00', '2026-03-01T08:10:00')]
+    result = price_sessions(sessions, RATES, vectorized=False)
+    assert result['count'] == 2
+    assert result['total'] == 195.0 + 300.0
+    assert result['vectorized'] is False
+
+# ---------------------------------------------------------------------------
+# numpy and loop paths
+# ---------------------------------------------------------------------------
+
+def random_sessions(count: int, seed: int = 7) -> list:
+    generator = random.Random(seed)
+    sessions = []
+    for _ in range(count):
+        start = 1772352000 + generator.randint(0, 86400 * 30)
+        end = start + generator.randint(1, 86400 * 3)
+        if generator.random() < 0.5:
+            sessions.append(session('o2', start, end, flow_rate=round(generator.uniform(0.5, 15), 1)))
+        else:
+            sessions.append(session('iso', start, end))
+    return sessions
+
+def test_vectorized_and_loop_paths_agree():
+    pytest.importorskip('numpy')
+    sessions = random_sessions(2000)
+    vectorized = price_sessions(sessions, RATES, vectorized=True)
+    loop = price_sessions(sessions, RATES, vectorized=False)
+    assert vectorized['vectorized'] is True
+    assert [s['charge'] for s in vectorized['sessions']] == [s['charge'] for s in loop['sessions']]
+    assert [s['quantity'] for s in vectorized['sessions']] == [s['quantity'] for s in loop['sessions']]
+    assert vectorized['total'] == loop['total']
+
+def test_default_path_follows_numpy_availability(monkeypatch):
+    monkeypatch.setattr(metering, 'np', None)
+    result = price_sessions([session('iso', '2026-03-01T08:00:00', '2026-03-01T08:01:00')], RATES)
+    assert result['vectorized'] is False
+
+# ---------------------------------------------------------------------------
+# Errors
+# ---------------------------------------------------------------------------
+
+def test_end_must_be_after_start():
+    with pytest.raises(MeteringError) as raised:
+        price_sessions([session('iso', '2026-03-01T08:00:00', '2026-03-01T08:00:00'),
+                        session('o2', '2026-03-01T09:00:00', '2026-03-01T08:00:00')], RATES)
+    assert raised.value.errors == [{'index': 0, 'error': 'end must be after start'},
+                                   {'index': 1, 'error': 'end must be after start'}]
+    assert str(raised.value) == '2 of 2 sessions are invalid'
+
+def test_unknown_service():
+    with pytest.raises(MeteringError) as raised:
+        price_sessions([session('iso', '2026-03-01T08:00:00', '2026-03-01T09:00:00'),
+                        session('nitrous', '2026-03-01T08:00:00', '2026-03-01T09:00:00')], RATES)
+    assert [error['index'] for error in raised.value.errors] == [1]
+    assert "Unknown service 'nitrous'" in raised.value.errors[0]['error']
+
+def test_missing_fields_and_bad_flow_rate():
+    with pytest.raises(MeteringError) as raised:
+        price_sessions([{'service': 'iso', 'start': '2026-03-01T08:00:00'},
+                        session('o2', '2026-03-01T08:00:00', '2026-03-01T09:00:00', flow_rate=-1)], RATES)
+    assert raised.value.errors == [{'index': 0, 'error': "Missing field 'end'"},
+                                   {'index': 1, 'error': 'flow_rate must be positive'}]
+
+@pytest.mark.parametrize('sessions', [[], None, 'o2'])
+def test_sessions_must_be_a_non_empty_list(sessions):
+    with pytest.raises(MeteringError, match='non-empty list'):
+        price_sessions(sessions, RATES)
+
+def test_batch_limit():
+    sessions = [session('iso', '2026-03-01T08:00:00', '2026-03-01T09:00:00')] * (MAX_SESSIONS + 1)
+    with pytest.raises(MeteringError, match=f'At most {MAX_SESSIONS}'):
+        price_sessions(sessions, RATES)
+    assert price_sessions(sessions[:MAX_SESSIONS], RATES, vectorized=False)['count'] == MAX_SESSIONS
+
+# ---------------------------------------------------------------------------
+# Catalog rates
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def database(tmp_path):
+    from flask_database import HospitalDB
+    return HospitalDB(str(tmp_path / 'metering.db'))
+
+def test_load_rates_from_the_catalog(database):
+    rates = load_rates(database)
+    assert set(rates) == {'o2', 'iso'}
+    assert rates['o2']['unit_price'] == 65.0
+    assert rates['iso']['unit_price'] == 30.0
+    assert rates['o2']['unit'] == 'L'
+
+def test_load_rates_with_a_missing_item(database):
+    iso = next(item for item in database.get_items_by_category('O2, ISO') if item['name'] == 'ISO Service')
+    database.delete_item(iso['id'])
+    with pytest.raises(MeteringError, match="Catalog item 'ISO Service' in 'O2, ISO' is missing"):
+        load_rates(database)
+
+def test_rates_endpoint_reports_a_missing_item(app_client):
+    from database_backend import db
+    for item in db.get_items_by_category('O2, ISO'):
+        db.delete_item(item['id'])
+    response = app_client.get('/api/metering/rates')
+    assert response.status_code == 409
+    assert response.get_json()['success'] is False
+
+def test_price_endpoint(app_client):
+    response = app_client.post('/api/metering/price', json={'sessions': [
+        session('o2', '2026-03-01T08:00:00', '2026-03-01T10:00:00', flow_rate=2)]})
+    assert response.status_code == 200
+    assert response.get_json()['total'] == 260.0
+
+    response = app_client.post('/api/metering/price', json={'sessions': [
+        session('o2', '2026-03-01T10:00:00', '2026-03-01T08:00:00')]})
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == [{'index': 0, 'error': 'end must be after start'}]
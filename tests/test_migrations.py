@@ -0,0 +1,117 @@
+"""
+Tests for schema and data migrations (schema_migrations.py).
+"""
+
+import sqlite3
+
+import pytest
+
+from schema_migrations import (BackfillBillPatients, BaseMigrator, DataMigration, DataMigrationRunner,
+                               SQLAlchemyMigrator, SQLiteMigrator, latest_version)
+
+def user_version(path) -> int:
+    with sqlite3.connect(path) as conn:
+        return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def test_base_classes_are_abstract():
+    with pytest.raises(TypeError):
+        BaseMigrator()
+    with pytest.raises(TypeError):
+        DataMigration()
+
+# ---------------------------------------------------------------------------
+# Schema migrations
+# ---------------------------------------------------------------------------
+
+def test_fresh_sqlite_file_migrates_to_latest(tmp_path):
+    path = str(tmp_path / 'fresh.db')
+    migrator = SQLiteMigrator(path)
+    assert migrator.current_version() == 0
+
+    applied = migrator.migrate()
+    assert applied == [row['version'] for row in migrator.applied()]
+    assert applied[-1] == latest_version()
+    assert migrator.current_version() == latest_version()
+    assert user_version(path) == latest_version()
+    assert migrator.pending() == []
+
+def test_second_run_is_a_no_op(tmp_path):
+    path = str(tmp_path / 'twice.db')
+    SQLiteMigrator(path).migrate()
+    history = SQLiteMigrator(path).applied()
+
+    assert SQLiteMigrator(path).migrate() == []
+    assert SQLiteMigrator(path).applied() == history
+
+def test_migrate_stops_at_target(tmp_path):
+    migrator = SQLiteMigrator(str(tmp_path / 'target.db'))
+    assert migrator.migrate(target=2) == [1, 2]
+    assert migrator.current_version() == 2
+    assert migrator.migrate()[-1] == latest_version()
+
+def test_sqlalchemy_migrator_on_sqlite(tmp_path):
+    from sqlalchemy import create_engine
+    engine = create_engine(f"sqlite:///{tmp_path / 'engine.db'}")
+    try:
+        migrator = SQLAlchemyMigrator(engine)
+        assert migrator.migrate()[-1] == latest_version()
+        assert SQLAlchemyMigrator(engine).migrate() == []
+    finally:
+        engine.dispose()
+
+# ---------------------------------------------------------------------------
+# Data migrations
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def migrator(tmp_path):
+    migrator = SQLiteMigrator(str(tmp_path / 'data.db'))
+    migrator.migrate()
+    return migrator
+
+def insert_bills(migrator: SQLiteMigrator, rows):
+    with migrator.transaction() as conn:
+        for n, (patient_name, opd_number) in enumerate(rows, start=1):
+            conn.execute(
+                'INSERT INTO bills (bill_number, patient_name, opd_number, total_amount, patient_id) '
+                'VALUES (:bill_number, :patient_name, :opd_number, 10, NULL)',
+                {'bill_number': f'B-{n}', 'patient_name': patient_name, 'opd_number': opd_number})
+
+def bill_patients(migrator: SQLiteMigrator) -> list:
+    with migrator.transaction() as conn:
+        return [tuple(row) for row in conn.execute(
+            'SELECT b.bill_number, p.opd_number, p.name FROM bills b '
+            'LEFT JOIN patients p ON p.id = b.patient_id ORDER BY b.id')]
+
+def test_backfill_resumes_from_its_checkpoint(migrator):
+    insert_bills(migrator, [('Asha', 'OPD-1'), ('Ravi', 'OPD-2'), ('Asha K', ' OPD-1 '),
+                            ('Walk-in', ''), ('Meena', 'OPD-3')])
+    backfill = BackfillBillPatients()
+    backfill.batch_size = 2
+    runner = DataMigrationRunner(migrator)
+
+    checkpoint = runner.run(backfill, max_batches=1)
+    assert checkpoint == {'last_id': 2, 'rows_done': 2, 'status': 'running'}
+    assert [row[1] for row in bill_patients(migrator)] == ['OPD-1', 'OPD-2', None, None, None]
+
+    # A new runner picks up after id 2 instead of starting over
+    checkpoint = DataMigrationRunner(migrator).run(backfill)
+    assert checkpoint == {'last_id': 5, 'rows_done': 5, 'status': 'completed'}
+    assert runner.status(backfill.name)['status'] == 'completed'
+    assert bill_patients(migrator) == [
+        ('B-1', 'OPD-1', 'Asha K'),
+        ('B-2', 'OPD-2', 'Ravi'),
+        ('B-3', 'OPD-1', 'Asha K'),
+        ('B-4', None, None),
+        ('B-5', 'OPD-3', 'Meena'),
+    ]
+
+def test_completed_backfill_does_not_run_again(migrator):
+    insert_bills(migrator, [('Asha', 'OPD-1')])
+    runner = DataMigrationRunner(migrator)
+    assert runner.run(BackfillBillPatients())['status'] == 'completed'
+
+    with migrator.transaction() as conn:
+        conn.execute("INSERT INTO bills (bill_number, opd_number, total_amount) VALUES ('LATE', 'OPD-9', 1)")
+    assert runner.run(BackfillBillPatients())['rows_done'] == 1
+    assert bill_patients(migrator)[-1] == ('LATE', None, None)
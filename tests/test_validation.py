@@ -0,0 +1,195 @@
+"""
+Tests for the declarative payload validation in validation.py.
+"""
+
+import pytest
+
+from validation import (ValidationError, ITEM_VALIDATOR, BILL_VALIDATOR, MAX_ERRORS, MAX_EXTRA_KEYS,
+                        MAX_EXTRA_LENGTH, PayloadValidator, compile_schema)
+
+def item(**fields) -> dict:
+    return {'category': 'Lab', 'name': 'CBC', 'price': 250, **fields}
+
+def bill(**fields) -> dict:
+    return {'bill_number': 'B-1', 'total_amount': 10,
+            'items': [{'name': 'CBC', 'quantity': 2, 'price': 5, 'totalPrice': 10}], **fields}
+
+def errors_of(validator, payload) -> list:
+    with pytest.raises(ValidationError) as raised:
+        validator.validate(payload)
+    return raised.value.errors
+
+# ---------------------------------------------------------------------------
+# Numbers
+# ---------------------------------------------------------------------------
+
+def test_numbers_keep_their_json_type():
+    cleaned = ITEM_VALIDATOR.validate(item(price=250))
+    assert cleaned['price'] == 250 and type(cleaned['price']) is int
+    cleaned = ITEM_VALIDATOR.validate(item(price=2.5))
+    assert cleaned['price'] == 2.5 and type(cleaned['price']) is float
+
+    line = BILL_VALIDATOR.validate(bill())['items'][0]
+    assert type(line['quantity']) is int
+    assert type(line['price']) is int
+
+@pytest.mark.parametrize('text, expected, kind', [
+    ('250', 250, int),
+    (' 12 ', 12, int),
+    ('2.5', 2.5, float),
+    ('1e3', 1000.0, float),
+])
+def test_numeric_strings_are_parsed(text, expected, kind):
+    price = ITEM_VALIDATOR.validate(item(price=text))['price']
+    assert price == expected
+    assert type(price) is kind
+
+@pytest.mark.parametrize('value', ['abc', '', True, [1], {'a': 1}, float('nan'), float('inf'), 'nan', 'inf'])
+def test_non_numbers_are_rejected(value):
+    assert errors_of(ITEM_VALIDATOR, item(price=value)) == [{'field': 'price', 'error': 'must be a number'}]
+
+def test_number_bounds():
+    assert errors_of(ITEM_VALIDATOR, item(price=-1)) == [{'field': 'price', 'error': 'must be at least 0'}]
+    validate = compile_schema({'n': {'type': 'number', 'maximum': 10}})
+    errors = []
+    validate({'n': 11}, errors)
+    assert errors == [{'field': 'n', 'error': 'must be at most 10'}]
+
+def test_integer_fields():
+    assert ITEM_VALIDATOR.validate(item(id='7'))['id'] == 7
+    cleaned = ITEM_VALIDATOR.validate(item(id=7.0))
+    assert cleaned['id'] == 7 and type(cleaned['id']) is int
+    assert errors_of(ITEM_VALIDATOR, item(id=7.5)) == [{'field': 'id', 'error': 'must be an integer'}]
+    assert errors_of(ITEM_VALIDATOR, item(id=0)) == [{'field': 'id', 'error': 'must be at least 1'}]
+
+# ---------------------------------------------------------------------------
+# Strings and datetimes
+# ---------------------------------------------------------------------------
+
+def test_strings():
+    assert ITEM_VALIDATOR.validate(item(strength=500))['strength'] == '500'
+    assert errors_of(ITEM_VALIDATOR, item(name='   ')) == [{'field': 'name', 'error': 'must not be empty'}]
+    assert errors_of(ITEM_VALIDATOR, item(name='x' * 256)) == [
+        {'field': 'name', 'error': 'must be at most 255 characters'}]
+    assert errors_of(ITEM_VALIDATOR, item(name=['CBC'])) == [{'field': 'name', 'error': 'must be a string'}]
+
+def test_required_and_null_fields():
+    errors = errors_of(ITEM_VALIDATOR, {'category': 'Lab'})
+    assert errors == [{'field': 'name', 'error': 'is required'}, {'field': 'price', 'error': 'is required'}]
+    # Optional fields keep an explicit null; absent ones stay absent
+    cleaned = ITEM_VALIDATOR.validate(item(description=None))
+    assert cleaned['description'] is None
+    assert 'type' not in cleaned
+
+    validate = compile_schema({'n': {'type': 'number', 'nullable': False}})
+    errors = []
+    validate({'n': None}, errors)
+    assert errors == [{'field': 'n', 'error': 'must not be null'}]
+
+@pytest.mark.parametrize('value, expected', [
+    ('2026-03-01T10:00:00', '2026-03-01T10:00:00'),
+    ('2026-03-01T10:00:00Z', '2026-03-01T10:00:00'),
+    ('2026-03-01T16:00:00+06:00', '2026-03-01T10:00:00'),
+    (0, '1970-01-01T00:00:00'),
+])
+def test_datetimes_are_normalized_to_naive_utc(value, expected):
+    validate = compile_schema({'at': {'type': 'datetime'}})
+    errors = []
+    assert validate({'at': value}, errors) == {'at': expected}
+    assert errors == []
+
+def test_bad_datetimes_are_rejected():
+    validate = compile_schema({'at': {'type': 'datetime'}})
+    errors = []
+    validate({'at': 'yesterday'}, errors)
+    assert errors == [{'field': 'at', 'error': 'must be an ISO 8601 date or time'}]
+
+def test_unknown_rule_type():
+    with pytest.raises(ValueError):
+        compile_schema({'n': {'type': 'decimal'}})
+
+# ---------------------------------------------------------------------------
+# Extra keys and cut-offs
+# ---------------------------------------------------------------------------
+
+def test_unknown_keys_are_dropped_from_items():
+    assert 'internal' not in ITEM_VALIDATOR.validate(item(internal='x'))
+
+def test_scalar_extra_keys_are_kept_on_bill_lines():
+    line = {'name': 'CBC', 'uid': 'row-1', 'selected': True, 'rank': 3, 'note': None}
+    cleaned = BILL_VALIDATOR.validate(bill(items=[line]))['items'][0]
+    assert cleaned == line
+
+def test_extra_keys_must_be_short_scalars():
+    errors = errors_of(BILL_VALIDATOR, bill(items=[{'name': 'CBC', 'meta': {'a': 1},
+                                                     'note': 'x' * (MAX_EXTRA_LENGTH + 1)}]))
+    assert [error['field'] for error in errors] == ['items[0].meta', 'items[0].note']
+
+def test_too_many_extra_keys():
+    line = {'name': 'CBC', **{f'extra{n}': n for n in range(MAX_EXTRA_KEYS + 1)}}
+    errors = errors_of(BILL_VALIDATOR, bill(items=[line]))
+    assert errors == [{'field': 'items[0]', 'error': f'has more than {MAX_EXTRA_KEYS} extra keys'}]
+
+def test_errors_stop_at_max_errors():
+    lines = [{'name': '', 'price': 'x'} for _ in range(MAX_ERRORS)]
+    errors = errors_of(BILL_VALIDATOR, bill(items=lines))
+    assert len(errors) == MAX_ERRORS
+    assert errors[0] == {'field': 'items[0].name', 'error': 'must not be empty'}
+
+def test_error_message_names_the_first_problem():
+    with pytest.raises(ValidationError) as raised:
+        ITEM_VALIDATOR.validate({'category': 'Lab', 'price': 'x'})
+    assert str(raised.value) == 'Invalid item: name is required (and 1 more)'
+
+def test_payload_must_be_an_object():
+    assert errors_of(ITEM_VALIDATOR, ['not', 'an', 'object']) == [{'field': '(body)', 'error': 'must be an object'}]
+
+# ---------------------------------------------------------------------------
+# Batches
+# ---------------------------------------------------------------------------
+
+def test_validate_many_names_the_row():
+    rows = [item(), item(), item(), item(price='x')]
+    with pytest.raises(ValidationError) as raised:
+        ITEM_VALIDATOR.validate_many(rows, 'items')
+    assert raised.value.errors == [{'field': 'items[3].price', 'error': 'must be a number'}]
+    assert str(raised.value) == 'Invalid item: items[3].price must be a number'
+
+def test_validate_many_nested_paths():
+    bills = [bill(), bill(items=[{'name': 'CBC'}, {'name': 'X', 'price': 'free'}])]
+    with pytest.raises(ValidationError) as raised:
+        BILL_VALIDATOR.validate_many(bills, 'bills')
+    assert raised.value.errors == [{'field': 'bills[1].items[1].price', 'error': 'must be a number'}]
+
+@pytest.mark.parametrize('payloads', [[], None, {'a': 1}])
+def test_validate_many_needs_a_list(payloads):
+    with pytest.raises(ValidationError) as raised:
+        ITEM_VALIDATOR.validate_many(payloads, 'items')
+    assert raised.value.errors == [{'field': 'items', 'error': 'must be a non-empty list'}]
+
+def test_validate_many_batch_limit(monkeypatch):
+    import validation
+    monkeypatch.setattr(validation, 'MAX_BATCH_ROWS', 2)
+    with pytest.raises(ValidationError):
+        PayloadValidator(validation.ITEM_SCHEMA, 'item').validate_many([item()] * 3, 'items')
+
+# ---------------------------------------------------------------------------
+# Endpoint
+# ---------------------------------------------------------------------------
+
+def test_invalid_bill_is_answered_with_400(app_client):
+    response = app_client.post('/api/bills', json=bill(total_amount='lots', items=[{'price': 5}]))
+    assert response.status_code == 400
+    body = response.get_json()
+    assert body['success'] is False
+    assert body['errors'] == [{'field': 'total_amount', 'error': 'must be a number'},
+                              {'field': 'items[0].name', 'error': 'is required'}]
+    assert body['message'] == 'Request payload failed validation'
+
+def test_valid_bill_keeps_integer_quantities(app_client):
+    response = app_client.post('/api/bills', json=bill(total_amount='10'))
+    assert response.status_code == 201
+    bill_id = response.get_json()['bill_id']
+    saved = next(b for b in app_client.get('/api/bills').get_json()['bills'] if b['id'] == bill_id)
+    line = saved['items'][0]
+    assert line['quantity'] == 2 and isinstance(line['quantity'], int)
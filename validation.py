@@ -0,0 +1,271 @@
+
+import os
+import math
+import logging
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Size limits for write payloads
+MAX_BILL_LINES = int(os.getenv('VALIDATION_MAX_BILL_LINES', 500))
+MAX_BATCH_ROWS = int(os.getenv('VALIDATION_MAX_BATCH_ROWS', 10000))
+# Line items may carry client keys beyond the declared ones (ids, UI markers), but only scalars
+MAX_EXTRA_KEYS = 16
+MAX_EXTRA_LENGTH = 255
+
+# Errors reported per payload before validation stops collecting
+MAX_ERRORS = 20
+
+# Declarative schemas: field name -> rule. Rules take a 'type' (string,
+# number, integer, datetime, list) plus 'required', 'nullable', 'min_length',
+# 'max_length', 'minimum', 'maximum', and for lists 'max_items' and 'schema'.
+ITEM_SCHEMA = {
+    'id': {'type': 'integer', 'minimum': 1},
+    'category': {'type': 'string', 'required': True, 'min_length': 1, 'max_length': 100},
+    'name': {'type': 'string', 'required': True, 'min_length': 1, 'max_length': 255},
+    'type': {'type': 'string', 'max_length': 100},
+    'strength': {'type': 'string', 'max_length': 100},
+    'price': {'type': 'number', 'required': True, 'minimum': 0},
+    'description': {'type': 'string', 'max_length': 2000}
+}
+
+BILL_LINE_SCHEMA = {
+    'category': {'type': 'string', 'max_length': 100},
+    'name': {'type': 'string', 'required': True, 'min_length': 1, 'max_length': 255},
+    'type': {'type': 'string', 'max_length': 100},
+    'strength': {'type': 'string', 'max_length': 500},
+    'quantity': {'type': 'number', 'minimum': 0},
+    'price': {'type': 'number'},
+    'totalPrice': {'type': 'number'},
+    'description': {'type': 'string', 'max_length': 2000}
+}
+
+BILL_SCHEMA = {
+    # Optional here: bills without a number get one from the server-side sequence
+    'bill_number': {'type': 'string', 'min_length': 1, 'max_length': 50},
+    'department': {'type': 'string', 'max_length': 50},
+    'patient_name': {'type': 'string', 'max_length': 255},
+    'opd_number': {'type': 'string', 'max_length': 50},
+    'total_amount': {'type': 'number', 'required': True, 'minimum': 0},
+    'items': {'type': 'list', 'required': True, 'max_items': MAX_BILL_LINES, 'schema': BILL_LINE_SCHEMA,
+              'extra': 'scalar'}
+}
+
+class ValidationError(ValueError):
+    """Payload does not match its schema; errors lists {'field', 'error'} entries"""
+
+    def __init__(self, message: str, errors: Optional[List[Dict]] = None):
+        super().__init__(message)
+        self.errors = errors or []
+
+class _Invalid(Exception):
+    """Raised by a field checker; carries the reason for one field"""
+
+def _check_string(rule: Dict) -> Callable:
+    min_length, max_length = rule.get('min_length'), rule.get('max_length')
+
+    def check(value):
+        if type(value) is not str:
+            if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                raise _Invalid('must be a string')
+            value = str(value)
+        if min_length is not None and len(value.strip()) < min_length:
+            raise _Invalid('must not be empty' if min_length == 1 else f'must be at least {min_length} characters')
+        if max_length is not None and len(value) > max_length:
+            raise _Invalid(f'must be at most {max_length} characters')
+        return value
+    return check
+
+def _check_number(rule: Dict, integer: bool = False) -> Callable:
+    minimum, maximum = rule.get('minimum'), rule.get('maximum')
+    kind = 'an integer' if integer else 'a number'
+
+    def check(value):
+        # Numbers keep their JSON type (2 stays 2, 2.5 stays 2.5); only numeric strings are converted
+        kind_of = type(value)
+        if kind_of is float or kind_of is int:
+            pass
+        elif kind_of is bool:
+            raise _Invalid(f'must be {kind}')
+        elif isinstance(value, str):
+            text = value.strip()
+            try:
+                value = int(text)
+            except ValueError:
+                try:
+                    value = float(text)
+                except ValueError:
+                    raise _Invalid(f'must be {kind}')
+        elif not isinstance(value, (int, float)):
+            raise _Invalid(f'must be {kind}')
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                raise _Invalid(f'must be {kind}')
+            if integer:
+                if value != int(value):
+                    raise _Invalid(f'must be {kind}')
+                value = int(value)
+        if minimum is not None and value < minimum:
+            raise _Invalid(f'must be at least {minimum}')
+        if maximum is not None and value > maximum:
+            raise _Invalid(f'must be at most {maximum}')
+        return value
+    return check
+
+def _check_datetime(rule: Dict) -> Callable:
+    """ISO 8601 text or epoch seconds, normalized to naive UTC ISO text"""
+    def check(value):
+        try:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                parsed = datetime.fromtimestamp(value, timezone.utc)
+            else:
+                parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except (TypeError, ValueError, OverflowError, OSError):
+            raise _Invalid('must be an ISO 8601 date or time')
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed.isoformat()
+    return check
+
+def _check_list(rule: Dict) -> Callable:
+    max_items = rule.get('max_items')
+    validate_row = compile_schema(rule['schema'], extra=rule.get('extra', 'drop'))
+
+    def check(value, errors, path):
+        if not isinstance(value, list):
+            raise _Invalid('must be a list')
+        if max_items is not None and len(value) > max_items:
+            raise _Invalid(f'must have at most {max_items} entries')
+        rows = []
+        for index, row in enumerate(value):
+            rows.append(validate_row(row, errors, f'{path}[{index}]'))
+            if len(errors) >= MAX_ERRORS:
+                break
+        return rows
+    check.nested = True
+    return check
+
+_CHECKERS = {
+    'string': _check_string,
+    'number': _check_number,
+    'integer': lambda rule: _check_number(rule, integer=True),
+    'datetime': _check_datetime,
+    'list': _check_list
+}
+
+def _check_extra(value):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str) and len(value) <= MAX_EXTRA_LENGTH:
+        return value
+    raise _Invalid(f'must be a number, boolean or string of at most {MAX_EXTRA_LENGTH} characters')
+
+def compile_schema(schema: Dict[str, Dict], extra: str = 'drop') -> Callable:
+    """Compile a schema once into a validator(payload, errors, path) returning the cleaned dict.
+
+    Each rule becomes a specialized checker up front, so validating a payload
+    is one pass over a tuple of (name, required, nullable, checker, nested). Unknown
+    keys are dropped, or with extra='scalar' kept when they hold scalars.
+    Problems are appended to errors as {'field', 'error'} entries.
+    """
+    fields = []
+    for name, rule in schema.items():
+        if rule['type'] not in _CHECKERS:
+            raise ValueError(f"Unknown type '{rule['type']}' for field '{name}'")
+        check = _CHECKERS[rule['type']](rule)
+        fields.append((name, rule.get('required', False), rule.get('nullable', True), check,
+                       getattr(check, 'nested', False)))
+    fields = tuple(fields)
+    declared = frozenset(schema)
+    keep_extra = extra == 'scalar'
+
+    def validate(payload, errors: List[Dict], path: str = '') -> Optional[Dict]:
+        prefix = f'{path}.' if path else ''
+        if not isinstance(payload, dict):
+            errors.append({'field': path or '(body)', 'error': 'must be an object'})
+            return None
+        cleaned = {}
+        for name, required, nullable, check, nested in fields:
+            value = payload.get(name)
+            if value is None:
+                if name in payload and not nullable:
+                    errors.append({'field': prefix + name, 'error': 'must not be null'})
+                elif required:
+                    errors.append({'field': prefix + name, 'error': 'is required'})
+                elif name in payload:
+                    cleaned[name] = None
+                continue
+            try:
+                if nested:
+                    cleaned[name] = check(value, errors, prefix + name)
+                else:
+                    cleaned[name] = check(value)
+            except _Invalid as e:
+                errors.append({'field': prefix + name, 'error': str(e)})
+        if keep_extra and len(payload) > len(cleaned):
+            extras = [key for key in payload if key not in declared]
+            if len(extras) > MAX_EXTRA_KEYS:
+                errors.append({'field': path or '(body)', 'error': f'has more than {MAX_EXTRA_KEYS} extra keys'})
+            else:
+                for key in extras:
+                    try:
+                        cleaned[key] = _check_extra(payload[key])
+                    except _Invalid as e:
+                        errors.append({'field': prefix + str(key), 'error': str(e)})
+        return cleaned
+    return validate
+
+def _raise_errors(errors: List[Dict], label: str):
+    errors = errors[:MAX_ERRORS]
+    first = errors[0]
+    more = f' (and {len(errors) - 1} more)' if len(errors) > 1 else ''
+    raise ValidationError(f"Invalid {label}: {first['field']} {first['error']}{more}", errors)
+
+class PayloadValidator:
+    """A compiled schema with single and batch entry points"""
+
+    def __init__(self, schema: Dict[str, Dict], label: str):
+        self.label = label
+        self._validate = compile_schema(schema)
+
+    def validate(self, payload: Any) -> Dict:
+        """Cleaned, coerced copy of payload, or ValidationError listing every problem"""
+        errors = []
+        cleaned = self._validate(payload, errors)
+        if errors:
+            _raise_errors(errors, self.label)
+        return cleaned
+
+    def validate_many(self, payloads: Any, key: str) -> List[Dict]:
+        """Validate a batch; errors name the row, e.g. 'items[3].price'"""
+        if not isinstance(payloads, list) or not payloads:
+            raise ValidationError(f'"{key}" must be a non-empty list',
+                                  [{'field': key, 'error': 'must be a non-empty list'}])
+        if len(payloads) > MAX_BATCH_ROWS:
+            raise ValidationError(f'At most {MAX_BATCH_ROWS} {key} can be saved at once',
+                                  [{'field': key, 'error': f'must have at most {MAX_BATCH_ROWS} entries'}])
+        errors = []
+        cleaned = []
+        for index, payload in enumerate(payloads):
+            cleaned.append(self._validate(payload, errors, f'{key}[{index}]'))
+            if len(errors) >= MAX_ERRORS:
+                break
+        if errors:
+            _raise_errors(errors, self.label)
+        return cleaned
+
+# Compiled once at import, shared by the single and batch write endpoints
+ITEM_VALIDATOR = PayloadValidator(ITEM_SCHEMA, 'item')
+BILL_VALIDATOR = PayloadValidator(BILL_SCHEMA, 'bill')
+
+def validation_error_response(error: ValidationError) -> Dict:
+    """Response body for a rejected payload"""
+    return {
+        'success': False,
+        'error': str(error),
+        'errors': error.errors,
+        'message': 'Request payload failed validation'
+    }
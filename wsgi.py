@@ -15,8 +15,10 @@ load_dotenv()
 # Add current directory to Python path
 sys.path.insert(0, os.path.dirname(__file__))
 
-# Import the Flask application
-from main import app
+# Import the Flask application and run its startup sequence
+from main import create_app
+
+app = create_app()
 
 # Configure for production
 if os.getenv('FLASK_ENV') == 'production':